@@ -1,27 +1,122 @@
 import nidaqmx
+import numpy as np
 # import sys
 
+NUM_CHANNELS = 32 # ao0 to ao31
+V_MIN = 0
+V_MAX = 10
+
 class voltageSetter:
-    
-    def __init__(self, devName='PXI1Slot2'):
+
+    # args: devName: NI device name
+    #       daqmx: module providing Task and constants, nidaqmx or a mock of it
+    def __init__(self, devName='PXI1Slot2', daqmx=nidaqmx):
         self.devName = devName
+        self.daqmx = daqmx
+        self.task = None # persistent task over self.channels, see open
+        self.channels = []
+        self.voltages = None # last voltages written to self.channels, NaN if not written yet
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Opens one task over several analog outputs that stays open for
+    # setVoltages and writeTable, instead of a task per write
+    # args: channels: channel numbers, e.g. range(32) for ao0 to ao31
+    #       voltages: one voltage per channel to write right away. Without it
+    #                 the outputs are left as they are until written.
+    def open(self, channels=range(NUM_CHANNELS), min_val=V_MIN, max_val=V_MAX, voltages=None):
+        self.close()
+        self.channels = list(channels)
+        self.task = self.daqmx.Task()
+        for ch in self.channels:
+            self.task.ao_channels.add_ao_voltage_chan(
+                self.devName+'/ao'+str(ch),
+                'ao'+str(ch),
+                min_val,
+                max_val
+                )
+        # The outputs keep whatever they were set to before, which isn't known
+        self.voltages = np.full(len(self.channels), np.nan)
+        if voltages is not None:
+            self.setVoltages(voltages)
+
+    def close(self):
+        if self.task is not None:
+            self.task.close()
+            self.task = None
+
+    # Sets every channel of the open task in one driver call
+    # args: voltages: one voltage per channel, in the order given to open
+    def setVoltages(self, voltages):
+        if self.task is None:
+            self.open()
+        voltages = np.asarray(voltages, dtype=np.float64)
+        if voltages.shape != (len(self.channels),):
+            raise ValueError("Need {} voltages, got {}".format(len(self.channels), voltages.shape))
+        self.task.write(voltages.tolist(), auto_start=True)
+        self.voltages = voltages
+
+    # Outputs a table of voltages clocked by the device, e.g. a bias sweep,
+    # and returns when it's done. The outputs stay at the last row.
+    # args: table: array of shape (samples, channels)
+    #       rate: rows per second
+    #       timeout: s to wait, by default the table length plus 10 s
+    def writeTable(self, table, rate, timeout=None):
+        if self.task is None:
+            self.open()
+        table = np.asarray(table, dtype=np.float64)
+        if table.ndim != 2 or table.shape[1] != len(self.channels) or len(table) < 2:
+            raise ValueError("Need a table of shape (samples >= 2, {})".format(len(self.channels)))
+        if timeout is None:
+            timeout = len(table)/rate + 10
+        constants = self.daqmx.constants
+        self.task.stop()
+        self.task.timing.cfg_samp_clk_timing(
+            rate,
+            sample_mode=constants.AcquisitionType.FINITE,
+            samps_per_chan=len(table)
+            )
+        try:
+            # one row per channel, one column per sample
+            self.task.write(table.T.tolist(), auto_start=False)
+            self.task.start()
+            self.task.wait_until_done(timeout=timeout)
+        finally:
+            self.task.stop()
+            self.task.timing.samp_timing_type = constants.SampleTimingType.ON_DEMAND
+        self.voltages = table[-1]
 
     def setVoltage(self, portID='a0', voltageOut=0):
-        with nidaqmx.Task() as task:
+        index = None
+        if self.task is not None and portID.startswith('ao') and int(portID[2:]) in self.channels:
+            index = self.channels.index(int(portID[2:]))
+            voltages = self.voltages.copy()
+            voltages[index] = voltageOut
+            # Through the open task once every channel is known, a write of
+            # the task sets all of them. Until then the task was never
+            # started, so a task of its own can write the channel.
+            if not np.isnan(voltages).any():
+                self.setVoltages(voltages)
+                return
+        with self.daqmx.Task() as task:
             task.ao_channels.add_ao_voltage_chan(
                 self.devName+'/'+portID,
                 portID,
-                0, 
+                0,
                 10
                 )
             task.start()
             task.write(voltageOut)
             task.stop()
+        if index is not None:
+            self.voltages[index] = voltageOut
 
 # if __name__ == "__main__":
 #     v_bias = .0
-#     vs = voltageSetter();
-#     for ch in range(0,32):
-#         vs.setVoltage('ao'+str(ch), v_bias)
+#     with voltageSetter() as vs:
+#         vs.setVoltages([v_bias]*NUM_CHANNELS)
 #     sys.exit(0)
-        
\ No newline at end of file
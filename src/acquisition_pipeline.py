@@ -0,0 +1,220 @@
+"""Pipelined angular sweeps: transfer and storage overlap the next move.
+
+A step of an angular sweep is move, settle, sweep, transfer (reading the
+traces over GPIB) and store. Done one after the other the stage waits for
+the transfer and the disk, and the VNA waits for the stage. The pipeline
+keeps the physical order (the stage never moves during a sweep, and the
+next sweep starts only after the stage has settled) but runs the transfer
+of angle N on a thread while the stage moves to angle N+1, and stores on
+another thread:
+
+    main thread      move+settle N | sweep N | move+settle N+1 | sweep N+1
+    transfer thread                          | transfer N      |
+    store thread                                      | store N         |
+
+The next sweep also waits for the previous transfer, since a sweep
+overwrites the traces still being read.
+
+Example:
+    sched = SettleScheduler(MotionModel.for_stage(stage))
+    pipe = AcquisitionPipeline(
+        move=stage_mover(stage, sched),
+        sweep=v.sweep,
+        transfer=vna_transfer(v, {"S12": "CHAN2", "S21": "CHAN3"}),
+        store=lambda angle, traces: writer.write_csv(...),
+    )
+    pipe.run(np.arange(-70, 70.5, 0.5))
+    print(pipe.timing.report())
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+MOVE = "move"
+SWEEP = "sweep"
+TRANSFER = "transfer"
+STORE = "store"
+WAIT_TRANSFER = "wait transfer"
+WAIT_STORE = "wait store"
+DRAIN = "drain"  # waiting for the last transfer and stores after the sweep
+STAGES = (MOVE, SWEEP, TRANSFER, STORE, WAIT_TRANSFER, WAIT_STORE, DRAIN)
+WAIT_TOLERANCE = 0.01  # waits below this fraction of the total don't count
+
+
+class PipelineTiming:
+    """Time spent in each stage of a pipelined sweep."""
+
+    def __init__(self):
+        self.times = {stage: [] for stage in STAGES}
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, stage, seconds):
+        self.times[stage].append(seconds)
+
+    def busy(self, stage):
+        """Returns the total time in s spent in stage."""
+        return float(np.sum(self.times[stage]))
+
+    def bottleneck(self):
+        """Returns the name of the resource that bounds the throughput.
+
+        The main thread (motion and sweeps) is the bottleneck when it never
+        waits for the others (less than WAIT_TOLERANCE of the total),
+        otherwise it's the thread it waited for most.
+        """
+        waited = {TRANSFER: self.busy(WAIT_TRANSFER), STORE: self.busy(WAIT_STORE)}
+        most = max(waited, key=waited.get)
+        if waited[most] <= WAIT_TOLERANCE * self.total:
+            return "stage + sweep"
+        return most
+
+    def report(self):
+        """Returns a table of the time per stage."""
+        lines = ["{:14s} {:>9s} {:>9s} {:>9s}".format("stage", "total s", "mean s", "max s")]
+        for stage in STAGES:
+            t = self.times[stage]
+            if t:
+                lines.append(
+                    "{:14s} {:9.3f} {:9.3f} {:9.3f}".format(
+                        stage, np.sum(t), np.mean(t), np.max(t)
+                    )
+                )
+        if self.count:
+            lines.append(
+                "{} angles in {:.2f} s, {:.3f} s per angle, bound by {}".format(
+                    self.count, self.total, self.total / self.count, self.bottleneck()
+                )
+            )
+        return "\n".join(lines)
+
+
+def timed(timing, stage, function, *args):
+    """Calls function(*args) and adds its duration to timing."""
+    t0 = time.perf_counter()
+    result = function(*args)
+    timing.add(stage, time.perf_counter() - t0)
+    return result
+
+
+def stage_mover(stage, sched):
+    """Returns a move function for AcquisitionPipeline using a rotaryStage.
+
+    Moves are run through the SettleScheduler, so they include its settle
+    time and are recorded in its report.
+    """
+
+    def move(degrees):
+        if degrees > 0:
+            return sched.run_move(degrees, lambda: stage.step_ccw(degrees, wait=True))
+        return sched.run_move(-degrees, lambda: stage.step_cw(-degrees, wait=True))
+
+    return move
+
+
+def vna_transfer(vna, channels):
+    """Returns a transfer function reading complex traces from a VNA.
+
+    Args:
+        vna (VNA): connected VNA
+        channels (dict): name to channel, e.g. {"S21": "CHAN3"}
+    """
+
+    def transfer():
+        return {name: vna.get_complex(chan) for name, chan in channels.items()}
+
+    return transfer
+
+
+class AcquisitionPipeline:
+    """Runs angular sweeps with transfer and storage overlapping motion."""
+
+    def __init__(self, move, sweep, transfer, store, max_pending=4):
+        """Initializes with given params.
+
+        Args:
+            move (function): move(degrees) moves by degrees (positive is
+                increasing angle) and returns once the stage has settled
+            sweep (function): sweep() triggers a measurement and returns when
+                it's complete, e.g. VNA.sweep
+            transfer (function): transfer() reads the measurement and returns
+                it, e.g. from vna_transfer. Must not trigger a new one.
+            store (function): store(angle, data) saves a measurement
+            max_pending (int): measurements that can wait to be stored
+                before the sweep blocks
+        """
+        self.move = move
+        self.sweep = sweep
+        self.transfer = transfer
+        self.store = store
+        self.max_pending = max_pending
+        self.timing = PipelineTiming()
+
+    def run(self, angles):
+        """Measures at each angle in order, the stage must be at angles[0].
+
+        Returns the number of angles measured. Errors from the transfer or
+        store threads are raised here, after the stage has stopped.
+        """
+        self.timing = timing = PipelineTiming()
+        start = time.perf_counter()
+        transfers = ThreadPoolExecutor(1, thread_name_prefix="transfer")
+        stores = ThreadPoolExecutor(1, thread_name_prefix="store")
+        pending = []  # store futures, oldest first
+        transfer = None
+        try:
+            for i, angle in enumerate(angles):
+                if i:
+                    timed(timing, MOVE, self.move, angle - angles[i - 1])
+                if transfer is not None:
+                    # The sweep would overwrite the traces being read
+                    timed(timing, WAIT_TRANSFER, transfer.result)
+                while len(pending) >= self.max_pending:
+                    timed(timing, WAIT_STORE, pending.pop(0).result)
+                timed(timing, SWEEP, self.sweep)
+                transfer = transfers.submit(self.transfer_and_store, stores, pending, angle)
+                timing.count += 1
+            if transfer is not None:
+                timed(timing, DRAIN, transfer.result)
+            for f in pending:
+                timed(timing, DRAIN, f.result)
+        finally:
+            transfers.shutdown()
+            stores.shutdown()
+            timing.total = time.perf_counter() - start
+        return timing.count
+
+    def transfer_and_store(self, stores, pending, angle):
+        """Runs on the transfer thread: reads a measurement, queues its store."""
+        data = timed(self.timing, TRANSFER, self.transfer)
+        pending.append(stores.submit(timed, self.timing, STORE, self.store, angle, data))
+
+
+if __name__ == "__main__":
+    # Times a sweep against the simulated stage and VNA, with a sleep
+    # standing in for the disk, and compares it with running the stages in
+    # order
+    from motion_scheduler import MotionModel, SettleScheduler
+    from rotary_stage import rotaryStage
+    from stage_simulator import SimulatedArduino
+    from vna import VNA, FreqSweepParams
+    from vna_simulator import SimulatedVNA
+
+    STORE_TIME = 0.15
+    angles = np.arange(0, 5.5, 0.5)
+    stage = rotaryStage("SIM", arduino=SimulatedArduino())
+    sched = SettleScheduler(MotionModel.for_stage(stage), settle_time=0.1)
+    v = VNA()
+    v.connect(16, resource=SimulatedVNA())
+    v.set_sweep_params(FreqSweepParams(8e9, 12e9, 801, -10, 1, []))
+    pipe = AcquisitionPipeline(
+        move=stage_mover(stage, sched),
+        sweep=v.sweep,
+        transfer=vna_transfer(v, {"S12": "CHAN2", "S21": "CHAN3"}),
+        store=lambda angle, data: time.sleep(STORE_TIME),
+    )
+    pipe.run(angles)
+    print(pipe.timing.report())
+    sequential = sum(pipe.timing.busy(s) for s in (MOVE, SWEEP, TRANSFER)) + len(angles) * STORE_TIME
+    print("in order: about {:.2f} s".format(sequential))
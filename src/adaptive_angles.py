@@ -0,0 +1,194 @@
+"""Adaptive angular sampling: refine the grid only where the pattern changes.
+
+A uniform grid fine enough for the nulls and sidelobes of a pattern wastes
+most of its stops on the main lobe and other smooth regions. An
+AdaptiveAngularSweep measures a coarse grid first, then adds the midpoint
+of every interval whose two ends differ by more than a threshold, or next
+to an angle whose response is more than the threshold off the straight
+line between its neighbours (a peak or dip the ends alone wouldn't show).
+This repeats until no interval needs splitting or the intervals reach
+min_step.
+
+The response can be anything measure returns: a VNA trace (the change is
+the largest dB difference over frequency) or a scalar like the scope
+current of angular_sweep.py. Responses more than dynamic_range dB below
+the peak are clipped before comparing, so the steep dB slopes into deep
+nulls don't use up all the extra stops. Each refinement pass visits its
+new angles in one direction, alternating between passes, so the stage
+doesn't go back and forth.
+
+Example:
+    sched = SettleScheduler(MotionModel.for_stage(stage))
+    sweep = AdaptiveAngularSweep(
+        move=stage_mover(stage, sched),
+        measure=lambda: vna_acquire(v, {"S21": "CHAN3"})()["S21"],
+        min_step=0.1,
+        threshold=1.0,
+    )
+    angles, data = sweep.run(-70, 70, coarse_step=5, start_angle=-70)
+"""
+import numpy as np
+
+THRESHOLD = 1.0  # dB between neighbouring angles before refining
+DYNAMIC_RANGE = 40.0  # dB below the peak that differences are ignored
+STEPS_PER_DEGREE = 800  # rotaryStage.cal
+
+
+def to_db(a, floor=-np.inf):
+    """Returns a response in dB, clipped to floor."""
+    with np.errstate(divide="ignore"):
+        return np.maximum(20 * np.log10(np.abs(np.asarray(a))), floor)
+
+
+def db_changes(angles, levels):
+    """Returns how much each interval needs refining, from responses in dB.
+
+    The change of an interval is the larger of the difference between its
+    ends and how far either end is off the line between its own neighbours.
+
+    Args:
+        angles (np.ndarray): measured angles, sorted
+        levels (np.ndarray): response in dB at each angle, one row per angle
+    """
+    levels = np.asarray(levels).reshape(len(angles), -1)
+    changes = np.max(np.abs(np.diff(levels, axis=0)), axis=1)
+    if len(angles) > 2:
+        w = ((angles[1:-1] - angles[:-2]) / (angles[2:] - angles[:-2]))[:, None]
+        line = levels[:-2] * (1 - w) + levels[2:] * w
+        off = np.max(np.abs(levels[1:-1] - line), axis=1)
+        changes[:-1] = np.maximum(changes[:-1], off)
+        changes[1:] = np.maximum(changes[1:], off)
+    return changes
+
+
+def refine(angles, changes, threshold, min_step):
+    """Returns the midpoints of intervals that need refining.
+
+    Args:
+        angles (np.ndarray): measured angles, sorted
+        changes (np.ndarray): change of each interval between neighbours
+        threshold (float): change above which an interval is split
+        min_step (float): intervals this small or smaller aren't split
+    """
+    widths = np.diff(angles)
+    split = (changes > threshold) & (widths / 2 >= min_step - 1e-9)
+    return (angles[:-1][split] + angles[1:][split]) / 2
+
+
+class AdaptiveAngularSweep:
+    """Measures a pattern, adding angles where it changes quickly."""
+
+    def __init__(
+        self,
+        move,
+        measure,
+        min_step,
+        threshold=THRESHOLD,
+        dynamic_range=DYNAMIC_RANGE,
+        change=None,
+        store=None,
+        steps_per_degree=STEPS_PER_DEGREE,
+    ):
+        """Initializes with given params.
+
+        Args:
+            move (function): move(degrees) moves the stage by degrees and
+                returns once it has settled, e.g. acquisition_pipeline's
+                stage_mover
+            measure (function): measure() measures and returns the response
+            min_step (float): smallest angle step in degrees
+            threshold (float): change between neighbours above which the
+                interval is split, in the units of change
+            dynamic_range (float): dB below the peak response that is
+                clipped by the default change
+            change (function): change(a, b) between two responses, by
+                default db_changes on responses clipped at the dynamic range
+            store (function): store(angle, data) called after each measurement
+            steps_per_degree (float): stage steps per degree. Angles are
+                rounded to whole steps and moves are made between them, so
+                rounding doesn't add up over many moves.
+        """
+        self.move = move
+        self.measure = measure
+        self.min_step = min_step
+        self.threshold = threshold
+        self.dynamic_range = dynamic_range
+        self.change = change
+        self.store = store
+        self.steps_per_degree = steps_per_degree
+        self.steps = None  # stage position in whole steps
+        self.data = {}  # angle to response
+        self.passes = []  # angles measured in each pass
+
+    def measure_at(self, angles):
+        """Moves to each angle in order and measures there.
+
+        The data is kept at the angle of the whole step the stage is at.
+        """
+        for angle in angles:
+            steps = int(round(angle * self.steps_per_degree))
+            if steps != self.steps:
+                self.move((steps - self.steps) / self.steps_per_degree)
+                self.steps = steps
+            angle = steps / self.steps_per_degree
+            data = self.measure()
+            self.data[angle] = data
+            if self.store is not None:
+                self.store(angle, data)
+        self.passes.append(list(angles))
+
+    def run(self, start, stop, coarse_step, start_angle=None, max_passes=None):
+        """Sweeps from start to stop.
+
+        Args:
+            start (float): first angle in degrees
+            stop (float): last angle in degrees, included
+            coarse_step (float): step of the first pass
+            start_angle (float): angle the stage is at, start by default
+            max_passes (int): refinement passes to stop after, no limit if None
+
+        Returns (angles, data), the measured angles sorted and their responses.
+        """
+        start_angle = start if start_angle is None else start_angle
+        self.steps = int(round(start_angle * self.steps_per_degree))
+        self.data = {}
+        self.passes = []
+        count = max(int(round(abs(stop - start) / coarse_step)), 1)
+        coarse = np.linspace(start, stop, count + 1)
+        self.measure_at(coarse)
+
+        forward = False  # the stage ends at stop, so come back first
+        while max_passes is None or len(self.passes) <= max_passes:
+            angles = np.array(sorted(self.data))
+            if self.change is None:
+                levels = [to_db(self.data[a]) for a in angles]
+                floor = max(np.max(l) for l in levels) - self.dynamic_range
+                changes = db_changes(angles, np.maximum(levels, floor))
+            else:
+                changes = np.array([
+                    self.change(self.data[a], self.data[b])
+                    for a, b in zip(angles[:-1], angles[1:])
+                ])
+            new = refine(angles, changes, self.threshold, self.min_step)
+            # Midpoints that round to a step already measured add nothing
+            spd = self.steps_per_degree
+            new = new[[round(a * spd) / spd not in self.data for a in new]]
+            if len(new) == 0:
+                break
+            if (new[-1] > new[0]) != (forward == (stop > start)):
+                new = new[::-1]
+            self.measure_at(new)
+            forward = not forward
+
+        angles = sorted(self.data)
+        return np.array(angles), [self.data[a] for a in angles]
+
+    def report(self):
+        """Returns a summary of the stops made compared to a uniform grid."""
+        angles = sorted(self.data)
+        if len(angles) < 2:
+            return "{} angles measured".format(len(angles))
+        uniform = int(round((angles[-1] - angles[0]) / self.min_step)) + 1
+        return "{} angles in {} passes, {} on a uniform {} deg grid".format(
+            len(angles), len(self.passes), uniform, self.min_step
+        )
@@ -0,0 +1,196 @@
+"""Adaptive IF bandwidth and averaging for VNA sweeps.
+
+A fixed IF bandwidth and averaging factor has to be chosen for the worst
+angle of a pattern, so the main lobe is measured far slower than it needs
+to be. AdaptiveSweep measures the trace noise at each angle with a few fast
+sweeps and then picks the fastest setting that still meets a noise target
+in every frequency band, from the IF_BW_FREQ table.
+
+Trace noise scales as sqrt(IF BW / averaging), so from the noise sigma0
+measured at (bw0, avg0) a setting (bw, avg) gives
+sigma0 * sqrt(bw / bw0 * avg0 / avg). Sweep time goes as avg / bw, which is
+minimised subject to the target, preferring wider IF BW (less averaging
+overhead) on ties.
+
+Noise targets are relative to the signal (noise / |S| in dB), so a band
+with a target of -40 dB needs its trace noise 40 dB below the trace. Deep
+nulls that can't meet it get the narrowest IF BW and AVERAGING_MAX.
+
+Example:
+    sweep = AdaptiveSweep(v, [NoiseTarget(8e9, 10e9, -40), NoiseTarget(10e9, 12e9, -30)])
+    traces, setting = sweep.measure({"S21": "CHAN3"})
+"""
+import math
+
+import numpy as np
+
+from vna import AVERAGING_MAX, IF_BW_FREQ
+
+PROBE_SWEEPS = 3  # fast sweeps to measure the noise with
+
+
+class NoiseTarget:
+    """Largest relative trace noise allowed in a frequency band."""
+
+    def __init__(self, start, stop, noise_db):
+        """Initializes with given params.
+
+        Args:
+            start (float): start of the band in Hz
+            stop (float): stop of the band in Hz
+            noise_db (float): noise / |S| allowed, in dB, e.g. -40
+        """
+        self.start = start
+        self.stop = stop
+        self.noise_db = noise_db
+
+    def __str__(self):
+        return "<NoiseTarget {:.3E} to {:.3E} Hz: {:.1f} dB>".format(
+            self.start, self.stop, self.noise_db
+        )
+
+
+class SweepSetting:
+    """IF bandwidth and averaging for a sweep."""
+
+    def __init__(self, if_bw, averaging):
+        self.if_bw = if_bw
+        self.averaging = averaging
+
+    @property
+    def cost(self):
+        """Relative sweep time."""
+        return self.averaging / self.if_bw
+
+    def __str__(self):
+        return "<SweepSetting if_bw:{} Hz averaging:{}>".format(self.if_bw, self.averaging)
+
+
+def trace_noise(traces):
+    """Returns (mean, sigma) per point of repeated complex traces.
+
+    Args:
+        traces (np.ndarray): shape (sweeps >= 2, points)
+    """
+    traces = np.asarray(traces)
+    if len(traces) < 2:
+        raise ValueError("At least 2 sweeps are needed to measure noise")
+    return traces.mean(axis=0), traces.std(axis=0, ddof=1)
+
+
+def relative_noise_db(mean, sigma):
+    """Returns the noise of each point relative to the signal, in dB."""
+    with np.errstate(divide="ignore"):
+        return 20 * np.log10(sigma) - 20 * np.log10(np.abs(mean))
+
+
+def required_ratio(freq, noise_db, targets, probe):
+    """Returns the largest if_bw / averaging that meets every target.
+
+    The noise of a band is the mean of its relative noise power, which is
+    steadier than the worst point when measured with only a few sweeps.
+
+    Args:
+        freq (np.ndarray): frequency of each point in Hz
+        noise_db (np.ndarray): relative noise of each point measured at probe
+        targets (list): NoiseTarget per band
+        probe (SweepSetting): setting the noise was measured at
+    """
+    ratio = math.inf
+    for target in targets:
+        band = (freq >= target.start) & (freq <= target.stop)
+        if not band.any():
+            continue
+        noise = 10 * np.log10(np.mean(10 ** (noise_db[band] / 10)))
+        # Noise power goes as if_bw / averaging
+        margin = 10 ** ((target.noise_db - noise) / 10)
+        ratio = min(ratio, probe.if_bw / probe.averaging * margin)
+    return ratio
+
+
+def choose_setting(ratio, if_bws=IF_BW_FREQ, averaging_max=AVERAGING_MAX):
+    """Returns the fastest SweepSetting with if_bw / averaging <= ratio."""
+    best = None
+    for bw in sorted(if_bws, reverse=True):
+        avg = max(1, math.ceil(bw / ratio)) if ratio > 0 else averaging_max + 1
+        if avg > averaging_max:
+            continue
+        setting = SweepSetting(bw, avg)
+        if best is None or setting.cost < best.cost:
+            best = setting
+    if best is None:
+        return SweepSetting(min(if_bws), averaging_max)
+    return best
+
+
+class AdaptiveSweep:
+    """Sweeps with the fastest IF bandwidth and averaging meeting a target."""
+
+    def __init__(self, vna, targets, probe=None, probe_sweeps=PROBE_SWEEPS):
+        """Initializes with given params.
+
+        Args:
+            vna (VNA): connected VNA, with the sweep already set up
+            targets (list): NoiseTarget per band
+            probe (SweepSetting): setting for the noise sweeps, by default
+                the widest IF BW without averaging
+            probe_sweeps (int): sweeps to measure the noise with, >= 2
+        """
+        self.vna = vna
+        self.targets = targets
+        self.probe = probe or SweepSetting(max(IF_BW_FREQ), 1)
+        self.probe_sweeps = probe_sweeps
+        self.freq = None
+
+    def apply(self, setting):
+        """Sets the VNA to setting, only the changes are sent."""
+        if self.vna.state.get("if_bw") != setting.if_bw:
+            self.vna.set_if_bw(setting.if_bw)
+        self.vna.averaging_factor = setting.averaging
+
+    def probe_noise(self, chan):
+        """Sweeps probe_sweeps times on channel chan.
+
+        Returns (mean trace, relative noise in dB per point).
+        """
+        self.apply(self.probe)
+        traces = []
+        for _ in range(self.probe_sweeps):
+            self.vna.sweep()
+            traces.append(self.vna.get_complex(chan))
+        mean, sigma = trace_noise(traces)
+        return mean, relative_noise_db(mean, sigma)
+
+    def measure(self, channels, noise_chan=None):
+        """Measures the traces of channels with an adaptive setting.
+
+        Args:
+            channels (dict): name to channel, e.g. {"S21": "CHAN3"}
+            noise_chan (str): channel the noise is measured on, by default
+                the first of channels
+
+        Returns (traces, setting): traces maps names to complex arrays and
+        setting is the SweepSetting that was used. The VNA's IF bandwidth
+        and averaging factor are set back to what they were.
+        """
+        if self.freq is None:
+            self.freq = self.vna.get_freq()
+        noise_chan = noise_chan or next(iter(channels.values()))
+        previous = SweepSetting(self.vna.get_if_bw(), self.vna.averaging_factor)
+        try:
+            mean, noise_db = self.probe_noise(noise_chan)
+            ratio = required_ratio(self.freq, noise_db, self.targets, self.probe)
+            setting = choose_setting(ratio)
+
+            if (
+                setting.if_bw == self.probe.if_bw
+                and setting.averaging <= self.probe_sweeps
+                and list(channels.values()) == [noise_chan]
+            ):
+                # The probe sweeps averaged together are already good enough
+                return {name: mean for name in channels}, SweepSetting(self.probe.if_bw, self.probe_sweeps)
+            self.apply(setting)
+            self.vna.sweep()
+            return {name: self.vna.get_complex(chan) for name, chan in channels.items()}, setting
+        finally:
+            self.apply(previous)
@@ -12,6 +12,10 @@ import numpy as np
 import pyvisa
 import time
 import csv
+from console_interface import COM_PORT
+from instrument_server import InstrumentClient, server_running
+from motion_scheduler import SettleScheduler
+from rotary_stage import rotaryStage
 
 # # Define rotation stage parameters
 start_angle = 26           # Minimum angle (degrees)
@@ -31,15 +35,35 @@ term_res = 50               #termination resistance on oscilloscope in Ohms
 
 output_folder = "./Data/"
 
+# The stage is moved through the instrument server if it is running (start it
+# with `ctrack serve`), which keeps the serial port open between steps.
+# Otherwise the serial port is opened here, like arm_travel does.
+if server_running():
+    stage = InstrumentClient()
+else:
+    stage = rotaryStage(COM_PORT)
+    time.sleep(2)  # the Arduino resets when the port is opened
+settle_time = 0.5           # Time for the arm to stop vibrating after a move (seconds)
+sched = SettleScheduler(settle_time=settle_time)
+
+def rotate(degrees, dirn):
+    """Rotates the stage, dirn is "l" (cw) or "r" (ccw)."""
+    if isinstance(stage, InstrumentClient):
+        print(stage.call("rotate", degrees=float(degrees), dirn=dirn))
+    elif dirn == "l":
+        print(stage.step_cw(float(degrees), wait=True))
+    else:
+        print(stage.step_ccw(float(degrees), wait=True))
+
 #################################################################################################################################################
 def set_rotary_angle(angle):
     """Moves stage to an absolute angle."""
     os.system(f"python console_interface.py move_to {angle}")
-    time.sleep(2)  # Stabilization time
+    sched.settle()  # Stabilization time
 
 #os.system(f"python console_interface.py rotate -d {start_angle} r")  # Move from 0° to -3°
 
-os.system("python console_interface.py rotate -d {} l".format(-start_angle))
+sched.run_move(start_angle, lambda: rotate(-start_angle, "l"))
 
 # Initialize PyVISA resource manager
 rm = pyvisa.ResourceManager()
@@ -148,11 +172,11 @@ for angle in angleVect:
         writer.writerow(["Wavelength (nm)", "Current (A)"])  # Header
         writer.writerows(data)  # Write data
     
-    # Increment the rotary stage
-    os.system("python console_interface.py rotate -d {} r".format(rotation_step))
-    time.sleep(2)
+    # Increment the rotary stage, returns once the move is done and settled
+    sched.run_move(rotation_step, lambda: rotate(rotation_step, "r"))
     
 # Rotate back into position
 #os.system("python console_interface.py rotate -d {} l".format(end_angle-start_angle))
 
+print(sched.report())
 tls.write(":OUTP OFF") # Turns off Laser output
\ No newline at end of file
@@ -0,0 +1,164 @@
+"""asyncio façade over the instrument drivers.
+
+The drivers (VNA, rotaryStage, voltageSetter and raw pyvisa resources like
+the TLS and oscilloscope in angular_sweep.py) block, so a script can only
+do one thing at a time and waits with time.sleep. Wrapping them here lets a
+script await several instruments at once where the physics allows, e.g.
+read the oscilloscope while the laser retunes:
+
+    tls, osc = AsyncDevice(tls_resource), AsyncDevice(osc_resource)
+    stage = AsyncStage(rotaryStage(COM_PORT))
+    await stage.move(400)
+    await tls.write("SOUR:WAVE:CW 1550NM")
+    await osc.write("SING")
+    data, _ = await asyncio.gather(
+        osc.query_ascii_values("CHAN2:DATA?"), asyncio.sleep(laser_settle)
+    )
+
+Each device gets its own worker thread, so calls to one device run in the
+order they were made while different devices run concurrently. Calls take
+a timeout (default the device's timeout), and cancelling a stage move sends
+the stop command.
+
+A call that times out or is cancelled can't interrupt a driver call that
+is already blocking in its thread, it finishes in the background and the
+next call to that device waits for it. AsyncStage avoids this by reading
+the serial port in short slices.
+"""
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rotary_stage import (
+    ACK_TIMEOUT,
+    DEFAULT_ACCELERATION,
+    MOVE_TIMEOUT_MARGIN,
+    StageTimeout,
+)
+
+POLL_INTERVAL = 0.05  # s, longest a serial read blocks the stage's thread
+
+
+class AsyncDevice:
+    """Runs the methods of a blocking driver on its own thread.
+
+    Any method of the driver can be awaited through the wrapper, e.g.
+    await AsyncDevice(v).sweep() for a VNA.
+    """
+
+    def __init__(self, device, timeout=None, name=None):
+        """Initializes with given params.
+
+        Args:
+            device: driver object, e.g. a VNA, voltageSetter or pyvisa resource
+            timeout (float): default timeout in s for calls, None for none
+            name (str): name of the worker thread
+        """
+        self.device = device
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(
+            1, thread_name_prefix=name or type(device).__name__
+        )
+
+    async def run(self, function, *args, timeout=None, **kwargs):
+        """Runs function(*args, **kwargs) on the device thread and returns
+        its result, raises asyncio.TimeoutError after timeout s."""
+        loop = asyncio.get_running_loop()
+        call = loop.run_in_executor(
+            self.executor, functools.partial(function, *args, **kwargs)
+        )
+        timeout = self.timeout if timeout is None else timeout
+        return await asyncio.wait_for(call, timeout)
+
+    def __getattr__(self, name):
+        attr = getattr(self.device, name)
+        if not callable(attr):
+            return attr
+
+        async def method(*args, timeout=None, **kwargs):
+            return await self.run(attr, *args, timeout=timeout, **kwargs)
+
+        method.__name__ = name
+        return method
+
+    def close(self):
+        """Stops the device thread once queued calls are done."""
+        self.executor.shutdown(wait=True)
+
+
+class AsyncStage(AsyncDevice):
+    """rotaryStage with moves that can be awaited and cancelled."""
+
+    def __init__(self, stage, name="stage"):
+        super().__init__(stage, name=name)
+
+    async def wait_reply(self, kind, seq, timeout, what):
+        """Like rotaryStage.wait_reply, without blocking the thread longer
+        than POLL_INTERVAL so the wait can be cancelled. A reply cut off by a
+        slice is kept by the stage and completed in the next one."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                return await self.run(
+                    self.device.wait_reply,
+                    kind,
+                    seq,
+                    max(min(POLL_INTERVAL, remaining), 0.001),
+                    what,
+                )
+            except StageTimeout:
+                if remaining <= POLL_INTERVAL:
+                    raise StageTimeout(
+                        "{} not done after {:.1f} s".format(what, timeout)
+                    )
+
+    async def command(self, cmd):
+        """Sends a framed command, returns its sequence number once ACKed.
+
+        The ACK comes within ACK_TIMEOUT, so this blocks the thread briefly.
+        """
+        return await self.run(self.device.command, cmd)
+
+    async def move(self, steps, timeout=None):
+        """Moves by steps (negative for cw) and returns the step count.
+
+        Cancelling the move, or its timeout, stops the stage.
+        """
+        steps = int(steps)
+        if steps == 0:
+            return 0
+        if timeout is None:
+            timeout = self.device.move_time(steps) + MOVE_TIMEOUT_MARGIN
+        seq = await self.command("M{}".format(steps))
+        try:
+            done = await self.wait_reply(
+                "DONE", seq, timeout, "move of {} steps".format(steps)
+            )
+        except (asyncio.CancelledError, StageTimeout):
+            await asyncio.shield(self.stop())
+            raise
+        return int(done)
+
+    async def step_ccw(self, step, timeout=None):
+        """Moves by step degrees ccw, like rotaryStage.step_ccw(wait=True)."""
+        return await self.move(round(step * self.device.cal), timeout)
+
+    async def step_cw(self, step, timeout=None):
+        """Moves by step degrees cw, like rotaryStage.step_cw(wait=True)."""
+        return await self.move(-round(step * self.device.cal), timeout)
+
+    async def position(self):
+        """Returns the position in steps counted by the firmware."""
+        seq = await self.command("Q")
+        return int(await self.wait_reply("DONE", seq, ACK_TIMEOUT, "position"))
+
+    async def stop(self):
+        """Stops a move right away, returns the position in steps."""
+        seq = await self.command("X")
+        return int(await self.wait_reply("DONE", seq, ACK_TIMEOUT, "stop"))
+
+    async def set_motion_profile(self, max_speed, acceleration=DEFAULT_ACCELERATION):
+        """See rotaryStage.set_motion_profile."""
+        return await self.run(self.device.set_motion_profile, max_speed, acceleration)
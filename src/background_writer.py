@@ -0,0 +1,265 @@
+"""Background writer, so saving data overlaps the next stage move.
+
+VNA.WriteData stringifies and writes every trace before returning, and the
+stage sits idle meanwhile. A BackgroundWriter takes the numpy arrays
+instead and saves them from its own thread:
+
+    writer = BackgroundWriter(journal_dir="./data/.journal")
+    for angle in angles:
+        stage.step_cw(steps, wait=True)
+        v.sweep()
+        v.WriteData("./data/", angle, Freq, writer=writer)  # returns right away
+    writer.close()  # waits until everything is on disk
+
+The queue is bounded (maxsize jobs), so if the disk can't keep up the
+acquisition loop blocks in submit rather than using up memory; the time
+spent blocked is kept in blocked_time.
+
+fsync sets when files are forced to the disk: FSYNC_NEVER leaves it to the
+OS, FSYNC_CLOSE syncs stores on close and FSYNC_ALWAYS syncs every file as
+it's written.
+
+With a journal_dir, the arrays of each job are saved (raw .npz, no
+formatting) before it is queued and removed once it has been written. If
+the program dies with jobs in the queue, replay_journal(journal_dir) writes
+them on the next run. Journal files are only forced to the disk with
+FSYNC_ALWAYS, otherwise saving one is a copy into the OS cache, which
+survives the program dying but not the computer.
+"""
+import atexit
+import glob
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from measurement_store import MeasurementStore
+from vna import write_trace_csv
+
+FSYNC_NEVER = "never"
+FSYNC_CLOSE = "close"
+FSYNC_ALWAYS = "always"
+
+CSV_JOB = "csv"
+STORE_JOB = "store"
+
+
+class BackgroundWriterError(Exception):
+    """Error writing data in the background."""
+
+    pass
+
+
+def write_journal(journal_dir, seq, kind, args, traces, fsync=True):
+    """Saves a job to the journal, returns its file.
+
+    fsync forces the file to the disk before it is renamed into place.
+    """
+    path = os.path.join(journal_dir, "{:08d}.npz".format(seq))
+    tmp = path + ".tmp"
+    arrays = {"t_" + name: np.asarray(t) for name, t in traces.items()}
+    if "Freq" in args:
+        arrays["freq"] = np.asarray(args["Freq"])
+        args = {k: v for k, v in args.items() if k != "Freq"}
+    meta = json.dumps({"kind": kind, "args": args, "names": list(traces)})
+    with open(tmp, "wb") as f:
+        np.savez(f, meta=np.array(meta), **arrays)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return path
+
+
+def read_journal(path):
+    """Returns (kind, args, traces) of a job saved by write_journal."""
+    with np.load(path) as data:
+        meta = json.loads(str(data["meta"]))
+        args = meta["args"]
+        if "freq" in data:
+            args["Freq"] = data["freq"]
+        traces = {name: data["t_" + name] for name in meta["names"]}
+    return meta["kind"], args, traces
+
+
+def run_job(kind, args, traces, stores, fsync, replay=False):
+    """Writes one job, stores are looked up in the dict stores by path.
+
+    Store jobs carry the index the angle gets in the store, so a replayed
+    job that was already appended (just before a crash) is skipped.
+    """
+    if kind == CSV_JOB:
+        write_trace_csv(
+            args["path"], args["title"], args["Freq"], traces,
+            fsync=fsync == FSYNC_ALWAYS,
+        )
+    elif kind == STORE_JOB:
+        store = stores[args["store"]]
+        if replay and store.count > args.get("index", store.count):
+            return  # appended just before the crash
+        store.append(args["angle"], traces)
+        # Keeps the angle count on disk in step with the removed journal file
+        store.flush(fsync=fsync == FSYNC_ALWAYS)
+    else:
+        raise BackgroundWriterError("Unknown job {}".format(kind))
+
+
+def replay_journal(journal_dir, fsync=FSYNC_CLOSE):
+    """Writes the jobs left in a journal by a program that didn't finish.
+
+    Returns the number of jobs written.
+    """
+    paths = sorted(glob.glob(os.path.join(journal_dir, "*.npz")))
+    stores = {}
+    try:
+        for path in paths:
+            kind, args, traces = read_journal(path)
+            if kind == STORE_JOB and args["store"] not in stores:
+                stores[args["store"]] = MeasurementStore(args["store"])
+            run_job(kind, args, traces, stores, fsync, replay=True)
+            os.remove(path)
+    finally:
+        for store in stores.values():
+            store.flush(fsync=fsync != FSYNC_NEVER)
+            store.close()
+    return len(paths)
+
+
+class BackgroundWriter:
+    """Writes measured traces to disk from a thread."""
+
+    def __init__(self, maxsize=8, fsync=FSYNC_CLOSE, journal_dir=None):
+        """Starts the writer thread.
+
+        Args:
+            maxsize (int): jobs that can wait before submit blocks
+            fsync (str): FSYNC_NEVER, FSYNC_CLOSE or FSYNC_ALWAYS
+            journal_dir (str): folder for the crash journal, none if None.
+                Jobs left in it from an earlier run are written first.
+        """
+        if fsync not in (FSYNC_NEVER, FSYNC_CLOSE, FSYNC_ALWAYS):
+            raise ValueError("Unknown fsync policy {}".format(fsync))
+        self.fsync = fsync
+        self.journal_dir = journal_dir
+        self.seq = 0
+        if journal_dir is not None:
+            os.makedirs(journal_dir, exist_ok=True)
+            if replay_journal(journal_dir, fsync):
+                print("Wrote jobs left in the journal " + journal_dir)
+        self.queue = queue.Queue(maxsize)
+        self.lock = threading.Lock()  # for stores and counts
+        self.stores = {}  # open stores by path, only added to by append
+        self.counts = {}  # angles each store will have once the queue is written
+        self.error = None
+        self.written = 0  # jobs written
+        self.failed = 0  # jobs not written because of an error, kept in the journal
+        self.blocked_time = 0.0  # s spent waiting in submit for a free slot
+        self.write_time = 0.0  # s the thread spent writing
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, kind, args, traces):
+        """Queues a job, blocking while the queue is full."""
+        if self.closed:
+            raise BackgroundWriterError("The writer is closed")
+        self.check()
+        traces = {name: np.array(t) for name, t in traces.items()}  # own copies
+        journal = None
+        if self.journal_dir is not None:
+            self.seq += 1
+            journal = write_journal(
+                self.journal_dir, self.seq, kind, args, traces, fsync=self.fsync == FSYNC_ALWAYS
+            )
+        t0 = time.perf_counter()
+        self.queue.put((kind, args, traces, journal))
+        self.blocked_time += time.perf_counter() - t0
+
+    def write_csv(self, path, title, Freq, traces):
+        """Queues a write_trace_csv, see there for the args."""
+        self.submit(CSV_JOB, {"path": path, "title": title, "Freq": Freq}, traces)
+
+    def append(self, store, angle, traces):
+        """Queues a MeasurementStore.append.
+
+        Args:
+            store (MeasurementStore): store to append to, or its folder. It
+                must not be used elsewhere until flush or close, and only one
+                store can be open per folder.
+            angle (float): angle in degrees
+            traces (dict): S-param name to complex trace
+        """
+        with self.lock:
+            path = store.path if isinstance(store, MeasurementStore) else store
+            if path not in self.stores:
+                if not isinstance(store, MeasurementStore):
+                    store = MeasurementStore(path)
+                self.stores[path] = store
+                self.counts[path] = store.count
+            elif isinstance(store, MeasurementStore) and store is not self.stores[path]:
+                raise BackgroundWriterError(
+                    "Another store is already open for {}".format(path)
+                )
+            index = self.counts[path]
+            self.counts[path] += 1
+        self.submit(STORE_JOB, {"store": path, "angle": float(angle), "index": index}, traces)
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                if self.error is not None:
+                    self.failed += 1
+                    continue  # the journal keeps the rest for replay
+                kind, args, traces, journal = job
+                t0 = time.perf_counter()
+                try:
+                    run_job(kind, args, traces, self.stores, self.fsync)
+                    if journal is not None:
+                        os.remove(journal)
+                    self.written += 1
+                except Exception as e:
+                    self.error = e
+                    self.failed += 1
+                self.write_time += time.perf_counter() - t0
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        """Raises the error the writer thread stopped on, if any."""
+        if self.error is not None:
+            raise BackgroundWriterError(
+                "Background write failed: {}".format(self.error)
+            ) from self.error
+
+    def flush(self):
+        """Waits until every queued job has been written."""
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        """Writes everything queued, closes the stores and stops the thread."""
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        self.queue.put(None)
+        self.thread.join()
+        for store in self.stores.values():
+            store.flush(fsync=self.fsync != FSYNC_NEVER)
+            store.close()
+        self.stores = {}
+        self.counts = {}
+        self.check()
@@ -0,0 +1,53 @@
+"""Compares the old tuple based FORM5 decoding with decode_form5.
+
+Run from the src folder with: python benchmarks/bench_form5.py
+"""
+import os
+import struct
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from vna import decode_form5  # noqa: E402
+
+POINTS = 1601
+REPEATS = 200
+
+
+def make_block(points=POINTS):
+    """Builds a synthetic FORM5 block like the one returned by OUTPFORM."""
+    values = np.zeros((points, 2), dtype="<f4")
+    values[:, 0] = np.linspace(-60, 0, points)
+    payload = values.tobytes()
+    return b"#A" + len(payload).to_bytes(2, "little") + payload
+
+
+def decode_old(block):
+    """Decodes the way get_mag used to: tuple of floats + Python loop."""
+    length = int.from_bytes(block[2:4], "little")
+    aux = struct.unpack("<{}f".format(length // 4), block[4 : 4 + length])
+    res = []
+    for i in range(0, len(aux), 2):
+        res.append(aux[i])
+    return np.asarray(res)
+
+
+def decode_new(block):
+    """Decodes the way get_mag does now."""
+    return decode_form5(block)[:, 0].astype(np.float64)
+
+
+if __name__ == "__main__":
+    block = make_block()
+    assert np.array_equal(decode_old(block), decode_new(block))
+
+    for name, func in (("old", decode_old), ("new", decode_new)):
+        t = timeit.timeit(lambda: func(block), number=REPEATS) / REPEATS
+        # A full readout is 4 channels x (mag + phase) per angle
+        print(
+            "{}: {:8.1f} us per trace, {:8.1f} us per 4 channel readout".format(
+                name, t * 1e6, t * 8e6
+            )
+        )
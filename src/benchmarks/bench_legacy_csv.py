@@ -0,0 +1,87 @@
+"""Compares the legacy CSV parser with reading one float() per value.
+
+Writes a synthetic sweep of WriteData files (2 S-params, 1601 points) and
+parses it the simple way, with legacy_csv in one process and with
+legacy_csv on a process pool, printing files/s for each. A folder of
+existing CSV files can be given instead.
+
+Run from the src folder with: python benchmarks/bench_legacy_csv.py [angles|folder]
+"""
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from legacy_csv import parse_file, parse_files  # noqa: E402
+from vna import write_trace_csv  # noqa: E402
+
+POINTS = 1601
+SPARAMS = ["S12", "S21"]
+
+
+def read_csv(path):
+    """Reads a file the simple way, one float() per value."""
+    rows = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            label, _, values = line.partition(",")
+            try:
+                rows[label] = np.array([float(v) for v in values.split(",")])
+            except ValueError:
+                pass  # title or header line
+    return rows
+
+
+def report(name, seconds, files):
+    print("{:14s} {:7.3f} s  {:8.1f} files/s".format(name, seconds, files / seconds))
+
+
+def make_sweep(folder, angles):
+    rng = np.random.default_rng(0)
+    freq = np.linspace(8, 12, POINTS)
+    for a in np.linspace(-70, 70, angles):
+        traces = {
+            s: rng.standard_normal(POINTS) + 1j * rng.standard_normal(POINTS)
+            for s in SPARAMS
+        }
+        write_trace_csv(
+            os.path.join(folder, "{:.3f}.csv".format(a)),
+            "Angle of: {:.3f}".format(a),
+            freq,
+            traces,
+        )
+
+
+if __name__ == "__main__":
+    arg = sys.argv[1] if len(sys.argv) > 1 else "500"
+    tmp = None
+    if os.path.isdir(arg):
+        folder = arg
+    else:
+        tmp = folder = tempfile.mkdtemp()
+        make_sweep(folder, int(arg))
+    try:
+        paths = sorted(glob.glob(os.path.join(folder, "*.csv")))
+
+        t = time.perf_counter()
+        for p in paths:
+            read_csv(p)
+        report("float()", time.perf_counter() - t, len(paths))
+
+        t = time.perf_counter()
+        for p in paths:
+            parse_file(p)
+        report("legacy_csv", time.perf_counter() - t, len(paths))
+
+        t = time.perf_counter()
+        ds = parse_files(paths)
+        report("legacy_csv pool", time.perf_counter() - t, len(paths))
+        print("{} files, traces: {}".format(len(ds), ", ".join(ds.labels)))
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
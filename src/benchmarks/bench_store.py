@@ -0,0 +1,89 @@
+"""Compares per-angle CSV files with a MeasurementStore.
+
+Writes and reads back a synthetic sweep (2 S-params, 1601 points) in both
+formats and prints the throughput.
+
+Run from the src folder with: python benchmarks/bench_store.py [angles]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from measurement_store import MeasurementStore  # noqa: E402
+from vna import write_trace_csv  # noqa: E402
+
+POINTS = 1601
+SPARAMS = ["S12", "S21"]
+
+
+def make_traces(rng):
+    return {
+        s: (rng.standard_normal(POINTS) + 1j * rng.standard_normal(POINTS)).astype(
+            np.complex64
+        )
+        for s in SPARAMS
+    }
+
+
+def read_csv(path):
+    """Reads a WriteData file back the simple way, one float() per value."""
+    rows = {}
+    with open(path, encoding="utf-8") as f:
+        next(f)
+        for line in f:
+            label, _, values = line.partition(",")
+            rows[label] = np.array([float(v) for v in values.split(",")])
+    return rows
+
+
+def report(name, seconds, angles, nbytes):
+    print(
+        "{:14s} {:7.3f} s  {:8.1f} angles/s  {:7.1f} MB/s".format(
+            name, seconds, angles / seconds, nbytes / seconds / 1e6
+        )
+    )
+
+
+if __name__ == "__main__":
+    angles = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = np.random.default_rng(0)
+    freq = np.linspace(8e9, 12e9, POINTS)
+    sweep = [(a, make_traces(rng)) for a in np.linspace(-70, 70, angles)]
+    nbytes = angles * len(SPARAMS) * POINTS * 8  # as complex64
+    tmp = tempfile.mkdtemp()
+    try:
+        csv_dir = os.path.join(tmp, "csv")
+        os.makedirs(csv_dir)
+        t = time.perf_counter()
+        for a, traces in sweep:
+            write_trace_csv(
+                os.path.join(csv_dir, "{:.3f}.csv".format(a)),
+                "Angle of: {:.3f}".format(a),
+                freq / 1e9,
+                traces,
+            )
+        report("csv write", time.perf_counter() - t, angles, nbytes)
+
+        t = time.perf_counter()
+        with MeasurementStore.create(os.path.join(tmp, "store"), freq, SPARAMS) as store:
+            for a, traces in sweep:
+                store.append(a, traces)
+        report("store write", time.perf_counter() - t, angles, nbytes)
+
+        t = time.perf_counter()
+        for name in sorted(os.listdir(csv_dir)):
+            read_csv(os.path.join(csv_dir, name))
+        report("csv read", time.perf_counter() - t, angles, nbytes)
+
+        t = time.perf_counter()
+        store = MeasurementStore(os.path.join(tmp, "store"))
+        data = {s: np.array(store.trace(s)) for s in SPARAMS}
+        report("store read", time.perf_counter() - t, angles, nbytes)
+        assert np.array_equal(data["S21"][-1], sweep[-1][1]["S21"])
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,188 @@
+"""Bias-grid sweeps over NI analog outputs, e.g. for reconfigurable surfaces.
+
+A BiasGrid is N axes, each a channel of the voltageSetter and the voltages
+to step it through. The points are visited in serpentine order (a reflected
+mixed-radix Gray code): each point differs from the one before in a single
+channel, by a single step, so every change is as small as possible and the
+settle time can stay short. Raster order, as in the nested loops of
+templates/python/vna_demoWithNIcontroller.py, jumps the inner channel all
+the way back at the end of every row.
+
+All points are streamed into one MeasurementStore, whose angles column
+holds the grid point number, and the grid is kept in its attrs. Running a
+sweep into a store that already has points skips them, so an interrupted
+sweep resumes where it stopped.
+
+Example:
+    grid = BiasGrid([(0, np.linspace(0, 10, 11)), (1, np.linspace(0.6, 1.87, 10))])
+    with voltageSetter() as vs:
+        vs.open(grid.channels)
+        sweep = BiasSweep(vs, grid, vna_acquire(v, {"S21": "CHAN3"}))
+        sweep.run("./data/bias1", v.get_freq())
+    traces = load_bias_sweep("./data/bias1")[1]   # S21: (11, 10, points)
+"""
+import os
+import time
+
+import numpy as np
+
+from measurement_store import MeasurementStore, MeasurementStoreError
+
+SERPENTINE = "serpentine"
+RASTER = "raster"
+SETTLE_TIME = 0.1  # s after setting the voltages, before measuring
+
+
+def serpentine_order(shape):
+    """Returns the grid indices of shape, shape (points, axes), in serpentine
+    order: the last axis is fastest and every axis reverses direction each
+    time it wraps."""
+    raster = raster_order(shape)
+    order = raster.copy()
+    for axis in range(1, len(shape)):
+        # Reversed when the slower axes have stepped an odd number of times
+        outer = np.ravel_multi_index(raster[:, :axis].T, shape[:axis])
+        odd = outer % 2 == 1
+        order[odd, axis] = shape[axis] - 1 - order[odd, axis]
+    return order
+
+
+def raster_order(shape):
+    """Returns the grid indices of shape in nested loop order."""
+    return np.indices(shape).reshape(len(shape), -1).T.copy()
+
+
+class BiasGrid:
+    """Voltages to sweep, one axis per NI channel."""
+
+    def __init__(self, axes, fixed=None):
+        """Initializes with given params.
+
+        Args:
+            axes (list): (channel number, voltages) per axis, slowest first
+            fixed (dict): channel number to voltage, for channels held
+                constant during the sweep
+        """
+        self.axes = [(int(ch), np.asarray(values, dtype=np.float64)) for ch, values in axes]
+        self.fixed = {int(ch): float(v) for ch, v in (fixed or {}).items()}
+        swept = [ch for ch, _ in self.axes]
+        if len(set(swept)) != len(swept) or set(swept) & set(self.fixed):
+            raise ValueError("Each channel can only be on one axis or fixed")
+
+    @property
+    def shape(self):
+        return tuple(len(values) for _, values in self.axes)
+
+    @property
+    def channels(self):
+        """Channels to open the voltageSetter with, swept then fixed."""
+        return [ch for ch, _ in self.axes] + sorted(self.fixed)
+
+    def order(self, kind=SERPENTINE):
+        """Returns the grid indices in the order to visit them."""
+        if kind == SERPENTINE:
+            return serpentine_order(self.shape)
+        if kind == RASTER:
+            return raster_order(self.shape)
+        raise ValueError("Unknown order {}".format(kind))
+
+    def point(self, index):
+        """Returns the point number of a grid index."""
+        return int(np.ravel_multi_index(tuple(index), self.shape))
+
+    def voltages(self, index):
+        """Returns the voltage of each channel, in self.channels order."""
+        swept = [values[i] for (_, values), i in zip(self.axes, index)]
+        return np.array(swept + [self.fixed[ch] for ch in sorted(self.fixed)])
+
+    def to_attrs(self):
+        return {
+            "axes": [[ch, values.tolist()] for ch, values in self.axes],
+            "fixed": {str(ch): v for ch, v in self.fixed.items()},
+        }
+
+    @classmethod
+    def from_attrs(cls, attrs):
+        return cls(attrs["axes"], {int(ch): v for ch, v in attrs["fixed"].items()})
+
+
+class BiasSweep:
+    """Measures at every point of a BiasGrid."""
+
+    def __init__(self, setter, grid, measure, settle_time=SETTLE_TIME, order=SERPENTINE):
+        """Initializes with given params.
+
+        Args:
+            setter (voltageSetter): opened with grid.channels
+            grid (BiasGrid): voltages to sweep
+            measure (function): takes a measurement and returns a dict of
+                name to trace, e.g. continuous_scan.vna_acquire
+            settle_time (float): s to wait after setting the voltages
+            order (str): SERPENTINE or RASTER
+        """
+        if list(setter.channels) != grid.channels:
+            raise ValueError("The voltageSetter must be opened with grid.channels")
+        self.setter = setter
+        self.grid = grid
+        self.measure = measure
+        self.settle_time = settle_time
+        self.order = order
+
+    def run(self, path, freq, attrs=None):
+        """Sweeps the grid into the store at path, skipping points it has.
+
+        Args:
+            path (str): folder of the store, created if needed
+            freq (np.ndarray): frequencies of the trace points in Hz
+            attrs (dict): more metadata to store, e.g. from sweep_attrs
+
+        Returns the number of points measured by this call.
+        """
+        store = None
+        if os.path.exists(path):
+            try:
+                store = MeasurementStore(path)
+            except MeasurementStoreError:
+                pass
+        if store is not None and store.attrs.get("grid") != self.grid.to_attrs():
+            raise MeasurementStoreError("{} has a different bias grid".format(path))
+        done = set() if store is None else set(int(p) for p in store.angles)
+
+        measured = 0
+        try:
+            for index in self.grid.order(self.order):
+                point = self.grid.point(index)
+                if point in done:
+                    continue
+                self.setter.setVoltages(self.grid.voltages(index))
+                time.sleep(self.settle_time)
+                traces = self.measure()
+                if store is None:
+                    meta = dict(attrs or {}, grid=self.grid.to_attrs(), order=self.order)
+                    store = MeasurementStore.create(path, freq, list(traces), meta)
+                store.append(point, traces)
+                store.flush()  # so a resume knows this point is done
+                measured += 1
+                print("Bias point {} of {}: {}".format(
+                    len(done) + measured, np.prod(self.grid.shape), self.grid.voltages(index)))
+        finally:
+            if store is not None:
+                store.close()
+        return measured
+
+
+def load_bias_sweep(path):
+    """Reads a store written by BiasSweep.
+
+    Returns (grid, traces), traces maps each S-param to a complex array of
+    shape grid.shape + (points,), NaN where a point hasn't been measured.
+    """
+    store = MeasurementStore(path)
+    grid = BiasGrid.from_attrs(store.attrs["grid"])
+    points = store.angles.astype(int)
+    traces = {}
+    for s in store.sparams:
+        data = np.full((int(np.prod(grid.shape)), store.points), np.nan, dtype=np.complex64)
+        data[points] = store.trace(s)
+        traces[s] = data.reshape(grid.shape + (store.points,))
+    return grid, traces
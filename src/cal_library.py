@@ -0,0 +1,204 @@
+"""On-disk library of VNA calibration sets, keyed by sweep configuration.
+
+Calibration coefficients only live in the VNA (and in memory once read with
+get_calibration_data), so changing to another frequency plan means
+calibrating again. A CalLibrary keeps the coefficient sets in a folder:
+
+    index.json    one entry per set: its key, file, and when it was saved
+                  and last used
+    <id>.npz      the coefficient arrays of a set, big-endian float64 as
+                  transferred in FORM3
+
+keyed by (start, stop, points, power, IF BW, CalType), with the values
+rounded the way set_sweep_params sends them. Sets older than max_age or
+beyond max_sets (least recently used first) are evicted when a set is
+saved.
+
+With vna.cal_library set, VNA.set_sweep_params restores the matching set
+through set_calibration_data whenever it selects a known configuration:
+
+    v.cal_library = CalLibrary("./cal")
+    ...calibrate...
+    v.cal_library.save_from(v)
+    v.set_sweep_params(params)   # restores the set saved for params
+"""
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+
+from vna import CAL_DATA_LENGTH, FREQ_DECIMALS, POWER_DECIMALS, CalType
+
+INDEX_FILE = "index.json"
+# Preferred when several cal types are saved for one sweep
+CAL_PREFERENCE = [
+    CalType.CALIFUL2,
+    CalType.CALIS111,
+    CalType.CALIS221,
+    CalType.CALIRAI,
+    CalType.CALIRESP,
+]
+
+
+class CalLibraryError(Exception):
+    """Error reading or writing a CalLibrary."""
+
+    pass
+
+
+def cal_key(start, stop, points, power, if_bw, cal_type):
+    """Returns the key of a calibration set as a tuple.
+
+    Args:
+        start (float): start freq in Hz
+        stop (float): stop freq in Hz
+        points (int): points in the sweep
+        power (float): power in dBm
+        if_bw (float): IF bandwidth in Hz
+        cal_type (CalType): type of the calibration
+    """
+    return (
+        round(start / 1.0e9, FREQ_DECIMALS),
+        round(stop / 1.0e9, FREQ_DECIMALS),
+        int(points),
+        round(power, POWER_DECIMALS),
+        int(if_bw),
+        cal_type.name,
+    )
+
+
+class CalLibrary:
+    """Calibration coefficient sets saved in a folder."""
+
+    def __init__(self, path, max_age=None, max_sets=None):
+        """Opens or creates the library in path.
+
+        Args:
+            path (str): folder of the library
+            max_age (float): s after which a set is evicted, never if None
+            max_sets (int): sets kept at most, no limit if None
+        """
+        self.path = path
+        self.max_age = max_age
+        self.max_sets = max_sets
+        os.makedirs(path, exist_ok=True)
+        try:
+            with open(os.path.join(path, INDEX_FILE), encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = []
+
+    def write_index(self):
+        tmp = os.path.join(self.path, INDEX_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp, os.path.join(self.path, INDEX_FILE))
+
+    def find(self, key):
+        """Returns the index entry for key, or None."""
+        for entry in self.entries:
+            if tuple(entry["key"]) == tuple(key):
+                return entry
+        return None
+
+    def find_sweep(self, sweep_params, if_bw):
+        """Returns the entry of the preferred cal type saved for a sweep."""
+        for cal_type in CAL_PREFERENCE:
+            entry = self.find(
+                cal_key(
+                    sweep_params.start,
+                    sweep_params.stop,
+                    sweep_params.points,
+                    sweep_params.power,
+                    if_bw,
+                    cal_type,
+                )
+            )
+            if entry is not None:
+                return entry
+        return None
+
+    def save(self, key, arrays):
+        """Saves a calibration set, replacing any set with the same key.
+
+        Args:
+            key (tuple): from cal_key
+            arrays (list): the coefficient arrays of the set's cal type
+        """
+        cal_type = CalType[key[-1]]
+        if len(arrays) != CAL_DATA_LENGTH[cal_type]:
+            raise CalLibraryError("{} needs {} arrays".format(cal_type.name, CAL_DATA_LENGTH[cal_type]))
+        self.remove(key)
+        name = uuid.uuid4().hex + ".npz"
+        np.savez(
+            os.path.join(self.path, name),
+            **{"c{:02d}".format(i + 1): np.asarray(a, dtype=">f8") for i, a in enumerate(arrays)}
+        )
+        now = time.time()
+        self.entries.append({"key": list(key), "file": name, "saved": now, "used": now})
+        self.evict(write=False)
+        self.write_index()
+
+    def save_from(self, vna):
+        """Reads the calibrations in the VNA and saves them for its current
+        sweep. Returns the keys saved."""
+        params = vna.get_sweep_params()
+        if_bw = vna.get_if_bw()
+        keys = []
+        for cal_type, arrays in vna.get_calibration_data().items():
+            key = cal_key(params.start, params.stop, params.points, params.power, if_bw, cal_type)
+            self.save(key, arrays)
+            keys.append(key)
+        return keys
+
+    def load(self, entry):
+        """Returns the coefficient arrays of an entry, and marks it used."""
+        with np.load(os.path.join(self.path, entry["file"])) as data:
+            arrays = [data["c{:02d}".format(i + 1)] for i in range(len(data.files))]
+        entry["used"] = time.time()
+        self.write_index()
+        return arrays
+
+    def restore(self, vna, sweep_params):
+        """Loads the set saved for sweep_params into the VNA, if there is one
+        and it isn't the set loaded already.
+
+        Returns the key of the set restored, or None.
+        """
+        entry = self.find_sweep(sweep_params, vna.get_if_bw())
+        if entry is None or tuple(entry["key"]) == vna.cal_key:
+            return None
+        cal_type = CalType[entry["key"][-1]]
+        vna.set_calibration_data(cal_type, {cal_type: self.load(entry)})
+        vna.cal_params = sweep_params
+        vna.cal_key = tuple(entry["key"])
+        return vna.cal_key
+
+    def remove(self, key):
+        """Removes the set saved for key, if any."""
+        entry = self.find(key)
+        if entry is not None:
+            self.entries.remove(entry)
+            try:
+                os.remove(os.path.join(self.path, entry["file"]))
+            except FileNotFoundError:
+                pass
+
+    def evict(self, write=True):
+        """Removes sets older than max_age and the least recently used sets
+        beyond max_sets. Returns the keys removed."""
+        stale = []
+        if self.max_age is not None:
+            now = time.time()
+            stale = [e for e in self.entries if now - e["saved"] > self.max_age]
+        if self.max_sets is not None:
+            kept = sorted((e for e in self.entries if e not in stale), key=lambda e: e["used"])
+            stale += kept[: max(len(kept) - self.max_sets, 0)]
+        keys = [tuple(e["key"]) for e in stale]
+        for key in keys:
+            self.remove(key)
+        if write and keys:
+            self.write_index()
+        return keys
@@ -1,6 +1,8 @@
 from rotary_stage import rotaryStage
+from instrument_server import InstrumentClient, server_running, serve
 # from vna import VNA, FreqSweepParams
 # from NI_pxie import voltageSetter
+# from motion_scheduler import SettleScheduler
 
 import click
 import time
@@ -60,17 +62,23 @@ CAL_STEP = 800
 #     return p
 
 def arm_travel(degrees,dirn):
+    # Use the instrument server if it is running, it keeps the port open
+    if server_running():
+        with InstrumentClient() as c:
+            print(c.call("rotate", degrees=degrees, dirn=dirn))
+        return
+
     s = rotaryStage(COM_PORT)
     time.sleep(2)
 
+    # Returns once the Arduino reports the move is done
     if dirn == 'l':
-        print(s.step_cw(degrees))
+        print(s.step_cw(degrees, wait=True))
     elif dirn == 'r':
-        print(s.step_ccw(degrees))
+        print(s.step_ccw(degrees, wait=True))
     else:
         print("l: cw rotation\nr: ccw rotation")
         
-    time.sleep(1)
     s.disconnect()
     
 # def arm_home():
@@ -115,6 +123,7 @@ def arm_travel(degrees,dirn):
 #     #Freq = np.linspace(6, 13, 1601)
     
 #     s = rotaryStage(COM_PORT)
+#     sched = SettleScheduler()
 #     v = VNA(False)
 #     v.connect(16)
     
@@ -164,19 +173,18 @@ def arm_travel(degrees,dirn):
 #         count = count + 1
         
 #         if dirn == 1:
-#             s.step_cw(abs(step))
+#             sched.run_move(abs(step), lambda: s.step_cw(abs(step), wait=True))
 #         elif dirn == 2 :
-#             s.step_ccw(abs(step))
+#             sched.run_move(abs(step), lambda: s.step_ccw(abs(step), wait=True))
 #         else:
 #             print('angle values are incompatible')
 #             sys.exit()
         
-#         time.sleep(8)
-        
 #         Angle = (s_angle+step*count)
 #         v.WriteData(str(p) + '/', str(Angle), Freq)
     
 #     print(f'completed sweep for: {count} data points')
+#     print(sched.report())
 #     s.disconnect()
 
 # def measure_angle_aps(angleswp,step,savepath,name):
@@ -187,6 +195,7 @@ def arm_travel(degrees,dirn):
 #     #Freq = np.linspace(6, 13, 1601)
     
 #     s = rotaryStage(COM_PORT)
+#     sched = SettleScheduler()
 #     #v = VNA(False)
 #     #v.connect(16)
     
@@ -251,14 +260,13 @@ def arm_travel(degrees,dirn):
 #         count = count + 1
         
 #         if dirn == 1:
-#             s.step_cw(abs(step))
+#             sched.run_move(abs(step), lambda: s.step_cw(abs(step), wait=True))
 #         elif dirn == 2 :
-#             s.step_ccw(abs(step))
+#             sched.run_move(abs(step), lambda: s.step_ccw(abs(step), wait=True))
 #         else:
 #             print('angle values are incompatible')
 #             sys.exit()
         
-#         time.sleep(8)
 #         Angle = (s_angle+step*count)
 #         pwr_v = s.read_msg()
         
@@ -274,6 +282,7 @@ def arm_travel(degrees,dirn):
 #         rtp.updatePlot(Angle,float(pwr_v))
     
 #     print(f'completed sweep for: {count} data points')
+#     print(sched.report())
 #     s.disconnect()
     
 # def measure_fixed_angle(Angle, savepath, name):
@@ -330,9 +339,8 @@ def arm_travel(degrees,dirn):
 
 # def set_ni_voltage_all_channel(voltage):
 #     v_bias = voltage
-#     vs = voltageSetter();
-#     for ch in range(0,32):
-#         vs.setVoltage('ao'+str(ch), v_bias)
+#     with voltageSetter() as vs:
+#         vs.setVoltages([v_bias]*32)
         
 # def set_ni_voltage_one_channel(voltage,channel):
 #     v_bias = voltage
@@ -382,6 +390,17 @@ def cli():
 @click.argument('dirn')
 def rotate(degrees,dirn):
     arm_travel(degrees,dirn)
+
+@cli.command('serve')
+@click.option('-c','--com', default=COM_PORT)
+@click.option('-g','--gpib', type=int, default=16)
+def serve_cmd(com,gpib):
+    serve(com, gpib)
+
+@cli.command()
+def stopserver():
+    with InstrumentClient() as c:
+        c.call("shutdown")
     
 # @cli.command()
 # def getfreq():
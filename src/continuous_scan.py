@@ -0,0 +1,169 @@
+"""Continuous (on-the-fly) angular scans: measure while the stage rotates.
+
+Instead of stop, settle, measure and move for every angle, the stage is
+sent one long move and measurements are triggered back to back while it
+turns. The stage position is polled around every measurement, giving a
+timeline of (time, step count) pairs, and each measurement is tagged with
+the angle interpolated at the middle of its sweep. The traces are
+transferred after the sweep, so the transfer is kept out of that timing.
+resample() then puts the measurements on an evenly spaced angle grid.
+
+Example:
+    scan = continuous_scan(stage, v.sweep, -70, 70, transfer=vna_transfer(v, {"S21": "CHAN3"}))
+    grid = np.arange(-70, 70.05, 0.1)
+    traces = {name: resample(scan.angles, t, grid) for name, t in scan.traces.items()}
+    write_scan_csv("./data/", grid, freq, traces)
+"""
+import os
+import time
+
+import numpy as np
+
+from rotary_stage import START_SPEED
+from vna import write_trace_csv
+
+
+class AngleTimeline:
+    """Stage positions over time, to find the angle at any time of a scan."""
+
+    def __init__(self, steps_per_degree, start_angle, start_steps):
+        """Initializes with given params.
+
+        Args:
+            steps_per_degree (float): rotaryStage.cal
+            start_angle (float): angle in degrees at start_steps
+            start_steps (int): stage position in steps when the scan starts
+        """
+        self.steps_per_degree = steps_per_degree
+        self.start_angle = start_angle
+        self.start_steps = start_steps
+        self.times = []
+        self.steps = []
+
+    def add(self, t, steps):
+        """Adds a position in steps at time.monotonic() t."""
+        self.times.append(t)
+        self.steps.append(steps)
+
+    def angle_at(self, t):
+        """Returns the angle(s) in degrees at time(s) t."""
+        steps = np.interp(t, self.times, self.steps)
+        return self.start_angle + (steps - self.start_steps) / self.steps_per_degree
+
+
+class ScanData:
+    """Measurements from a continuous scan, in the order they were taken."""
+
+    def __init__(self, times, angles, traces, timeline):
+        self.times = times  # mid sweep time.monotonic() per measurement
+        self.angles = angles  # angle in degrees per measurement
+        self.traces = traces  # name to array with one row per measurement
+        self.timeline = timeline
+
+
+def poll_position(stage):
+    """Returns (time, position in steps), the time is the middle of the query."""
+    t0 = time.monotonic()
+    steps = stage.position()
+    return (t0 + time.monotonic()) / 2, steps
+
+
+def vna_acquire(vna, channels):
+    """Returns an acquire function that sweeps and reads traces from a VNA.
+
+    For continuous_scan pass vna.sweep and acquisition_pipeline.vna_transfer
+    instead, so the angle is tagged from the sweep alone.
+
+    Args:
+        vna (VNA): connected VNA
+        channels (dict): name to channel, e.g. {"S21": "CHAN3"}
+    """
+
+    def acquire():
+        vna.sweep()
+        return {name: vna.get_complex(chan) for name, chan in channels.items()}
+
+    return acquire
+
+
+def continuous_scan(stage, acquire, start_angle, stop_angle, speed=START_SPEED, transfer=None):
+    """Rotates from start_angle to stop_angle while measuring continuously.
+
+    The stage should already be at start_angle. It is moved at up to speed
+    steps/s (START_SPEED is the constant rate the stage always managed), and
+    the motion profile is left set to that speed.
+
+    Args:
+        stage (rotaryStage): stage using the framed protocol
+        acquire (function): takes one measurement, e.g. VNA.sweep. The angle
+            is tagged at the middle of the time it takes.
+        start_angle (float): angle in degrees the stage is at
+        stop_angle (float): angle in degrees to stop at
+        speed (float): cruise speed in steps/s
+        transfer (function): reads the measurement and returns a dict of
+            name to numpy array, e.g. from acquisition_pipeline.vna_transfer. Without it acquire
+            returns the dict itself, and reading it is timed too.
+
+    Returns a ScanData.
+    """
+    stage.set_motion_profile(speed, stage.acceleration)
+    t, start_steps = poll_position(stage)
+    timeline = AngleTimeline(stage.cal, start_angle, start_steps)
+    timeline.add(t, start_steps)
+
+    steps = round((stop_angle - start_angle) * stage.cal)
+    seq = stage.start_move(steps)
+    times = []
+    samples = []
+    while ("DONE", seq) not in stage.replies:
+        t0 = time.monotonic()
+        data = acquire()
+        t1 = time.monotonic()
+        if transfer is not None:
+            data = transfer()
+        times.append((t0 + t1) / 2)
+        samples.append(data)
+        # Polling also picks up the DONE of the move once it's finished
+        timeline.add(*poll_position(stage))
+    stage.wait_move(seq, steps)
+
+    times = np.asarray(times)
+    names = samples[0].keys() if samples else []
+    traces = {name: np.array([s[name] for s in samples]) for name in names}
+    return ScanData(times, timeline.angle_at(times), traces, timeline)
+
+
+def resample(angles, data, grid):
+    """Linearly interpolates measurements at angles onto an angle grid.
+
+    Args:
+        angles (np.ndarray): angle of each measurement, in any order
+        data (np.ndarray): one row (e.g. a complex trace) per measurement
+        grid (np.ndarray): angles to interpolate at, the ends are clamped to
+            the first and last measurement
+
+    Returns an array with one row per grid angle.
+    """
+    if len(angles) < 2:
+        raise ValueError("At least 2 measurements are needed to resample")
+    order = np.argsort(angles)
+    angles = np.asarray(angles)[order]
+    data = np.asarray(data)[order]
+    # Index of the measurement at or below each grid angle
+    i = np.clip(np.searchsorted(angles, grid, side="right") - 1, 0, len(angles) - 2)
+    span = angles[i + 1] - angles[i]
+    w = np.clip((grid - angles[i]) / np.where(span == 0, 1, span), 0, 1)
+    w = w.reshape((-1,) + (1,) * (data.ndim - 1))
+    return data[i] * (1 - w) + data[i + 1] * w
+
+
+def write_scan_csv(filepath, grid, Freq, traces):
+    """Writes resampled traces as one file per angle like VNA.WriteData."""
+    for k, angle in enumerate(grid):
+        angle = f"{float(angle):.3f}"
+        write_trace_csv(
+            os.path.join(filepath, angle + ".csv"),
+            "Angle of: " + angle,
+            Freq,
+            {name: t[k] for name, t in traces.items()},
+        )
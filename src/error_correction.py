@@ -0,0 +1,136 @@
+"""Host-side full 2-port (12-term) error correction.
+
+The VNA corrects the traces with the one calibration it has active, and
+changing it means uploading all the coefficients. Measuring raw
+(uncorrected) traces instead and correcting them here with numpy lets a
+whole campaign be corrected, or corrected again, against any saved
+calibration set without the instrument.
+
+The CALIFUL2 arrays read with VNA.get_calibration_data (or saved in a
+CalLibrary) are, in OUTPCALC order:
+
+    01 EDF  directivity          07 EDR
+    02 ESF  source match         08 ESR
+    03 ERF  reflection tracking  09 ERR
+    04 EXF  isolation            10 EXR
+    05 ELF  load match           11 ELR
+    06 ETF  transmission track.  12 ETR
+
+forward terms on the left, reverse on the right, each as FORM3 real and
+imaginary pairs per point.
+
+Example:
+    terms = ErrorTerms.from_cal_data(library.load(entry))
+    raw = v.get_raw_sparams()            # OUTPRAW1..4
+    s = terms.correct(raw)               # {"S11": ..., "S21": ..., ...}
+    correct_store("./raw_sweep", "./corrected", terms)
+"""
+import numpy as np
+
+from measurement_store import MeasurementStore
+
+TERMS = [
+    "EDF", "ESF", "ERF", "EXF", "ELF", "ETF",
+    "EDR", "ESR", "ERR", "EXR", "ELR", "ETR",
+]
+SPARAMS = ["S11", "S21", "S12", "S22"]
+CHUNK = 256  # angles corrected at a time by correct_store
+
+
+class ErrorTerms:
+    """The 12 error terms of a full 2-port calibration, per point."""
+
+    def __init__(self, terms):
+        """Initializes with given params.
+
+        Args:
+            terms (dict): name in TERMS to complex array, one value per point
+        """
+        missing = [t for t in TERMS if t not in terms]
+        if missing:
+            raise ValueError("Missing error terms: " + ", ".join(missing))
+        self.terms = {t: np.asarray(terms[t], dtype=np.complex128) for t in TERMS}
+        for t in TERMS:
+            setattr(self, t, self.terms[t])
+
+    @classmethod
+    def from_cal_data(cls, arrays):
+        """Returns the terms from the 12 CALIFUL2 arrays in OUTPCALC order,
+        each real/imaginary pairs as read in FORM3."""
+        if len(arrays) != len(TERMS):
+            raise ValueError("A full 2-port calibration has {} arrays".format(len(TERMS)))
+        terms = {}
+        for name, a in zip(TERMS, arrays):
+            a = np.asarray(a, dtype=np.float64)
+            terms[name] = a[0::2] + 1j * a[1::2]
+        return cls(terms)
+
+    @property
+    def points(self):
+        return len(self.terms["EDF"])
+
+    def correct(self, raw):
+        """Returns the corrected S-params of raw measurements.
+
+        Args:
+            raw (dict): "S11", "S21", "S12" and "S22" to raw complex traces,
+                of shape (..., points), e.g. one row per angle
+
+        Returns a dict of the same S-params, corrected.
+        """
+        n11 = (np.asarray(raw["S11"]) - self.EDF) / self.ERF
+        n21 = (np.asarray(raw["S21"]) - self.EXF) / self.ETF
+        n12 = (np.asarray(raw["S12"]) - self.EXR) / self.ETR
+        n22 = (np.asarray(raw["S22"]) - self.EDR) / self.ERR
+        d = (1 + n11 * self.ESF) * (1 + n22 * self.ESR) - n21 * n12 * self.ELF * self.ELR
+        return {
+            "S11": (n11 * (1 + n22 * self.ESR) - self.ELF * n21 * n12) / d,
+            "S21": n21 * (1 + n22 * (self.ESR - self.ELF)) / d,
+            "S12": n12 * (1 + n11 * (self.ESF - self.ELR)) / d,
+            "S22": (n22 * (1 + n11 * self.ESF) - self.ELR * n21 * n12) / d,
+        }
+
+    def distort(self, actual):
+        """Returns what the VNA would measure raw for the actual S-params.
+
+        The inverse of correct, for checking it and for simulating raw data.
+        """
+        s11, s21, s12, s22 = (np.asarray(actual[s]) for s in SPARAMS)
+        det = s11 * s22 - s21 * s12
+        df = 1 - self.ESF * s11 - self.ELF * s22 + self.ESF * self.ELF * det
+        dr = 1 - self.ESR * s22 - self.ELR * s11 + self.ESR * self.ELR * det
+        return {
+            "S11": self.EDF + self.ERF * (s11 - self.ELF * det) / df,
+            "S21": self.EXF + self.ETF * s21 / df,
+            "S22": self.EDR + self.ERR * (s22 - self.ELR * det) / dr,
+            "S12": self.EXR + self.ETR * s12 / dr,
+        }
+
+
+def correct_store(src, dst, terms, chunk=CHUNK):
+    """Corrects a MeasurementStore of raw traces into a new store.
+
+    Args:
+        src (str): folder of a store with raw S11, S21, S12 and S22
+        dst (str): folder for the corrected store
+        terms (ErrorTerms): calibration to correct with
+        chunk (int): angles corrected at a time
+
+    Returns the corrected MeasurementStore, closed.
+    """
+    raw = MeasurementStore(src)
+    missing = [s for s in SPARAMS if s not in raw.sparams]
+    if missing:
+        raise ValueError("{} has no {}".format(src, ", ".join(missing)))
+    if raw.points != terms.points:
+        raise ValueError("The calibration has {} points, the store {}".format(terms.points, raw.points))
+    attrs = dict(raw.attrs, corrected=True)
+    angles = raw.angles
+    traces = {s: raw.trace(s) for s in SPARAMS}
+    with MeasurementStore.create(dst, raw.freq, SPARAMS, attrs) as out:
+        for start in range(0, raw.count, chunk):
+            rows = slice(start, start + chunk)
+            corrected = terms.correct({s: t[rows] for s, t in traces.items()})
+            for k, angle in enumerate(angles[rows]):
+                out.append(angle, {s: corrected[s][k] for s in SPARAMS})
+    return out
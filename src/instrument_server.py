@@ -0,0 +1,242 @@
+"""Long lived server that keeps the instrument sessions open.
+
+Opening the Arduino serial port resets it, so every `ctrack rotate` used to
+cost a new interpreter, a 2 s reset wait and a 1 s wait before closing. The
+server opens the rotary stage, VNA and VISA instruments (TLS, oscilloscope)
+once and serves requests from clients over localhost TCP.
+
+Requests and replies are single lines of JSON:
+    {"cmd": "rotate", "args": {"degrees": 0.1, "dirn": "r"}}
+    {"ok": true, "result": "moving: 80"}
+
+Start it with `ctrack serve` (or `python console_interface.py serve`).
+"""
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+import util
+
+HOST = "127.0.0.1"
+PORT = 50507
+ARDUINO_RESET_TIME = 2  # in s, the Arduino resets when the port is opened
+
+
+class InstrumentServerError(Exception):
+    """Error reported by the instrument server."""
+
+    pass
+
+
+class InstrumentSessions:
+    """Holds the open instrument sessions and runs commands on them.
+
+    Sessions are opened the first time a command needs them. Each command
+    is a method called do_<cmd>, and commands are run one at a time.
+    """
+
+    def __init__(self, com_port, vna_address=16):
+        self.com_port = com_port
+        self.vna_address = vna_address
+        self.lock = threading.Lock()
+        self.stage = None
+        self.vna = None
+        self.rm = None
+        self.resources = {}
+
+    def run(self, cmd, args):
+        """Runs the command cmd with keyword arguments args."""
+        handler = getattr(self, "do_" + cmd, None)
+        if handler is None:
+            raise InstrumentServerError("Unknown command {}".format(cmd))
+        with self.lock:
+            return handler(**args)
+
+    def get_stage(self):
+        """Returns the rotary stage, connecting to it if needed."""
+        if self.stage is None:
+            from rotary_stage import rotaryStage
+
+            self.stage = rotaryStage(self.com_port)
+            time.sleep(ARDUINO_RESET_TIME)
+        return self.stage
+
+    def get_vna(self):
+        """Returns the VNA, connecting to it if needed."""
+        if self.vna is None:
+            from vna import VNA
+
+            vna = VNA(False)
+            if vna.connect(self.vna_address) is False:
+                raise InstrumentServerError("Could not connect to VNA")
+            self.vna = vna
+        return self.vna
+
+    def get_resource(self, address, timeout):
+        """Returns the VISA resource at address, opening it if needed."""
+        if address not in self.resources:
+            import pyvisa
+
+            if self.rm is None:
+                self.rm = pyvisa.ResourceManager()
+            resource = self.rm.open_resource(address)
+            resource.timeout = timeout
+            self.resources[address] = resource
+        return self.resources[address]
+
+    def close(self):
+        """Closes all open sessions."""
+        if self.stage is not None:
+            self.stage.disconnect()
+            self.stage = None
+        if self.vna is not None:
+            self.vna.disconnect()
+            self.vna = None
+        for resource in self.resources.values():
+            resource.close()
+        self.resources = {}
+
+    def do_ping(self):
+        return "pong"
+
+    def do_rotate(self, degrees, dirn):
+        """Steps the stage, dirn is "l" (cw) or "r" (ccw) like `ctrack rotate`.
+
+        Replies once the move is finished.
+        """
+        stage = self.get_stage()
+        if dirn == "l":
+            return stage.step_cw(degrees, wait=True)
+        elif dirn == "r":
+            return stage.step_ccw(degrees, wait=True)
+        raise InstrumentServerError("l: cw rotation\nr: ccw rotation")
+
+    def do_set_motion_profile(self, max_speed, acceleration):
+        return self.get_stage().set_motion_profile(max_speed, acceleration)
+
+    def do_reset_stage(self):
+        self.get_stage().reset_stage()
+
+    def do_vna_get_sweep_params(self):
+        p = self.get_vna().get_sweep_params()
+        return {
+            "start": p.start,
+            "stop": p.stop,
+            "points": p.points,
+            "power": p.power,
+            "averaging": p.averaging,
+        }
+
+    def do_vna_sweep(self):
+        self.get_vna().sweep()
+
+    def do_vna_write_data(self, filepath, angle, freq):
+        self.get_vna().WriteData(filepath, angle, freq)
+
+    def do_vna_set_if_bw(self, freq):
+        self.get_vna().set_if_bw(freq)
+
+    def do_visa_write(self, address, msg, timeout=3000):
+        self.get_resource(address, timeout).write(msg)
+
+    def do_visa_query(self, address, msg, timeout=3000):
+        return self.get_resource(address, timeout).query(msg)
+
+    def do_visa_query_ascii_values(self, address, msg, timeout=3000):
+        return list(self.get_resource(address, timeout).query_ascii_values(msg))
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Handles a client connection, one JSON request per line."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                util.dprint("server: {}".format(request))
+                if request["cmd"] == "shutdown":
+                    self.reply({"ok": True, "result": None})
+                    threading.Thread(target=self.server.shutdown).start()
+                    return
+                result = self.server.sessions.run(
+                    request["cmd"], request.get("args", {})
+                )
+                self.reply({"ok": True, "result": result})
+            except Exception as e:
+                self.reply({"ok": False, "error": "{}: {}".format(type(e).__name__, e)})
+
+    def reply(self, msg):
+        self.wfile.write((json.dumps(msg) + "\n").encode())
+
+
+class InstrumentServer(socketserver.ThreadingTCPServer):
+    """TCP server on localhost that owns an InstrumentSessions."""
+
+    # On Windows this would let a second server bind the same port
+    allow_reuse_address = os.name != "nt"
+    daemon_threads = True
+
+    def __init__(self, sessions, host=HOST, port=PORT):
+        super().__init__((host, port), RequestHandler)
+        self.sessions = sessions
+
+
+def serve(com_port, vna_address=16, host=HOST, port=PORT):
+    """Runs the server until a client sends shutdown or Ctrl+C is pressed."""
+    sessions = InstrumentSessions(com_port, vna_address)
+    server = InstrumentServer(sessions, host, port)
+    print("Instrument server listening on {}:{}".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        sessions.close()
+
+
+class InstrumentClient:
+    """Thin client for the instrument server.
+
+    Example:
+        c = InstrumentClient()
+        c.call("rotate", degrees=0.1, dirn="r")
+    """
+
+    def __init__(self, host=HOST, port=PORT, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.file = self.sock.makefile("rwb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def call(self, cmd, **args):
+        """Runs cmd on the server and returns its result."""
+        self.file.write((json.dumps({"cmd": cmd, "args": args}) + "\n").encode())
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise InstrumentServerError("Server closed the connection")
+        reply = json.loads(line)
+        if not reply["ok"]:
+            raise InstrumentServerError(reply["error"])
+        return reply["result"]
+
+
+def server_running(host=HOST, port=PORT):
+    """Returns True if an instrument server is accepting connections."""
+    try:
+        with socket.create_connection((host, port), timeout=0.5):
+            return True
+    except OSError:
+        return False
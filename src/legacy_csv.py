@@ -0,0 +1,196 @@
+"""Fast bulk parser for the CSV files written by the measurement scripts.
+
+Recognises the layouts found in the data archives:
+
+    writedata     "Angle of: <angle>" title, then rows of a label followed by
+                  comma separated values ("Freq [GHz],", "S21 [Mag]," ...),
+                  from VNA.WriteData, WriteSelectData and the templates
+    point         same rows with a "point of: <name>" title, from
+                  VNA.WriteData_singlePoint
+    rows          same rows without a title, as written by the NI controller
+                  template ("S21 [dB]," ...), named after the file
+    columns       a header line and columns of numbers, like the
+                  "Wavelength (nm),Current (A)" files from angular_sweep.py,
+                  named (and angled) after the file
+
+All the numbers of a file are converted with one numpy call instead of a
+float() per value, and parse_dir spreads the files over a process pool. On Windows
+call parse_dir from under `if __name__ == "__main__":`.
+
+Example:
+    ds = parse_dir("./Data/")
+    ds.angles             # angle per file (NaN if unknown)
+    ds.stack("Current (A)")  # (files, points) array
+"""
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+WRITEDATA = "writedata"
+POINT = "point"
+ROWS = "rows"
+COLUMNS = "columns"
+
+
+class LegacyCSVError(Exception):
+    """Error parsing a legacy CSV file."""
+
+    pass
+
+
+class LegacyRecord:
+    """Contents of one legacy CSV file."""
+
+    def __init__(self, path, kind, name, angle, x_label, x, traces):
+        self.path = path
+        self.kind = kind  # WRITEDATA, POINT, ROWS or COLUMNS
+        self.name = name  # angle or point name from the title, or file name
+        self.angle = angle  # in degrees, NaN if the file has no angle
+        self.x_label = x_label  # e.g. "Freq [GHz]" or "Wavelength (nm)"
+        self.x = x
+        self.traces = traces  # label (e.g. "S21 [Mag]") to numpy array
+
+
+class LegacyDataset:
+    """Records from a set of legacy CSV files, sorted by angle then name."""
+
+    def __init__(self, records):
+        self.records = sorted(
+            records, key=lambda r: (np.isnan(r.angle), r.angle, r.name)
+        )
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    @property
+    def angles(self):
+        return np.array([r.angle for r in self.records])
+
+    @property
+    def labels(self):
+        """Trace labels found in every record."""
+        if not self.records:
+            return []
+        common = set(self.records[0].traces)
+        for r in self.records[1:]:
+            common &= set(r.traces)
+        return [l for l in self.records[0].traces if l in common]
+
+    def x(self):
+        """Returns the x values (e.g. frequencies) shared by the records."""
+        x = self.records[0].x
+        for r in self.records[1:]:
+            if len(r.x) != len(x) or not np.allclose(r.x, x):
+                raise LegacyCSVError("{} has different x values".format(r.path))
+        return x
+
+    def stack(self, label):
+        """Returns a (records, points) array of the trace label."""
+        try:
+            return np.vstack([r.traces[label] for r in self.records])
+        except KeyError:
+            raise LegacyCSVError("{} is not in every record".format(label))
+        except ValueError:
+            raise LegacyCSVError("{} has different lengths".format(label))
+
+
+def file_angle(path):
+    """Returns the angle in a file name like "-12.5.csv", or NaN."""
+    try:
+        return float(os.path.splitext(os.path.basename(path))[0])
+    except ValueError:
+        return float("nan")
+
+
+def to_floats(path, text):
+    """Converts comma separated numbers in one call."""
+    try:
+        return np.fromstring(text, sep=",")
+    except ValueError:
+        raise LegacyCSVError("{} has values that are not numbers".format(path))
+
+
+def parse_text(path, text):
+    """Parses the contents of a legacy CSV file, returns a LegacyRecord."""
+    lines = text.splitlines()
+    if not lines:
+        raise LegacyCSVError("{} is empty".format(path))
+    first = lines[0].strip()
+    name = os.path.splitext(os.path.basename(path))[0]
+    angle = file_angle(path)
+
+    if first.startswith("Angle of:") or first.startswith("point of:"):
+        title, _, value = first.partition(":")
+        name = value.strip()
+        if title == "Angle of":
+            kind = WRITEDATA
+            angle = float(name)
+        else:
+            kind = POINT
+        lines = lines[1:]
+    elif first.startswith("Freq [GHz],"):
+        kind = ROWS
+    else:
+        return parse_columns(path, lines, name, angle)
+
+    labels = []
+    rows = []
+    for line in lines:
+        label, _, values = line.partition(",")
+        if values.strip():
+            labels.append(label.strip())
+            rows.append(values)
+    # One conversion for the whole file, then split back into rows
+    values = to_floats(path, ",".join(rows))
+    ends = np.cumsum([r.count(",") + 1 for r in rows])
+    if len(values) != (ends[-1] if rows else 0):
+        raise LegacyCSVError("{} has rows that are not numbers".format(path))
+    traces = dict(zip(labels, np.split(values, ends[:-1])))
+    if "Freq [GHz]" not in traces:
+        raise LegacyCSVError("{} has no Freq [GHz] row".format(path))
+    x = traces.pop("Freq [GHz]")
+    return LegacyRecord(path, kind, name, angle, "Freq [GHz]", x, traces)
+
+
+def parse_columns(path, lines, name, angle):
+    """Parses a header line and columns of numbers."""
+    header = [h.strip() for h in lines[0].split(",")]
+    body = ",".join(l for l in lines[1:] if l.strip())
+    values = to_floats(path, body)
+    if len(values) % len(header):
+        raise LegacyCSVError("{} doesn't have {} columns".format(path, len(header)))
+    values = values.reshape(-1, len(header))
+    traces = {h: values[:, i] for i, h in enumerate(header[1:], 1)}
+    return LegacyRecord(path, COLUMNS, name, angle, header[0], values[:, 0], traces)
+
+
+def parse_file(path):
+    """Parses one legacy CSV file, returns a LegacyRecord."""
+    with open(path, encoding="utf-8") as f:
+        return parse_text(path, f.read())
+
+
+def parse_files(paths, processes=None):
+    """Parses CSV files into a LegacyDataset.
+
+    Args:
+        paths (list): files to parse
+        processes (int): worker processes, 1 parses in this process and None
+            uses one per CPU
+    """
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(paths) < 2:
+        return LegacyDataset([parse_file(p) for p in paths])
+    with ProcessPoolExecutor(processes) as pool:
+        chunk = max(1, len(paths) // (4 * processes))
+        return LegacyDataset(list(pool.map(parse_file, paths, chunksize=chunk)))
+
+
+def parse_dir(path, pattern="*.csv", processes=None):
+    """Parses all CSV files in a folder into a LegacyDataset."""
+    return parse_files(sorted(glob.glob(os.path.join(path, pattern))), processes)
@@ -0,0 +1,209 @@
+"""Columnar store for angular sweep measurements.
+
+VNA.WriteData writes one text CSV per angle, which is slow to write (every
+value is stringified) and slow to read back. A MeasurementStore keeps a
+whole sweep in one folder instead:
+
+    meta.json        sweep metadata, S-params, number of angles stored
+    freq.npy         frequencies in Hz
+    angles.f8        angle in degrees of each row, appended as float64
+    <sparam>.c8      complex64 traces, one row of points per angle
+
+The .f8 and .c8 files are raw little-endian arrays that are appended to as
+angles are measured and memory-mapped when read, so reading one angle or
+one frequency only touches the bytes needed. FORM5 data is 32 bit, so
+complex64 keeps all of it.
+
+Example:
+    store = MeasurementStore.create("./sweep1", freq, ["S12", "S21"],
+                                    sweep_attrs(params, v.get_if_bw(), v.cal_type))
+    store.append(angle, {"S12": v.get_complex("CHAN2"), "S21": v.get_complex("CHAN3")})
+    store.close()
+
+    store = MeasurementStore("./sweep1")
+    s21 = store.trace("S21")  # (angles, points) memory-mapped array
+"""
+import json
+import os
+
+import numpy as np
+
+from vna import write_trace_csv
+
+META_FILE = "meta.json"
+FREQ_FILE = "freq.npy"
+ANGLES_FILE = "angles.f8"
+TRACE_DTYPE = np.dtype("<c8")
+ANGLE_DTYPE = np.dtype("<f8")
+
+
+class MeasurementStoreError(Exception):
+    """Error reading or writing a MeasurementStore."""
+
+    pass
+
+
+def sweep_attrs(sweep_params, if_bw=None, cal_type=None):
+    """Returns the metadata of a sweep as a dict that can be stored.
+
+    Args:
+        sweep_params (FreqSweepParams): sweep settings
+        if_bw (float): IF bandwidth in Hz
+        cal_type (CalType): calibration active during the sweep
+    """
+    return {
+        "start": sweep_params.start,
+        "stop": sweep_params.stop,
+        "points": sweep_params.points,
+        "power": sweep_params.power,
+        "averaging": sweep_params.averaging,
+        "if_bw": None if if_bw is None else float(if_bw),
+        "cal_type": None if cal_type is None else cal_type.name,
+    }
+
+
+class MeasurementStore:
+    """Complex S-param traces of an angular sweep, keyed by angle."""
+
+    def __init__(self, path):
+        """Opens an existing store for reading and appending.
+
+        Args:
+            path (str): folder of the store
+        """
+        self.path = path
+        try:
+            with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise MeasurementStoreError("No measurement store at {}".format(path))
+        self.sparams = meta["sparams"]
+        self.attrs = meta["attrs"]
+        self.count = meta["count"]
+        self.freq = np.load(os.path.join(path, FREQ_FILE))
+        self.files = None  # open for appending
+
+    @classmethod
+    def create(cls, path, freq, sparams, attrs=None):
+        """Creates a new, empty store and returns it.
+
+        Args:
+            path (str): folder for the store, created if needed
+            freq (np.ndarray): frequencies of the trace points in Hz
+            sparams (list): names of the traces stored for every angle
+            attrs (dict): metadata, e.g. from sweep_attrs
+        """
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, META_FILE)):
+            raise MeasurementStoreError("{} already has a store".format(path))
+        np.save(os.path.join(path, FREQ_FILE), np.asarray(freq, dtype=np.float64))
+        for name in [ANGLES_FILE] + [s + ".c8" for s in sparams]:
+            open(os.path.join(path, name), "wb").close()
+        meta = {"sparams": list(sparams), "attrs": attrs or {}, "count": 0}
+        with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=1)
+        return cls(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def points(self):
+        return len(self.freq)
+
+    def open_files(self):
+        """Opens the data files for appending."""
+        if self.files is None:
+            # Drops rows written after the last flush by a program that died
+            for name in [ANGLES_FILE] + [s + ".c8" for s in self.sparams]:
+                size = self.count * (
+                    ANGLE_DTYPE.itemsize if name == ANGLES_FILE
+                    else TRACE_DTYPE.itemsize * self.points
+                )
+                with open(os.path.join(self.path, name), "r+b") as f:
+                    f.truncate(size)
+            self.files = {
+                name: open(os.path.join(self.path, name), "ab")
+                for name in [ANGLES_FILE] + [s + ".c8" for s in self.sparams]
+            }
+
+    def append(self, angle, traces):
+        """Appends the traces measured at one angle.
+
+        Args:
+            angle (float): angle in degrees
+            traces (dict): S-param name to complex trace, for every S-param
+        """
+        for s in self.sparams:
+            if s not in traces or len(traces[s]) != self.points:
+                raise MeasurementStoreError(
+                    "Need a {} point trace for {}".format(self.points, s)
+                )
+        self.open_files()
+        for s in self.sparams:
+            self.files[s + ".c8"].write(np.asarray(traces[s], dtype=TRACE_DTYPE).tobytes())
+        self.files[ANGLES_FILE].write(np.asarray([angle], dtype=ANGLE_DTYPE).tobytes())
+        self.count += 1
+
+    def flush(self, fsync=False):
+        """Writes buffered data and the angle count to disk.
+
+        Args:
+            fsync (bool): also ask the OS to write to the disk
+        """
+        if self.files is not None:
+            for f in self.files.values():
+                f.flush()
+                if fsync:
+                    os.fsync(f.fileno())
+        meta = {"sparams": self.sparams, "attrs": self.attrs, "count": self.count}
+        tmp = os.path.join(self.path, META_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(tmp, os.path.join(self.path, META_FILE))
+
+    def close(self):
+        """Flushes and closes the data files."""
+        self.flush()
+        if self.files is not None:
+            for f in self.files.values():
+                f.close()
+            self.files = None
+
+    @property
+    def angles(self):
+        """Angles in degrees of the stored rows."""
+        if self.files is not None:
+            self.files[ANGLES_FILE].flush()
+        return np.fromfile(
+            os.path.join(self.path, ANGLES_FILE), dtype=ANGLE_DTYPE, count=self.count
+        )
+
+    def trace(self, sparam):
+        """Returns a memory-mapped (angles, points) complex array for sparam."""
+        if self.count == 0:
+            return np.empty((0, self.points), dtype=TRACE_DTYPE)
+        if self.files is not None:
+            self.files[sparam + ".c8"].flush()
+        return np.memmap(
+            os.path.join(self.path, sparam + ".c8"),
+            dtype=TRACE_DTYPE,
+            mode="r",
+            shape=(self.count, self.points),
+        )
+
+    def export_csv(self, filepath):
+        """Writes one CSV per angle in the VNA.WriteData layout."""
+        freq = self.freq / 1e9
+        traces = {s: self.trace(s) for s in self.sparams}
+        for k, angle in enumerate(self.angles):
+            angle = f"{float(angle):.3f}"
+            write_trace_csv(
+                os.path.join(filepath, angle + ".csv"),
+                "Angle of: " + angle,
+                freq,
+                {s: t[k] for s, t in traces.items()},
+            )
@@ -0,0 +1,142 @@
+"""Motion time model and settle scheduler for the circular track.
+
+The firmware steps at a known rate (a fixed 2 ms period, or a trapezoidal
+profile set with rotaryStage.set_motion_profile) and the stage moves
+rotaryStage.cal (800) steps per degree, so the time a move takes follows
+from its step count. The scheduler adds a mechanical settle time to get the
+minimum dwell for an angle step, and keeps track of predicted vs observed
+move times so the model can be checked against the hardware.
+"""
+import time
+
+import numpy as np
+
+import rotary_stage
+from rotary_stage import COMMAND_LATENCY, DEFAULT_ACCELERATION, START_SPEED
+
+STEPS_PER_DEGREE = 800  # same as rotaryStage.cal
+SETTLE_TIME = 0.5  # in s, for the arm to stop vibrating after a move
+
+
+class MotionModel:
+    """Predicts how long the stage takes to move."""
+
+    def __init__(
+        self,
+        steps_per_degree=STEPS_PER_DEGREE,
+        max_speed=START_SPEED,
+        acceleration=DEFAULT_ACCELERATION,
+        command_delay=COMMAND_LATENCY,
+    ):
+        """Initializes with given params.
+
+        Args:
+            steps_per_degree (float): stepper steps per degree of rotation
+            max_speed (float): cruise speed in steps/s
+            acceleration (float): acceleration in steps/s^2
+            command_delay (float): time in s from sending a command until the
+                motor starts moving
+        """
+        self.steps_per_degree = steps_per_degree
+        self.max_speed = max_speed
+        self.acceleration = acceleration
+        self.command_delay = command_delay
+
+    @classmethod
+    def for_stage(cls, stage, command_delay=COMMAND_LATENCY):
+        """Returns a model using the calibration and profile of a rotaryStage."""
+        return cls(stage.cal, stage.max_speed, stage.acceleration, command_delay)
+
+    def steps(self, degrees):
+        """Returns the number of steps sent for a move of degrees."""
+        return round(degrees * self.steps_per_degree)
+
+    def move_time(self, degrees):
+        """Returns the predicted time in s to move by degrees."""
+        steps = abs(self.steps(degrees))
+        if steps == 0:
+            return 0.0
+        return self.command_delay + rotary_stage.move_time(
+            steps, self.max_speed, self.acceleration
+        )
+
+
+class SettleScheduler:
+    """Works out the dwell for each angle step and times the moves.
+
+    Example:
+        sched = SettleScheduler(settle_time=0.3)
+        for angle in angles:
+            sched.run_move(step, lambda: stage.step_ccw(step, wait=True))
+            measure()
+        print(sched.report())
+    """
+
+    def __init__(self, model=None, settle_time=SETTLE_TIME):
+        """Initializes with given params.
+
+        Args:
+            model (MotionModel): motion model, the default one if None
+            settle_time (float): time in s to wait after motion stops
+        """
+        self.model = MotionModel() if model is None else model
+        self.settle_time = settle_time
+        self.moves = []  # (degrees, predicted s, observed s) per move
+
+    def dwell(self, degrees):
+        """Returns the minimum time in s from sending a move until measuring."""
+        return self.model.move_time(degrees) + self.settle_time
+
+    def sweep_time(self, angles):
+        """Returns the predicted time in s spent moving over a list of angles."""
+        return sum(self.dwell(d) for d in np.diff(angles))
+
+    def run_move(self, degrees, move):
+        """Runs a blocking move, records its time and waits for it to settle.
+
+        Args:
+            degrees (float): size of the move, used for the prediction
+            move (function): starts the move and returns when it's done, e.g.
+                lambda: stage.step_ccw(degrees, wait=True)
+
+        Returns what move returned.
+        """
+        start = time.monotonic()
+        result = move()
+        observed = time.monotonic() - start
+        self.moves.append((degrees, self.model.move_time(degrees), observed))
+        self.settle()
+        return result
+
+    def settle(self):
+        """Waits for the mechanical settle time."""
+        time.sleep(self.settle_time)
+
+    def wait(self, degrees, start):
+        """Sleeps until a move of degrees sent at time.monotonic() start has
+        had time to finish and settle.
+
+        For stages that can't report when a move is done.
+        """
+        remaining = start + self.dwell(degrees) - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def report(self):
+        """Returns a summary of predicted vs observed move times."""
+        if not self.moves:
+            return "No moves recorded"
+        predicted = np.array([m[1] for m in self.moves])
+        observed = np.array([m[2] for m in self.moves])
+        error = observed - predicted
+        return (
+            "{} moves: predicted {:.2f} s, observed {:.2f} s, "
+            "error mean {:+.3f} s max {:+.3f} s, settle {:.2f} s".format(
+                len(self.moves),
+                predicted.sum(),
+                observed.sum(),
+                error.mean(),
+                error[np.argmax(np.abs(error))],
+                self.settle_time * len(self.moves),
+            )
+        )
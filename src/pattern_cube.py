@@ -0,0 +1,195 @@
+"""Memory-mapped (angle, sparam, freq) cube for post-processing sweeps.
+
+A fine angular sweep is hundreds or thousands of WriteData CSV files, and
+loading it means parsing all of them in full. PatternCube ingests the CSV
+files once into a cache folder:
+
+    cube.npy      complex64 array of shape (angles, sparams, points)
+    angles.npy    angle in degrees of each row, sorted
+    freq.npy      frequencies in GHz as written in the CSVs
+    meta.json     S-param names, the CSV folder and the CSV files it was
+                  made from
+
+and then serves the cube memory-mapped, so a single angle or a single
+frequency cut only reads the bytes it needs.
+
+Example:
+    cube = PatternCube.from_csv_dir("./data/sweep1/")
+    pattern = cube.cut(freq=10.0, sparam="S21")   # complex, one per angle
+    trace = cube.at_angle(0.0, "S21")             # complex, one per point
+"""
+import glob
+import json
+import os
+
+import numpy as np
+
+from legacy_csv import WRITEDATA, parse_file
+
+CUBE_FILE = "cube.npy"
+ANGLES_FILE = "angles.npy"
+FREQ_FILE = "freq.npy"
+META_FILE = "meta.json"
+CACHE_FOLDER = ".cube"
+
+
+class PatternCubeError(Exception):
+    """Error reading or building a PatternCube."""
+
+    pass
+
+
+def csv_files(paths):
+    """Returns the sorted file names of paths, to tell if a cube is stale."""
+    return sorted(os.path.basename(p) for p in paths)
+
+
+def read_writedata_csv(path):
+    """Reads a file written by VNA.WriteData.
+
+    Returns (title, freq, traces), where traces maps S-param names to
+    complex arrays made from the "[Mag]" or "[dB]" and "[Phase]" (degrees)
+    rows.
+    """
+    record = parse_file(path)
+    if record.x_label != "Freq [GHz]":
+        raise PatternCubeError("{} is not a WriteData file".format(path))
+    rows = record.traces
+    traces = {}
+    for label in rows:
+        for unit in ("[Mag]", "[dB]"):
+            if label.endswith(unit):
+                name = label[: -len(unit)].strip()
+                mag = rows[label]
+                phase = rows.get(name + " [Phase]", np.zeros_like(mag))
+                traces[name] = 10 ** (mag / 20) * np.exp(1j * np.radians(phase))
+    if record.kind == WRITEDATA:
+        title = "Angle of: " + record.name
+    else:
+        title = record.name
+    return title, record.x, traces
+
+
+def csv_angle(path, title):
+    """Returns the angle of a WriteData file, from its title or its name."""
+    if title.startswith("Angle of:"):
+        angle = title.split(":", 1)[1]
+    else:
+        angle = os.path.splitext(os.path.basename(path))[0]
+    try:
+        return float(angle)
+    except ValueError:
+        raise PatternCubeError("{} has no angle in its title or name".format(path))
+
+
+class PatternCube:
+    """Complex S-param traces of a sweep as a memory-mapped cube."""
+
+    def __init__(self, cache_dir):
+        """Opens a cube that has been built, see from_csv_dir.
+
+        Args:
+            cache_dir (str): folder with the cube files
+        """
+        try:
+            with open(os.path.join(cache_dir, META_FILE), encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise PatternCubeError("No pattern cube in {}".format(cache_dir))
+        self.cache_dir = cache_dir
+        self.sparams = meta["sparams"]
+        self.angles = np.load(os.path.join(cache_dir, ANGLES_FILE))
+        self.freq = np.load(os.path.join(cache_dir, FREQ_FILE))
+        self.data = np.load(os.path.join(cache_dir, CUBE_FILE), mmap_mode="r")
+
+    @classmethod
+    def from_csv_dir(cls, csv_dir, cache_dir=None, rebuild=False):
+        """Opens the cube for a folder of WriteData CSVs, building it if needed.
+
+        The cube is rebuilt when any CSV is newer than it, or when CSVs
+        were added or removed since it was built.
+
+        Args:
+            csv_dir (str): folder with the CSV files
+            cache_dir (str): where to keep the cube, csv_dir/.cube by default
+            rebuild (bool): rebuild even if the cube is up to date
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join(csv_dir, CACHE_FOLDER)
+        paths = glob.glob(os.path.join(csv_dir, "*.csv"))
+        if not paths:
+            raise PatternCubeError("No CSV files in {}".format(csv_dir))
+
+        meta_path = os.path.join(cache_dir, META_FILE)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                built_from = json.load(f).get("files")
+        except FileNotFoundError:
+            built_from = None
+        newest = max(os.path.getmtime(p) for p in paths)
+        if (
+            rebuild
+            or built_from != csv_files(paths)
+            or os.path.getmtime(meta_path) < newest
+        ):
+            cls.build(paths, cache_dir, csv_dir)
+        return cls(cache_dir)
+
+    @staticmethod
+    def build(paths, cache_dir, source=""):
+        """Parses CSV files into a cube in cache_dir, one file at a time."""
+        first_title, freq, first = read_writedata_csv(paths[0])
+        sparams = list(first)
+        # Sort by angle without parsing the data again
+        angles = []
+        for p in paths:
+            with open(p, encoding="utf-8") as f:
+                angles.append(csv_angle(p, f.readline().strip()))
+        order = np.argsort(angles)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        meta_path = os.path.join(cache_dir, META_FILE)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)  # marks the cube as incomplete while building
+        cube = np.lib.format.open_memmap(
+            os.path.join(cache_dir, CUBE_FILE),
+            mode="w+",
+            dtype=np.complex64,
+            shape=(len(paths), len(sparams), len(freq)),
+        )
+        for row, k in enumerate(order):
+            _, f, traces = read_writedata_csv(paths[k])
+            if len(f) != len(freq) or any(s not in traces for s in sparams):
+                raise PatternCubeError("{} doesn't match {}".format(paths[k], paths[0]))
+            for i, s in enumerate(sparams):
+                cube[row, i] = traces[s]
+        cube.flush()
+        del cube
+
+        np.save(os.path.join(cache_dir, ANGLES_FILE), np.asarray(angles)[order])
+        np.save(os.path.join(cache_dir, FREQ_FILE), freq)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"sparams": sparams, "source": os.path.abspath(source), "files": csv_files(paths)},
+                f,
+            )
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def angle_index(self, angle):
+        """Returns the row of the angle closest to angle."""
+        return int(np.argmin(np.abs(self.angles - angle)))
+
+    def freq_index(self, freq):
+        """Returns the point of the frequency closest to freq (GHz)."""
+        return int(np.argmin(np.abs(self.freq - freq)))
+
+    def cut(self, freq, sparam):
+        """Returns the complex pattern (one value per angle) at a frequency."""
+        return np.array(self.data[:, self.sparams.index(sparam), self.freq_index(freq)])
+
+    def at_angle(self, angle, sparam):
+        """Returns the complex trace (one value per point) at an angle."""
+        return np.array(self.data[self.angle_index(angle), self.sparams.index(sparam)])
@@ -9,23 +9,72 @@ import time
 cal=0
 arduino=''
 
+STEP_PERIOD = 0.002 # s per step, the firmware pulses 1000 us high + 1000 us low
+SERIAL_READ_DELAY = 1.0 # s, old style commands without a newline wait for this timeout
+COMMAND_LATENCY = 0.01 # s, framed commands are parsed as soon as the newline arrives
+ACK_TIMEOUT = 0.5 # s to wait for the firmware to acknowledge a framed command
+MOVE_TIMEOUT_MARGIN = 2.0 # s added to the expected move time before giving up
+MAX_REPLIES = 64 # replies kept for commands that haven't been waited for yet
+
+# Motion profile, see templates/arduino/circularTrackControl.ino
+START_SPEED = 1/STEP_PERIOD # steps/s, moves start and end at the old fixed rate
+MAX_SPEED_LIMIT = 4000 # steps/s
+DEFAULT_ACCELERATION = 2000 # steps/s^2
+
+# Returns the time in s a move of steps takes with a trapezoidal profile that
+# ramps from START_SPEED to max_speed (steps/s) at acceleration (steps/s^2)
+def move_time(steps, max_speed=START_SPEED, acceleration=DEFAULT_ACCELERATION):
+    steps = abs(steps)
+    v0 = START_SPEED
+    if max_speed <= v0 or acceleration <= 0:
+        return steps/v0
+    ramp_steps = (max_speed**2 - v0**2)/(2*acceleration)
+    if 2*ramp_steps >= steps:
+        # Triangular profile, never reaches max_speed
+        peak = (v0**2 + acceleration*steps)**0.5
+        return 2*(peak - v0)/acceleration
+    return 2*(max_speed - v0)/acceleration + (steps - 2*ramp_steps)/max_speed
+
+class StageError(Exception):
+    """Error when talking to the rotary stage."""
+
+    pass
+
+class StageTimeout(StageError):
+    """The stage didn't reply in time."""
+
+    pass
+
 class rotaryStage:
     
     #initializes a rotary stage object, which connects to the arduino
     # args: com_port: will almost always be COM10 but may change if USB is unplugged
-    def __init__(self,COM_PORT):
-        self.arduino = serial.Serial(COM_PORT,115200)
+    #       arduino: already open serial port to use instead, e.g. a SimulatedArduino
+    def __init__(self,COM_PORT,arduino=None):
+        if arduino is None:
+            arduino = serial.Serial(COM_PORT,115200)
+        self.arduino = arduino
         self.cal = 800 # NEW: 800 steps per degree 1600 steps per revolution uStep enabled
         #OLD: 100 steps per degree, 200 steps per revolution, ignoring skipped steps
+        self.max_speed = START_SPEED # the firmware starts with a constant speed
+        self.acceleration = DEFAULT_ACCELERATION
+        self.seq = 0 # sequence number of the last framed command
+        self.ack_latency = None # s from sending the last framed command to its ACK
+        self.replies = {} # (kind, seq): rest of line, replies read while waiting for others
+        self.unwaited = set() # sequence numbers of moves whose DONE nobody waits for
+        self.partial = b"" # start of a line whose newline hasn't been read yet
+        self.async_stage = None # AsyncStage running move_async, made on first use
     
     def __del__(self):
         self.arduino.close()
     
     #disconnect arduino
     def disconnect(self):
+        if self.async_stage is not None:
+            self.async_stage.close()
         self.arduino.close()
         
-    # Sends an encoded serial message to the arduino
+    # Sends an encoded serial message to the arduino, without framing (old style)
     # The Arduino only accepts an integer number of steps (conversion is 200 steps for 1 rotation (100 steps for 1 degree))
     # Include a "t" at the beginning of the integer to make the motor step faster
     def send_msg(self, msg):
@@ -41,13 +90,185 @@ class rotaryStage:
         msg2 = msg.decode('ascii')
         return (msg2)              
     
-    def step_ccw(self,step):
-        MessageToArduino = str(round(step*self.cal))
-        return self.send_msg(MessageToArduino)
+    # Sends a framed command "<seq> <cmd>\n" and waits for "ACK <seq>"
+    # Returns the sequence number, to wait for the command with wait_done
+    # See templates/arduino/circularTrackControl.ino for the commands
+    def command(self, cmd, ack_timeout=ACK_TIMEOUT):
+        self.seq += 1
+        seq = self.seq
+        start = time.monotonic()
+        self.arduino.write("{} {}\n".format(seq, cmd).encode())
+        self.wait_reply("ACK", seq, ack_timeout, cmd)
+        self.ack_latency = time.monotonic() - start
+        return seq
+
+    # Waits for "DONE <seq> <result>" and returns result
+    def wait_done(self, seq, timeout, what):
+        return self.wait_reply("DONE", seq, timeout, what)
+
+    # Waits for the reply kind ("ACK" or "DONE") to command seq and returns the
+    # rest of the line, raises StageError if the firmware replies "ERR <seq>"
+    def wait_reply(self, kind, seq, timeout, what):
+        for reply_kind in ("ERR", kind):
+            if (reply_kind, seq) in self.replies:
+                return self.check_reply(reply_kind, self.replies.pop((reply_kind, seq)), what)
+        return self.wait_for(lambda line: self.handle_reply(line, kind, seq, what), timeout, what)
+
+    def check_reply(self, reply_kind, rest, what):
+        if reply_kind == "ERR":
+            raise StageError("{} failed: {}".format(what, rest))
+        return rest
+
+    # Returns the rest of line if it is the reply kind (or ERR) to command seq,
+    # None otherwise. Replies to other commands are kept in self.replies for when
+    # they are waited for, except the DONE of moves in self.unwaited, which is
+    # dropped. An ERR to one of those raises StageError. At most MAX_REPLIES are
+    # kept, the oldest are dropped first.
+    def handle_reply(self, line, kind, seq, what):
+        parts = line.split(" ", 2)
+        if len(parts) < 2 or parts[0] not in ("ACK", "DONE", "ERR"):
+            return None # not a framed reply
+        try:
+            reply_seq = int(parts[1])
+        except ValueError:
+            return None
+        rest = parts[2] if len(parts) > 2 else ""
+        if reply_seq == seq and parts[0] in (kind, "ERR"):
+            return self.check_reply(parts[0], rest, what)
+        if parts[0] == "ACK":
+            return None
+        if reply_seq in self.unwaited:
+            self.unwaited.discard(reply_seq)
+            return self.check_reply(parts[0], rest, "move {}".format(reply_seq))
+        self.replies[(parts[0], reply_seq)] = rest
+        if len(self.replies) > MAX_REPLIES:
+            del self.replies[min(self.replies, key=lambda k: k[1])]
+        return None
+
+    # Handles the replies already received, without waiting for more
+    def poll_replies(self):
+        old_timeout = self.arduino.timeout
+        try:
+            self.arduino.timeout = 0
+            while self.arduino.in_waiting:
+                line = self.arduino.readline()
+                if not line.endswith(b"\n"):
+                    self.partial += line
+                    continue
+                line, self.partial = self.partial + line, b""
+                self.handle_reply(line.decode('ascii', 'ignore').strip(), None, None, "")
+        finally:
+            self.arduino.timeout = old_timeout
+
+    # Sets the trapezoidal motion profile used by the firmware
+    # Returns the profile the firmware is using
+    # args: max_speed: cruise speed in steps/s, START_SPEED to MAX_SPEED_LIMIT
+    #       acceleration: in steps/s^2
+    def set_motion_profile(self, max_speed, acceleration=DEFAULT_ACCELERATION, timeout=ACK_TIMEOUT):
+        if max_speed < START_SPEED or max_speed > MAX_SPEED_LIMIT:
+            raise StageError("max_speed should be {} to {} steps/s".format(START_SPEED, MAX_SPEED_LIMIT))
+        if acceleration <= 0:
+            raise StageError("acceleration should be positive")
+
+        seq = self.command("P{:.0f},{:.0f}".format(max_speed, acceleration))
+        speed, accel = self.wait_done(seq, timeout, "motion profile").split(",")
+        self.max_speed, self.acceleration = float(speed), float(accel)
+        return self.max_speed, self.acceleration
+
+    # Returns the position in steps counted by the firmware
+    def position(self, timeout=ACK_TIMEOUT):
+        seq = self.command("Q")
+        return int(self.wait_done(seq, timeout, "position"))
+
+    # Stops a move right away, returns the position in steps
+    def stop(self, timeout=ACK_TIMEOUT):
+        seq = self.command("X")
+        return int(self.wait_done(seq, timeout, "stop"))
+
+    # Returns the time in s the motor takes for a move of steps
+    def move_time(self, steps):
+        return move_time(steps, self.max_speed, self.acceleration)
+
+    # Starts a move by a number of steps (negative for cw) without waiting
+    # for it to finish. Returns the sequence number to pass to wait_move.
+    def start_move(self, steps):
+        return self.command("M{}".format(int(steps)))
+
+    # Waits for the move started with sequence number seq to finish
+    # Returns the step count reported by the Arduino
+    # args: timeout: s to wait, by default the expected move time plus a margin
+    def wait_move(self, seq, steps, timeout=None):
+        if timeout is None:
+            timeout = self.move_time(steps) + MOVE_TIMEOUT_MARGIN
+        return int(self.wait_done(seq, timeout, "move of {} steps".format(steps)))
+
+    # Moves by a number of steps (negative for cw) and blocks until the Arduino
+    # reports that the move is finished.
+    # Returns the step count reported by the Arduino.
+    # args: steps: number of steps
+    #       timeout: s to wait, by default the expected move time plus a margin
+    def move(self, steps, timeout=None):
+        steps = int(steps)
+        if steps == 0:
+            return 0
+        return self.wait_move(self.start_move(steps), steps, timeout)
+
+    # Reads lines until parse(line) returns something other than None and
+    # returns that, raises StageTimeout after timeout s
+    # A line cut off by the timeout is kept in self.partial and completed by the
+    # next read, so waiting in short slices doesn't lose replies
+    def wait_for(self, parse, timeout, what):
+        deadline = time.monotonic() + timeout
+        old_timeout = self.arduino.timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise StageTimeout("{} not done after {:.1f} s".format(what, timeout))
+                self.arduino.timeout = remaining
+                line = self.arduino.readline()
+                if not line.endswith(b"\n"):
+                    self.partial += line
+                    continue
+                line, self.partial = self.partial + line, b""
+                result = parse(line.decode('ascii', 'ignore').strip())
+                if result is not None:
+                    return result
+        finally:
+            self.arduino.timeout = old_timeout
+
+    # Awaitable version of move, see AsyncStage.move
+    # If the await is cancelled or times out the stage is stopped, and the
+    # port is free for other commands once it returns
+    async def move_async(self, steps, timeout=None):
+        if self.async_stage is None:
+            from async_instruments import AsyncStage # imports this module
+            self.async_stage = AsyncStage(self)
+        return await self.async_stage.move(steps, timeout)
+
+    # Starts a move without waiting for it, its DONE is dropped when read
+    # Raises StageError if the last move started this way isn't done yet, the
+    # firmware would reject this one as busy
+    def start_unwaited_move(self, steps):
+        self.poll_replies()
+        if self.unwaited:
+            raise StageError("previous move not done, wait for it before moving again")
+        self.unwaited.add(self.start_move(steps))
+
+    # wait: block until the move is finished (see move)
+    def step_ccw(self,step,wait=False,timeout=None):
+        steps = round(step*self.cal)
+        if wait:
+            return ("moved: " + str(self.move(steps, timeout)))
+        self.start_unwaited_move(steps)
+        return ("moving: " + str(steps))
         
-    def step_cw(self,step):
-        MessageToArduino = str(round(-1*step*self.cal))
-        return self.send_msg(MessageToArduino)
+    def step_cw(self,step,wait=False,timeout=None):
+        steps = round(-1*step*self.cal)
+        if wait:
+            return ("moved: " + str(self.move(steps, timeout)))
+        self.start_unwaited_move(steps)
+        return ("moving: " + str(steps))
     
     def reset_stage(self):
         #some extremely high value > 56000 steps so that the arm will be guaranteed to hit limit switch
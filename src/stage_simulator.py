@@ -0,0 +1,264 @@
+"""Simulated Arduino for running rotaryStage without the circular track.
+
+SimulatedArduino stands in for the serial.Serial port of a rotaryStage and
+answers like templates/arduino/circularTrackControl.ino, with the same
+timing: framed commands are acknowledged right away, moves take the time
+given by the trapezoidal motion profile, and old style commands without a
+newline wait for the 1 s timeout first.
+
+Example:
+    stage = rotaryStage("SIM", arduino=SimulatedArduino(time_scale=0.01))
+    stage.set_motion_profile(2000, 4000)
+    stage.move(8000)
+
+open_pty() connects a simulator to a pseudo terminal instead, so a real
+pyserial port (and everything above it) can be tested on Linux/macOS:
+    port = open_pty(SimulatedArduino())
+    stage = rotaryStage(port)
+
+Running this file checks rotaryStage against the simulator.
+"""
+import os
+import threading
+import time
+
+from rotary_stage import (
+    COMMAND_LATENCY,
+    DEFAULT_ACCELERATION,
+    MAX_SPEED_LIMIT,
+    SERIAL_READ_DELAY,
+    START_SPEED,
+    move_time,
+)
+
+
+class SimulatedArduino:
+    """Serial port look-alike connected to a simulated stage controller."""
+
+    def __init__(
+        self,
+        command_latency=COMMAND_LATENCY,
+        legacy_delay=SERIAL_READ_DELAY,
+        time_scale=1.0,
+    ):
+        """Initializes with given params.
+
+        Args:
+            command_latency (float): time in s to parse a framed command
+            legacy_delay (float): time in s the firmware waits before running
+                characters that are not followed by a newline
+            time_scale (float): multiplies all simulated durations, use less
+                than 1 to run faster than the real hardware
+        """
+        self.timeout = None
+        self.command_latency = command_latency
+        self.legacy_delay = legacy_delay
+        self.time_scale = time_scale
+        self.max_speed = START_SPEED
+        self.acceleration = DEFAULT_ACCELERATION
+        self.position = 0  # in steps, at the end of the current move
+        self.move = None  # (seq, steps, start, end) of the current move
+        self.partial = b""  # received characters without a newline yet
+        self.partial_time = 0.0  # time.monotonic() of the last character
+        self.lines = []  # (time.monotonic() when sent, line) waiting to be read
+        self.received = []  # every command received, for checking
+        self.cond = threading.Condition()
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    @property
+    def in_waiting(self):
+        with self.cond:
+            self.poll()
+            now = time.monotonic()
+            return sum(len(line) for t, line in self.lines if t <= now)
+
+    def reset_input_buffer(self):
+        """Drops lines that have already been sent by the firmware."""
+        with self.cond:
+            self.poll()
+            now = time.monotonic()
+            self.lines = [(t, line) for t, line in self.lines if t > now]
+
+    def write(self, data):
+        """Receives characters, complete lines are run right away."""
+        with self.cond:
+            self.poll()
+            self.partial += data
+            self.partial_time = time.monotonic()
+            while b"\n" in self.partial:
+                line, self.partial = self.partial.split(b"\n", 1)
+                line = line.strip().decode("ascii")
+                if line:
+                    self.run_line(line)
+            self.cond.notify_all()
+        return len(data)
+
+    def readline(self):
+        """Returns the next line, or b"" if none is sent within the timeout."""
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self.cond:
+            while True:
+                self.poll()
+                now = time.monotonic()
+                if self.lines and self.lines[0][0] <= now:
+                    return self.lines.pop(0)[1]
+                waits = [t - now for t in self.next_events()]
+                if deadline is not None:
+                    if now >= deadline:
+                        return b""
+                    waits.append(deadline - now)
+                self.cond.wait(min(waits) if waits else None)
+
+    def next_events(self):
+        """Returns the times at which something will happen without input."""
+        events = []
+        if self.lines:
+            events.append(self.lines[0][0])
+        if self.partial.strip():
+            events.append(self.partial_time + self.legacy_delay * self.time_scale)
+        return events
+
+    def send(self, line, at=None):
+        """Queues a reply line to be readable at time at (default now)."""
+        at = time.monotonic() if at is None else at
+        self.lines.append((at, (line + "\r\n").encode("ascii")))
+        self.lines.sort(key=lambda x: x[0])
+
+    def poll(self):
+        """Runs old style commands whose timeout has passed."""
+        now = time.monotonic()
+        legacy_time = self.partial_time + self.legacy_delay * self.time_scale
+        if self.partial.strip() and now >= legacy_time:
+            msg, self.partial = self.partial.strip().decode("ascii"), b""
+            self.received.append(msg)
+            try:
+                steps = int(msg)
+            except ValueError:
+                return  # atol() gives 0 and nothing happens
+            if steps != 0 and not self.moving(now):
+                self.start_move(None, steps, now)
+
+    def moving(self, now):
+        return self.move is not None and now < self.move[3]
+
+    def start_move(self, seq, steps, now):
+        end = now + move_time(steps, self.max_speed, self.acceleration) * self.time_scale
+        self.move = (seq, steps, now, end)
+        self.position += steps
+        self.send(self.move_report(seq, steps), end)
+
+    def move_report(self, seq, steps):
+        """Returns the line sent when a move is done."""
+        return str(steps) if seq is None else "DONE {} {}".format(seq, steps)
+
+    def current_position(self, now):
+        """Returns the position, estimated in proportion to time while moving."""
+        if not self.moving(now):
+            return self.position
+        seq, steps, start, end = self.move
+        done = int(steps * (now - start) / (end - start))
+        return self.position - steps + done
+
+    def run_line(self, line):
+        """Runs a framed command "<seq> <command>"."""
+        self.received.append(line)
+        now = time.monotonic() + self.command_latency * self.time_scale
+        seq, _, command = line.partition(" ")
+        try:
+            seq = int(seq)
+        except ValueError:
+            self.send("ERR -1 bad frame", now)
+            return
+        self.send("ACK {}".format(seq), now)
+
+        kind, args = command[:1], command[1:]
+        if kind in ("M", "P") and self.moving(now):
+            self.send("ERR {} busy".format(seq), now)
+        elif kind == "M":
+            steps = int(args or 0)
+            if steps == 0:
+                self.send("DONE {} 0".format(seq), now)
+            else:
+                self.start_move(seq, steps, now)
+        elif kind == "P":
+            speed, _, accel = args.partition(",")
+            self.max_speed = min(max(float(speed), START_SPEED), MAX_SPEED_LIMIT)
+            if accel and float(accel) > 0:
+                self.acceleration = float(accel)
+            self.send(
+                "DONE {} {:.0f},{:.0f}".format(seq, self.max_speed, self.acceleration),
+                now,
+            )
+        elif kind == "Q":
+            self.send("DONE {} {}".format(seq, self.current_position(now)), now)
+        elif kind == "X":
+            if self.moving(now):
+                move_seq, steps, start, end = self.move
+                position = self.current_position(now)
+                done = position - (self.position - steps)
+                # The move is reported as done now, with the steps it made
+                report = (self.move_report(move_seq, steps) + "\r\n").encode("ascii")
+                self.lines = [(t, l) for t, l in self.lines if l != report]
+                self.position = position
+                self.move = None
+                self.send(self.move_report(move_seq, done), now)
+            self.send("DONE {} {}".format(seq, self.position), now)
+        else:
+            self.send("ERR {} unknown command".format(seq), now)
+
+
+def open_pty(simulator):
+    """Connects simulator to a new pseudo terminal and returns the port name.
+
+    Opening the returned port with serial.Serial (or rotaryStage) talks to
+    the simulator through the operating system like a real Arduino would.
+    Only available where the os module has openpty (Linux, macOS).
+    """
+    import select
+    import tty
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    name = os.ttyname(slave)
+
+    def forward_input():
+        while simulator.is_open:
+            ready, _, _ = select.select([master], [], [], 0.1)
+            if ready:
+                simulator.write(os.read(master, 1024))
+
+    def forward_output():
+        simulator.timeout = 0.1
+        while simulator.is_open:
+            line = simulator.readline()
+            if line:
+                os.write(master, line)
+
+    for target in (forward_input, forward_output):
+        threading.Thread(target=target, daemon=True).start()
+    return name
+
+
+if __name__ == "__main__":
+    from rotary_stage import rotaryStage
+
+    scale = 0.01
+    stage = rotaryStage("SIM", arduino=SimulatedArduino(time_scale=scale))
+    for profile in ((START_SPEED, DEFAULT_ACCELERATION), (4000, 8000)):
+        print("profile:", stage.set_motion_profile(*profile))
+        for steps in (80, 8000, -73000):
+            start = time.monotonic()
+            assert stage.move(steps) == steps
+            observed = (time.monotonic() - start) / scale
+            expected = stage.move_time(steps)
+            print(
+                "{:7d} steps: expected {:7.2f} s, simulated {:7.2f} s, "
+                "ack after {:.1f} ms".format(
+                    steps, expected, observed, stage.ack_latency / scale * 1e3
+                )
+            )
+            assert abs(observed - expected) < 0.1 * expected + 0.5
+    print("position:", stage.position())
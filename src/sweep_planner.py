@@ -0,0 +1,163 @@
+"""Plans wideband or non-uniform frequency lists as several VNA sweeps.
+
+FreqSweepParams is one linear sweep of at most POINTS_MAX points. plan()
+splits a list of requested frequencies (several bands, or densities that
+change across the list) into the fewest linear sweeps that measure every
+requested frequency at least as finely as it was requested, using the
+point counts the 8720ES allows (POINTS). run_plan() measures the segments
+back to back and merges them into one trace at the requested frequencies.
+
+Each segment is set with VNA.set_sweep_params, so with a CalLibrary on the
+VNA the calibration saved for that segment is restored automatically.
+
+Example:
+    freqs = np.concatenate([np.linspace(2e9, 4e9, 401), np.linspace(8e9, 12e9, 2001)])
+    segments = plan(freqs, power=-10)
+    traces = run_plan(v, segments, freqs, {"S21": "CHAN3"})
+"""
+import math
+
+import numpy as np
+
+from vna import FREQ_DECIMALS, FREQ_MAX, FREQ_MIN, POINTS, POINTS_MAX, FreqSweepParams
+
+FREQ_RESOLUTION = 10 ** (9 - FREQ_DECIMALS)  # Hz, set_sweep_params rounds to this
+
+
+def allowed_points(needed):
+    """Returns the smallest point count in POINTS of at least needed, or
+    None if more than POINTS_MAX are needed."""
+    for p in POINTS:
+        if p >= needed:
+            return p
+    return None
+
+
+def segment_points(freqs):
+    """Returns (start, stop, points) of the linear sweep that measures the
+    sorted freqs at least as finely as they are spaced, or None if it would
+    need more than POINTS_MAX points."""
+    start = math.floor(freqs[0] / FREQ_RESOLUTION) * FREQ_RESOLUTION
+    stop = min(math.ceil(freqs[-1] / FREQ_RESOLUTION) * FREQ_RESOLUTION, FREQ_MAX)
+    if stop <= start:
+        start = stop - FREQ_RESOLUTION
+    step = np.min(np.diff(freqs)) if len(freqs) > 1 else stop - start
+    points = allowed_points(math.ceil((stop - start) / step - 1e-9) + 1)
+    if points is None:
+        return None
+    return start, stop, points
+
+
+def reachable(freqs, i):
+    """Returns (j, points) for each point count in POINTS, where freqs[j] is
+    the last freq a segment starting at freqs[i] can reach with at most that
+    many points, and points is what segment_points(freqs[i : j + 1]) gives.
+
+    A segment holds at most POINTS_MAX freqs, so only that many are looked
+    at, which keeps this independent of len(freqs).
+    """
+    end = min(len(freqs), i + POINTS_MAX + 1)
+    start = math.floor(freqs[i] / FREQ_RESOLUTION) * FREQ_RESOLUTION
+    stop = np.minimum(np.ceil(freqs[i + 1 : end] / FREQ_RESOLUTION) * FREQ_RESOLUTION, FREQ_MAX)
+    step = np.minimum.accumulate(np.diff(freqs[i:end]))
+    needed = np.ceil((stop - start) / step - 1e-9) + 1
+    # Points needed to reach each later freq, never decreasing
+    reach = np.maximum.accumulate(needed)
+    ends = {}
+    for p in POINTS:
+        k = int(np.searchsorted(reach, p, side="right"))
+        if k == 0:
+            ends[i] = segment_points(freqs[i : i + 1])[2]
+        else:
+            ends[i + k] = allowed_points(needed[k - 1])
+    return sorted(ends.items())
+
+
+def plan(freqs, power, averaging=1):
+    """Returns the FreqSweepParams of the fewest sweeps measuring freqs.
+
+    Among plans with the fewest sweeps, the one with the fewest points in
+    total (the shortest sweep time) is chosen, so a gap between bands is
+    only swept over when that saves a sweep. A segment from freqs[i] only
+    needs to be tried ending at the last freq it can reach with each
+    allowed point count.
+
+    Args:
+        freqs (np.ndarray): requested frequencies in Hz, in any order
+        power (float): power in dBm for every segment
+        averaging (int): averaging factor for every segment
+    """
+    freqs = np.unique(np.asarray(freqs, dtype=np.float64))
+    if len(freqs) == 0:
+        return []
+    if freqs[0] < FREQ_MIN or freqs[-1] > FREQ_MAX:
+        raise ValueError("Frequencies should be {} GHz to {} GHz".format(FREQ_MIN / 1e9, FREQ_MAX / 1e9))
+
+    # best[i]: (sweeps, points, end of the first segment) to measure freqs[i:]
+    best = [None] * len(freqs) + [(0, 0, None)]
+    for i in range(len(freqs) - 1, -1, -1):
+        best[i] = min(
+            (best[j + 1][0] + 1, best[j + 1][1] + points, j)
+            for j, points in reachable(freqs, i)
+        )
+
+    segments = []
+    i = 0
+    while i < len(freqs):
+        j = best[i][2]
+        start, stop, points = segment_points(freqs[i : j + 1])
+        segments.append(FreqSweepParams(start, stop, points, power, averaging, []))
+        i = j + 1
+    return segments
+
+
+def segment_freqs(segment):
+    """Returns the frequencies in Hz measured by a segment."""
+    return np.linspace(segment.start, segment.stop, segment.points)
+
+
+def merge(measured, freqs):
+    """Merges segments into one trace per name at the requested freqs.
+
+    Args:
+        measured (list): (frequencies, traces) per segment, traces maps
+            names to complex arrays
+        freqs (np.ndarray): frequencies to return the traces at, each is
+            interpolated from the segment that covers it
+
+    Returns a dict of name to complex array, one value per freq.
+    """
+    freqs = np.asarray(freqs, dtype=np.float64)
+    merged = {}
+    for name in measured[0][1]:
+        out = np.full(len(freqs), np.nan, dtype=np.complex128)
+        for f, traces in measured:
+            inside = (freqs >= f[0]) & (freqs <= f[-1]) & np.isnan(out)
+            t = traces[name]
+            out[inside] = np.interp(freqs[inside], f, t.real) + 1j * np.interp(freqs[inside], f, t.imag)
+        merged[name] = out
+    return merged
+
+
+def run_plan(vna, segments, freqs, channels):
+    """Measures each segment in turn and merges the traces.
+
+    Args:
+        vna (VNA): connected VNA, with cal_library set to restore a
+            calibration per segment
+        segments (list): FreqSweepParams from plan
+        freqs (np.ndarray): requested frequencies in Hz
+        channels (dict): name to channel, e.g. {"S21": "CHAN3"}
+
+    Returns a dict of name to complex array, one value per freq.
+    """
+    measured = []
+    for segment in segments:
+        vna.set_sweep_params(segment)
+        library = vna.cal_library
+        if library is not None and library.find_sweep(segment, vna.get_if_bw()) is None:
+            print("No saved calibration for " + str(segment))
+        vna.sweep()
+        traces = {name: vna.get_complex(chan) for name, chan in channels.items()}
+        measured.append((segment_freqs(segment), traces))
+    return merge(measured, freqs)
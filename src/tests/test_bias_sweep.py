@@ -0,0 +1,68 @@
+"""Checks the serpentine visiting order of bias grids.
+
+Run from the src folder with: python -m pytest tests
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bias_sweep import RASTER, BiasGrid, raster_order, serpentine_order  # noqa: E402
+
+SHAPES = [(5,), (3, 4), (2, 3, 4), (4, 1, 3), (2, 2, 2, 3)]
+
+
+class SerpentineOrderTest(unittest.TestCase):
+    def test_visits_every_point_once(self):
+        for shape in SHAPES:
+            order = serpentine_order(shape)
+            self.assertEqual(order.shape, (int(np.prod(shape)), len(shape)))
+            points = np.ravel_multi_index(order.T, shape)
+            self.assertEqual(sorted(points), list(range(int(np.prod(shape)))))
+
+    def test_one_channel_one_step_at_a_time(self):
+        for shape in SHAPES:
+            steps = np.abs(np.diff(serpentine_order(shape), axis=0))
+            np.testing.assert_array_equal(steps.sum(axis=1), 1, err_msg=str(shape))
+
+    def test_two_axes(self):
+        np.testing.assert_array_equal(
+            serpentine_order((2, 3)),
+            [[0, 0], [0, 1], [0, 2], [1, 2], [1, 1], [1, 0]],
+        )
+
+    def test_raster_jumps_back(self):
+        order = raster_order((2, 3))
+        np.testing.assert_array_equal(order[3], [1, 0])
+        self.assertEqual(np.abs(order[3] - order[2]).sum(), 3)
+
+
+class BiasGridTest(unittest.TestCase):
+    def setUp(self):
+        self.grid = BiasGrid([(2, [0, 1, 2]), (0, [5, 6])], fixed={4: 1.5})
+
+    def test_channels_and_voltages(self):
+        self.assertEqual(self.grid.shape, (3, 2))
+        self.assertEqual(self.grid.channels, [2, 0, 4])
+        np.testing.assert_array_equal(self.grid.voltages((2, 1)), [2, 6, 1.5])
+        self.assertEqual(self.grid.point((2, 1)), 5)
+        self.assertEqual(len(self.grid.order(RASTER)), 6)
+
+    def test_attrs_round_trip(self):
+        grid = BiasGrid.from_attrs(self.grid.to_attrs())
+        self.assertEqual(grid.channels, self.grid.channels)
+        np.testing.assert_array_equal(grid.voltages((1, 0)), self.grid.voltages((1, 0)))
+
+    def test_channel_on_two_axes(self):
+        with self.assertRaises(ValueError):
+            BiasGrid([(0, [0, 1]), (0, [2, 3])])
+        with self.assertRaises(ValueError):
+            BiasGrid([(0, [0, 1])], fixed={0: 1.0})
+        with self.assertRaises(ValueError):
+            self.grid.order("spiral")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+"""Checks the 12-term correction against its inverse and on a store.
+
+Run from the src folder with: python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from error_correction import SPARAMS, TERMS, ErrorTerms, correct_store  # noqa: E402
+from measurement_store import MeasurementStore  # noqa: E402
+
+POINTS = 21
+
+
+def random_complex(rng, shape, scale):
+    return scale * (rng.standard_normal(shape) + 1j * rng.standard_normal(shape))
+
+
+def random_terms(rng):
+    """Returns ErrorTerms of a plausible instrument: small leakage and
+    mismatch, tracking near 1."""
+    terms = {}
+    for name in TERMS:
+        if name[:2] in ("ER", "ET"):
+            terms[name] = 1 + random_complex(rng, POINTS, 0.1)
+        else:
+            terms[name] = random_complex(rng, POINTS, 0.05)
+    return ErrorTerms(terms)
+
+
+def random_sparams(rng, shape):
+    return {s: random_complex(rng, shape, 0.3) for s in SPARAMS}
+
+
+class ErrorTermsTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(7)
+        self.terms = random_terms(self.rng)
+
+    def test_correct_undoes_distort(self):
+        actual = random_sparams(self.rng, POINTS)
+        corrected = self.terms.correct(self.terms.distort(actual))
+        for s in SPARAMS:
+            np.testing.assert_allclose(corrected[s], actual[s], rtol=0, atol=1e-12)
+
+    def test_correct_broadcasts_over_angles(self):
+        actual = random_sparams(self.rng, (5, POINTS))
+        corrected = self.terms.correct(self.terms.distort(actual))
+        self.assertEqual(corrected["S21"].shape, (5, POINTS))
+        np.testing.assert_allclose(corrected["S12"], actual["S12"], rtol=0, atol=1e-12)
+
+    def test_ideal_terms_change_nothing(self):
+        ideal = {t: np.zeros(POINTS) for t in TERMS}
+        for t in ("ERF", "ETF", "ERR", "ETR"):
+            ideal[t] = np.ones(POINTS)
+        actual = random_sparams(self.rng, POINTS)
+        raw = ErrorTerms(ideal).distort(actual)
+        for s in SPARAMS:
+            np.testing.assert_allclose(raw[s], actual[s])
+
+    def test_from_cal_data_pairs(self):
+        arrays = []
+        for t in TERMS:
+            pairs = np.empty(2 * POINTS)
+            pairs[0::2] = self.terms.terms[t].real
+            pairs[1::2] = self.terms.terms[t].imag
+            arrays.append(pairs)
+        terms = ErrorTerms.from_cal_data(arrays)
+        self.assertEqual(terms.points, POINTS)
+        np.testing.assert_array_equal(terms.ESR, self.terms.ESR)
+        with self.assertRaises(ValueError):
+            ErrorTerms.from_cal_data(arrays[:3])
+
+    def test_missing_terms(self):
+        with self.assertRaises(ValueError):
+            ErrorTerms({"EDF": np.zeros(POINTS)})
+
+
+class CorrectStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.rng = np.random.default_rng(11)
+        self.terms = random_terms(self.rng)
+        self.freq = np.linspace(8e9, 12e9, POINTS)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def test_store_is_corrected_in_chunks(self):
+        angles = np.arange(7) * 5.0
+        actual = random_sparams(self.rng, (len(angles), POINTS))
+        raw = self.terms.distort(actual)
+        with MeasurementStore.create(self.path("raw"), self.freq, SPARAMS, {"note": "x"}) as store:
+            for k, angle in enumerate(angles):
+                store.append(angle, {s: raw[s][k] for s in SPARAMS})
+
+        correct_store(self.path("raw"), self.path("out"), self.terms, chunk=3)
+        out = MeasurementStore(self.path("out"))
+        np.testing.assert_array_equal(out.angles, angles)
+        self.assertEqual(out.attrs, {"note": "x", "corrected": True})
+        for s in SPARAMS:
+            # Stored as complex64
+            np.testing.assert_allclose(out.trace(s), actual[s], rtol=0, atol=1e-5)
+
+    def test_store_needs_all_sparams_and_points(self):
+        MeasurementStore.create(self.path("s21"), self.freq, ["S21"]).close()
+        with self.assertRaises(ValueError):
+            correct_store(self.path("s21"), self.path("out"), self.terms)
+        MeasurementStore.create(self.path("short"), self.freq[:5], SPARAMS).close()
+        with self.assertRaises(ValueError):
+            correct_store(self.path("short"), self.path("out"), self.terms)
+
+
+if __name__ == "__main__":
+    unittest.main()
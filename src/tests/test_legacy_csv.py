@@ -0,0 +1,105 @@
+"""Checks that legacy_csv recognises the CSV layouts of the data archives.
+
+Run from the src folder with: python -m pytest tests
+"""
+import math
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from legacy_csv import (  # noqa: E402
+    COLUMNS,
+    POINT,
+    ROWS,
+    WRITEDATA,
+    LegacyCSVError,
+    parse_dir,
+    parse_text,
+)
+
+WRITEDATA_TEXT = (
+    "Angle of: -12.500\n"
+    "Freq [GHz],8.0, 9.0, 10.0\n"
+    "S21 [Mag],-3.0, -3.5, -4.0\n"
+    "S21 [Phase],10.0, 20.0, 30.0\n"
+)
+
+
+class ParseTextTest(unittest.TestCase):
+    def test_writedata(self):
+        r = parse_text("x/whatever.csv", WRITEDATA_TEXT)
+        self.assertEqual((r.kind, r.name, r.angle), (WRITEDATA, "-12.500", -12.5))
+        self.assertEqual(r.x_label, "Freq [GHz]")
+        np.testing.assert_array_equal(r.x, [8, 9, 10])
+        self.assertEqual(list(r.traces), ["S21 [Mag]", "S21 [Phase]"])
+        np.testing.assert_array_equal(r.traces["S21 [Phase]"], [10, 20, 30])
+
+    def test_point(self):
+        r = parse_text("x/S21_cal.csv", "point of: S21_cal\nFreq [GHz],1,2\nS21 [dB],-1,-2\n")
+        self.assertEqual((r.kind, r.name), (POINT, "S21_cal"))
+        self.assertTrue(math.isnan(r.angle))
+
+    def test_rows_are_named_after_the_file(self):
+        r = parse_text("x/7.5.csv", "Freq [GHz],1,2\nS21 [dB],-1,-2\n\n")
+        self.assertEqual((r.kind, r.name, r.angle), (ROWS, "7.5", 7.5))
+        np.testing.assert_array_equal(r.traces["S21 [dB]"], [-1, -2])
+
+    def test_columns(self):
+        text = "Wavelength (nm),Current (A)\n1550,0.1\n1551,0.2\n1552,0.3\n"
+        r = parse_text("x/30.csv", text)
+        self.assertEqual((r.kind, r.angle, r.x_label), (COLUMNS, 30.0, "Wavelength (nm)"))
+        np.testing.assert_array_equal(r.x, [1550, 1551, 1552])
+        np.testing.assert_array_equal(r.traces["Current (A)"], [0.1, 0.2, 0.3])
+
+    def test_errors(self):
+        with self.assertRaises(LegacyCSVError):
+            parse_text("x/a.csv", "")
+        with self.assertRaises(LegacyCSVError):
+            parse_text("x/a.csv", "Angle of: 1\nS21 [Mag],1,2\n")  # no Freq row
+        with self.assertRaises(LegacyCSVError):
+            parse_text("x/a.csv", "Freq [GHz],1,2\nS21 [Mag],1,oops\n")
+        with self.assertRaises(LegacyCSVError):
+            parse_text("x/a.csv", "a,b,c\n1,2,3\n4,5\n")
+
+
+class ParseDirTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, text):
+        with open(os.path.join(self.tmp.name, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def test_dataset_sorted_by_angle_and_stacked(self):
+        for angle in (10, -5, 0):
+            self.write("{}.csv".format(angle), WRITEDATA_TEXT.replace("-12.500", str(angle)))
+        self.write("S21_cal.csv", "point of: S21_cal\n" + WRITEDATA_TEXT.split("\n", 1)[1])
+
+        ds = parse_dir(self.tmp.name, processes=1)
+        self.assertEqual(len(ds), 4)
+        np.testing.assert_array_equal(ds.angles[:3], [-5, 0, 10])
+        self.assertTrue(math.isnan(ds.angles[3]))
+        self.assertEqual(ds.labels, ["S21 [Mag]", "S21 [Phase]"])
+        np.testing.assert_array_equal(ds.x(), [8, 9, 10])
+        self.assertEqual(ds.stack("S21 [Mag]").shape, (4, 3))
+        with self.assertRaises(LegacyCSVError):
+            ds.stack("S12 [Mag]")
+
+    def test_process_pool_gives_the_same_records(self):
+        for angle in range(6):
+            self.write("{}.csv".format(angle), WRITEDATA_TEXT.replace("-12.500", str(angle)))
+        serial = parse_dir(self.tmp.name, processes=1)
+        pooled = parse_dir(self.tmp.name, processes=2)
+        np.testing.assert_array_equal(pooled.angles, serial.angles)
+        np.testing.assert_array_equal(pooled.stack("S21 [Phase]"), serial.stack("S21 [Phase]"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+"""Checks MeasurementStore appends, reopening and recovery after a crash.
+
+Run from the src folder with: python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from measurement_store import MeasurementStore, MeasurementStoreError  # noqa: E402
+
+POINTS = 11
+
+
+def trace(k):
+    return (np.arange(POINTS) + 1j * k).astype(np.complex64)
+
+
+class MeasurementStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "store")
+        self.freq = np.linspace(8e9, 12e9, POINTS)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def create(self):
+        return MeasurementStore.create(self.path, self.freq, ["S21", "S12"], {"power": -10})
+
+    def test_append_and_reopen(self):
+        with self.create() as store:
+            for k in range(3):
+                store.append(k * 1.5, {"S21": trace(k), "S12": -trace(k)})
+            # Readable before close
+            np.testing.assert_array_equal(store.trace("S21")[2], trace(2))
+
+        store = MeasurementStore(self.path)
+        self.assertEqual(store.count, 3)
+        self.assertEqual(store.attrs, {"power": -10})
+        np.testing.assert_array_equal(store.freq, self.freq)
+        np.testing.assert_array_equal(store.angles, [0, 1.5, 3])
+        self.assertEqual(store.trace("S12").shape, (3, POINTS))
+        np.testing.assert_array_equal(store.trace("S12")[1], -trace(1))
+
+    def test_reopened_store_appends(self):
+        with self.create() as store:
+            store.append(0, {"S21": trace(0), "S12": trace(0)})
+        with MeasurementStore(self.path) as store:
+            store.append(1, {"S21": trace(1), "S12": trace(1)})
+        store = MeasurementStore(self.path)
+        np.testing.assert_array_equal(store.angles, [0, 1])
+        np.testing.assert_array_equal(store.trace("S21")[1], trace(1))
+
+    def test_rows_after_last_flush_are_dropped(self):
+        store = self.create()
+        store.append(0, {"S21": trace(0), "S12": trace(0)})
+        store.flush()
+        store.append(1, {"S21": trace(1), "S12": trace(1)})
+        for f in store.files.values():
+            f.flush()  # data on disk, but the count isn't: the program dies here
+
+        reopened = MeasurementStore(self.path)
+        self.assertEqual(reopened.count, 1)
+        reopened.append(2, {"S21": trace(2), "S12": trace(2)})
+        reopened.close()
+        store = MeasurementStore(self.path)
+        np.testing.assert_array_equal(store.angles, [0, 2])
+        np.testing.assert_array_equal(store.trace("S21")[1], trace(2))
+
+    def test_empty_store(self):
+        store = self.create()
+        self.assertEqual(store.count, 0)
+        self.assertEqual(store.trace("S21").shape, (0, POINTS))
+        self.assertEqual(len(store.angles), 0)
+
+    def test_bad_traces_and_existing_store(self):
+        store = self.create()
+        with self.assertRaises(MeasurementStoreError):
+            store.append(0, {"S21": trace(0)})
+        with self.assertRaises(MeasurementStoreError):
+            store.append(0, {"S21": trace(0), "S12": trace(0)[:5]})
+        self.assertEqual(store.count, 0)
+        with self.assertRaises(MeasurementStoreError):
+            self.create()
+
+    def test_export_csv(self):
+        with self.create() as store:
+            store.append(-2.5, {"S21": trace(1), "S12": trace(2)})
+            store.export_csv(self.tmp.name)
+        with open(os.path.join(self.tmp.name, "-2.500.csv"), encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], "Angle of: -2.500")
+        self.assertTrue(lines[1].startswith("Freq [GHz],8.0"))
+        self.assertEqual([line.split(",")[0] for line in lines[2:]],
+                         ["S21 [Mag]", "S21 [Phase]", "S12 [Mag]", "S12 [Phase]"])
+
+
+if __name__ == "__main__":
+    unittest.main()
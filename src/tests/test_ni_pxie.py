@@ -0,0 +1,140 @@
+"""Checks voltageSetter against a mock of the nidaqmx module.
+
+Run from the src folder with: python -m pytest tests
+"""
+import os
+import sys
+import types
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+class MockTask:
+    """Records what a voltageSetter does with an nidaqmx Task."""
+
+    def __init__(self, daqmx):
+        self.daqmx = daqmx
+        self.channels = []
+        self.writes = []
+        self.running = False
+        self.closed = False
+        self.timing = types.SimpleNamespace(
+            samp_timing_type=daqmx.constants.SampleTimingType.ON_DEMAND,
+            cfg_samp_clk_timing=self.cfg_samp_clk_timing,
+        )
+        self.ao_channels = types.SimpleNamespace(add_ao_voltage_chan=self.add_ao_voltage_chan)
+        daqmx.tasks.append(self)
+
+    def add_ao_voltage_chan(self, physical_channel, name, min_val, max_val):
+        self.channels.append(physical_channel)
+
+    def cfg_samp_clk_timing(self, rate, sample_mode, samps_per_chan):
+        self.timing.samp_timing_type = "SAMPLE_CLOCK"
+        self.timing.rate = rate
+        self.timing.samps_per_chan = samps_per_chan
+
+    def write(self, data, auto_start=False):
+        self.writes.append((data, self.timing.samp_timing_type))
+        if auto_start:
+            self.running = True
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+    def wait_until_done(self, timeout):
+        self.waited = timeout
+
+    def close(self):
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def mock_daqmx():
+    """Returns a module look-alike with Task and the constants used."""
+    daqmx = types.SimpleNamespace(tasks=[])
+    daqmx.constants = types.SimpleNamespace(
+        AcquisitionType=types.SimpleNamespace(FINITE="FINITE"),
+        SampleTimingType=types.SimpleNamespace(ON_DEMAND="ON_DEMAND"),
+    )
+    daqmx.Task = lambda: MockTask(daqmx)
+    return daqmx
+
+
+# NI_pxie imports nidaqmx, which is only installed with the NI drivers
+sys.modules.setdefault("nidaqmx", mock_daqmx())
+from NI_pxie import voltageSetter  # noqa: E402
+
+
+class VoltageSetterTest(unittest.TestCase):
+    def setUp(self):
+        self.daqmx = mock_daqmx()
+        self.vs = voltageSetter("Dev1", daqmx=self.daqmx)
+
+    def test_open_adds_channels_to_one_task(self):
+        self.vs.open(channels=[0, 3, 5])
+        self.assertEqual(len(self.daqmx.tasks), 1)
+        self.assertEqual(self.daqmx.tasks[0].channels, ["Dev1/ao0", "Dev1/ao3", "Dev1/ao5"])
+        self.assertEqual(self.daqmx.tasks[0].writes, [])
+
+    def test_set_voltages_is_one_write(self):
+        self.vs.open(channels=range(4))
+        self.vs.setVoltages([1, 2, 3, 4])
+        task = self.daqmx.tasks[0]
+        self.assertEqual(task.writes, [([1.0, 2.0, 3.0, 4.0], "ON_DEMAND")])
+        with self.assertRaises(ValueError):
+            self.vs.setVoltages([1, 2])
+
+    def test_set_voltage_leaves_unknown_channels_alone(self):
+        self.vs.open(channels=range(4))
+        self.vs.setVoltage("ao2", 5.0)
+        persistent, single = self.daqmx.tasks
+        self.assertEqual(persistent.writes, [])
+        self.assertEqual(single.channels, ["Dev1/ao2"])
+        self.assertEqual(single.writes, [(5.0, "ON_DEMAND")])
+        self.assertTrue(single.closed)
+        np.testing.assert_array_equal(self.vs.voltages, [np.nan, np.nan, 5.0, np.nan])
+
+    def test_set_voltage_through_task_once_known(self):
+        self.vs.open(channels=range(3), voltages=[1, 2, 3])
+        self.vs.setVoltage("ao1", 7.0)
+        task = self.daqmx.tasks[0]
+        self.assertEqual(len(self.daqmx.tasks), 1)
+        self.assertEqual(task.writes[-1][0], [1.0, 7.0, 3.0])
+
+    def test_set_voltage_outside_task(self):
+        self.vs.open(channels=range(2), voltages=[0, 0])
+        self.vs.setVoltage("ao9", 2.5)
+        self.assertEqual(self.daqmx.tasks[1].channels, ["Dev1/ao9"])
+        np.testing.assert_array_equal(self.vs.voltages, [0, 0])
+
+    def test_write_table_is_clocked_then_on_demand(self):
+        self.vs.open(channels=range(2), voltages=[0, 0])
+        table = np.array([[0, 1], [2, 3], [4, 5]])
+        self.vs.writeTable(table, rate=100)
+        task = self.daqmx.tasks[0]
+        self.assertEqual(task.writes[-1], ([[0.0, 2.0, 4.0], [1.0, 3.0, 5.0]], "SAMPLE_CLOCK"))
+        self.assertEqual(task.timing.samps_per_chan, 3)
+        self.assertEqual(task.timing.samp_timing_type, "ON_DEMAND")
+        self.assertFalse(task.running)
+        np.testing.assert_array_equal(self.vs.voltages, [4, 5])
+
+    def test_close(self):
+        with self.vs as vs:
+            vs.open(channels=[0])
+        self.assertTrue(self.daqmx.tasks[0].closed)
+        self.assertIsNone(self.vs.task)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+"""Checks rotaryStage's framed protocol over a real pyserial port.
+
+The stage talks to a SimulatedArduino through a pseudo terminal (open_pty),
+so the replies go through pyserial's readline and its timeouts like they do
+with the Arduino. Needs pyserial and os.openpty (Linux, macOS).
+
+Run from the src folder with: python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from async_instruments import AsyncStage  # noqa: E402
+from rotary_stage import MAX_REPLIES, StageError, StageTimeout, rotaryStage  # noqa: E402
+from stage_simulator import SimulatedArduino, open_pty  # noqa: E402
+
+TIME_SCALE = 0.01
+
+
+class FakeFirmware:
+    """Other end of a pseudo terminal, sending replies written by a test."""
+
+    def __init__(self):
+        import tty
+
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+
+    def read_command(self):
+        """Returns (seq, command) of the next framed command."""
+        line = b""
+        while not line.endswith(b"\n"):
+            line += os.read(self.master, 1)
+        seq, _, command = line.decode("ascii").strip().partition(" ")
+        return int(seq), command
+
+    def send(self, data):
+        os.write(self.master, data)
+
+
+@unittest.skipUnless(hasattr(os, "openpty"), "needs a pseudo terminal")
+class FramedProtocolTest(unittest.TestCase):
+    def setUp(self):
+        self.simulator = SimulatedArduino(time_scale=TIME_SCALE)
+        self.stage = rotaryStage(open_pty(self.simulator))
+
+    def tearDown(self):
+        self.stage.disconnect()
+        self.simulator.close()
+
+    def test_move_reports_steps(self):
+        self.assertEqual(self.stage.move(800), 800)
+        self.assertEqual(self.stage.move(-300), -300)
+        self.assertEqual(self.stage.position(), 500)
+        self.assertIsNotNone(self.stage.ack_latency)
+
+    def test_motion_profile(self):
+        self.assertEqual(self.stage.set_motion_profile(4000, 8000), (4000.0, 8000.0))
+        self.assertEqual(self.stage.move(8000), 8000)
+
+    def test_unknown_command_is_err(self):
+        seq = self.stage.command("Z")
+        with self.assertRaises(StageError):
+            self.stage.wait_done(seq, 0.5, "Z")
+
+    def test_move_while_moving_is_err(self):
+        seq = self.stage.start_move(8000)
+        with self.assertRaises(StageError):
+            self.stage.move(10)
+        self.assertEqual(self.stage.wait_move(seq, 8000), 8000)
+
+    def test_stop_reports_steps_made(self):
+        seq = self.stage.start_move(50000)
+        time.sleep(0.2)
+        position = self.stage.stop()
+        self.assertGreater(position, 0)
+        self.assertLess(position, 50000)
+        self.assertEqual(self.stage.wait_move(seq, 50000), position)
+
+    def test_cancelled_move_async_stops_the_stage(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(asyncio.wait_for(self.stage.move_async(50000), 0.2))
+        position = self.stage.position()
+        self.assertGreater(position, 0)
+        self.assertLess(position, 50000)
+        self.assertEqual(self.stage.move(100), 100)
+        self.assertEqual(self.stage.position(), position + 100)
+
+    def test_replies_of_unwaited_moves_are_dropped(self):
+        for _ in range(3):
+            self.stage.step_ccw(0.01)
+            time.sleep(5 * 8 / 500 * TIME_SCALE + 0.05)
+        self.stage.position()
+        self.assertEqual(self.stage.replies, {})
+
+    def test_unwaited_move_while_moving_is_rejected(self):
+        self.stage.step_ccw(1)
+        with self.assertRaises(StageError):
+            self.stage.step_ccw(1)
+        time.sleep(self.stage.move_time(800) * TIME_SCALE + 0.05)
+        self.stage.step_ccw(1)
+        time.sleep(self.stage.move_time(800) * TIME_SCALE + 0.05)
+        self.assertEqual(self.stage.position(), 1600)
+
+
+@unittest.skipUnless(hasattr(os, "openpty"), "needs a pseudo terminal")
+class ReplyFramingTest(unittest.TestCase):
+    def setUp(self):
+        self.firmware = FakeFirmware()
+        self.stage = rotaryStage(self.firmware.port)
+
+    def tearDown(self):
+        self.stage.disconnect()
+        os.close(self.firmware.master)
+
+    def reply_later(self, *parts):
+        """Acks the next command, then sends each (delay in s, part)."""
+
+        def run():
+            seq, _ = self.firmware.read_command()
+            self.firmware.send("ACK {}\r\n".format(seq).encode())
+            for delay, part in parts:
+                time.sleep(delay)
+                self.firmware.send(part.format(seq=seq).encode())
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def test_reply_split_across_polls(self):
+        # Cut off by the 50 ms slices of AsyncStage.wait_reply
+        self.reply_later((0.12, "DO"), (0.12, "NE {seq} 800\r\n"))
+        done = asyncio.run(AsyncStage(self.stage).move(800, timeout=2))
+        self.assertEqual(done, 800)
+
+    def test_reply_split_across_timeouts(self):
+        # pyserial's readline can overrun its timeout by up to the timeout
+        self.reply_later((0, "DONE {seq}"), (1.0, " 12\r\n"))
+        seq = self.stage.command("Q")
+        with self.assertRaises(StageTimeout):
+            self.stage.wait_done(seq, 0.2, "position")
+        self.assertEqual(self.stage.wait_done(seq, 2.0, "position"), "12")
+
+    def test_err_of_unwaited_move_is_raised(self):
+        self.reply_later((0.05, "ERR {seq} busy\r\n"))
+        self.stage.step_ccw(1)
+        time.sleep(0.2)
+        with self.assertRaises(StageError):
+            self.stage.step_ccw(1)
+        self.assertEqual(self.stage.unwaited, set())
+
+    def test_replies_kept_are_bounded(self):
+        lines = "".join("DONE {} 0\r\n".format(1000 + i) for i in range(2 * MAX_REPLIES))
+        self.reply_later((0, lines + "DONE {seq} 7\r\n"))
+        seq = self.stage.command("Q")
+        self.assertEqual(self.stage.wait_done(seq, 1.0, "position"), "7")
+        self.assertEqual(len(self.stage.replies), MAX_REPLIES)
+        self.assertIn(("DONE", 1000 + 2 * MAX_REPLIES - 1), self.stage.replies)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Checks the trapezoidal motion profile and the M/P/Q/X commands against
+SimulatedArduino, which follows templates/arduino/circularTrackControl.ino.
+
+Run from the src folder with: python -m pytest tests
+"""
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rotary_stage import (  # noqa: E402
+    DEFAULT_ACCELERATION,
+    MAX_SPEED_LIMIT,
+    START_SPEED,
+    move_time,
+    rotaryStage,
+)
+from stage_simulator import SimulatedArduino  # noqa: E402
+
+TIME_SCALE = 0.05
+
+
+class MoveTimeTest(unittest.TestCase):
+    def test_constant_speed_without_acceleration(self):
+        self.assertAlmostEqual(move_time(8000, START_SPEED), 8000 / START_SPEED)
+        self.assertAlmostEqual(move_time(8000, 4000, 0), 8000 / START_SPEED)
+
+    def test_trapezoid(self):
+        v, a = 4000, 8000
+        ramp_steps = (v ** 2 - START_SPEED ** 2) / (2 * a)
+        expected = 2 * (v - START_SPEED) / a + (80000 - 2 * ramp_steps) / v
+        self.assertAlmostEqual(move_time(80000, v, a), expected)
+        self.assertLess(move_time(80000, v, a), 80000 / START_SPEED)
+
+    def test_triangle_meets_trapezoid(self):
+        v, a = 4000, 8000
+        ramp_steps = (v ** 2 - START_SPEED ** 2) / (2 * a)
+        self.assertAlmostEqual(
+            move_time(2 * ramp_steps - 1e-6, v, a), move_time(2 * ramp_steps + 1e-6, v, a), places=5
+        )
+        # Short moves never reach max_speed, so a higher one doesn't help
+        self.assertAlmostEqual(move_time(100, v, a), move_time(100, MAX_SPEED_LIMIT, a))
+
+    def test_direction_does_not_matter(self):
+        self.assertEqual(move_time(-5000, 3000, 2000), move_time(5000, 3000, 2000))
+
+
+class SimulatorCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.simulator = SimulatedArduino(time_scale=TIME_SCALE)
+        self.simulator.timeout = 2.0
+
+    def send(self, line):
+        self.simulator.write((line + "\n").encode())
+
+    def reply(self):
+        return self.simulator.readline().decode("ascii").strip()
+
+    def test_move_is_acked_then_done_after_profile_time(self):
+        self.send("1 P4000,8000")
+        self.assertEqual(self.reply(), "ACK 1")
+        self.assertEqual(self.reply(), "DONE 1 4000,8000")
+        start = time.monotonic()
+        self.send("2 M-20000")
+        self.assertEqual(self.reply(), "ACK 2")
+        self.assertEqual(self.reply(), "DONE 2 -20000")
+        elapsed = (time.monotonic() - start) / TIME_SCALE
+        self.assertAlmostEqual(elapsed, move_time(20000, 4000, 8000), delta=0.4)
+
+    def test_profile_is_clamped(self):
+        self.send("1 P100000,0")
+        self.reply()
+        self.assertEqual(self.reply(), "DONE 1 {:.0f},{:.0f}".format(MAX_SPEED_LIMIT, DEFAULT_ACCELERATION))
+        self.send("2 P10,500")
+        self.reply()
+        self.assertEqual(self.reply(), "DONE 2 {:.0f},500".format(START_SPEED))
+
+    def test_position_during_and_after_move(self):
+        self.send("1 M1000")
+        self.reply()
+        time.sleep(1000 / START_SPEED / 2 * TIME_SCALE)
+        self.send("2 Q")
+        self.assertEqual(self.reply(), "ACK 2")
+        during = int(self.reply().split()[2])
+        self.assertGreater(during, 0)
+        self.assertLess(during, 1000)
+        self.assertEqual(self.reply(), "DONE 1 1000")
+        self.send("3 Q")
+        self.reply()
+        self.assertEqual(self.reply(), "DONE 3 1000")
+
+    def test_stop_ends_move_with_steps_made(self):
+        self.send("1 M5000")
+        self.reply()
+        time.sleep(1.0 * TIME_SCALE)
+        self.send("2 X")
+        self.assertEqual(self.reply(), "ACK 2")
+        done_move = self.reply().split()
+        done_stop = self.reply().split()
+        self.assertEqual(done_move[:2], ["DONE", "1"])
+        self.assertEqual(done_stop[:2], ["DONE", "2"])
+        self.assertEqual(done_move[2], done_stop[2])
+        self.assertLess(int(done_stop[2]), 5000)
+
+    def test_busy_and_unknown_commands_are_err(self):
+        self.send("1 M5000")
+        self.reply()
+        self.send("2 M10")
+        self.assertEqual(self.reply(), "ACK 2")
+        self.assertEqual(self.reply(), "ERR 2 busy")
+        self.send("3 Z")
+        self.reply()
+        self.assertEqual(self.reply(), "ERR 3 unknown command")
+
+    def test_old_style_command_runs_after_timeout(self):
+        self.simulator.write(b"20")
+        self.assertEqual(self.reply(), "20")
+        self.assertEqual(self.simulator.received, ["20"])
+
+
+class StageProfileTest(unittest.TestCase):
+    def test_stage_moves_take_profile_time(self):
+        stage = rotaryStage("SIM", arduino=SimulatedArduino(time_scale=TIME_SCALE))
+        stage.set_motion_profile(4000, 8000)
+        for steps in (80, 8000, -30000):
+            start = time.monotonic()
+            self.assertEqual(stage.move(steps), steps)
+            elapsed = (time.monotonic() - start) / TIME_SCALE
+            self.assertAlmostEqual(elapsed, stage.move_time(steps), delta=0.4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+"""Checks decoding of the VNA's FORM5 binary blocks.
+
+Run from the src folder with: python -m pytest tests
+"""
+import os
+import struct
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from vna import decode_form5  # noqa: E402
+
+
+def form5_block(values):
+    """Returns values framed like the 8720ES sends FORM5: "#A", the length
+    in bytes (2 bytes, little-endian) and little-endian float32s."""
+    payload = struct.pack("<{}f".format(len(values)), *values)
+    return b"#A" + struct.pack("<H", len(payload)) + payload
+
+
+class DecodeForm5Test(unittest.TestCase):
+    def test_pairs_per_point(self):
+        values = [1.0, -2.0, 0.5, 0.25, -1e-3, 3e4]
+        data = decode_form5(form5_block(values))
+        self.assertEqual(data.shape, (3, 2))
+        self.assertEqual(data.dtype, np.float32)
+        np.testing.assert_array_equal(data.ravel(), np.float32(values))
+
+    def test_ignores_bytes_around_the_block(self):
+        # e.g. a stray newline before the block and the EOI newline after it
+        data = decode_form5(b"\n" + form5_block([1.5, 2.5]) + b"\n")
+        np.testing.assert_array_equal(data, [[1.5, 2.5]])
+
+    def test_empty_block(self):
+        self.assertEqual(decode_form5(form5_block([])).shape, (0, 2))
+
+    def test_full_length_trace(self):
+        values = np.arange(2 * 1601, dtype=np.float32)
+        data = decode_form5(form5_block(values))
+        self.assertEqual(data.shape, (1601, 2))
+        np.testing.assert_array_equal(data[-1], [3200, 3201])
+
+    def test_no_header(self):
+        with self.assertRaises(ValueError):
+            decode_form5(b"1.0,2.0\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
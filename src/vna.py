@@ -1,6 +1,8 @@
 import pyvisa as visa
 from pyvisa.resources import MessageBasedResource
 from enum import Enum
+import os
+import struct
 import util
 import numpy as np
 
@@ -39,6 +41,30 @@ CHANNELS = {
     SParam.S22: "CHAN4",
 }
 
+# Mnemonics that select state which stays active until changed again. Writes
+# that would select the state that is already active can be skipped.
+DATA_FORMATS = ("FORM1", "FORM2", "FORM3", "FORM4", "FORM5")
+DISPLAY_FORMATS = (
+    "LOGM", "PHAS", "DELA", "SMIC", "POLA", "LINM", "SWR", "REAL", "IMAG"
+)
+# Mnemonics after which none of the tracked state can be trusted, also with
+# the "*" of IEEE 488.2 common commands (*RST)
+RESET_MNEMONICS = ("PRES", "RST")
+# Cached sweep settings and the mnemonics that change them
+SWEEP_STATE = {
+    "STAR": "start",
+    "STOP": "stop",
+    "POIN": "points",
+    "POWE": "power",
+    "IFBW": "if_bw",
+}
+
+class VNAError(Exception):
+    """Simple error exception for VNA."""
+
+    pass
+
+
 class CalType(Enum):
     """Represents a calibration type."""
 
@@ -87,6 +113,23 @@ class FreqSweepParams:
             self.start, self.stop, self.points, self.power, self.averaging, sp
         )
 
+    def as_set(self):
+        """Returns new FreqSweepParams with the values the 8720ES uses.
+
+        Frequencies and power are rounded like they are sent, and points
+        goes up to the next count in POINTS, since the instrument only
+        sweeps those.
+        """
+        points = next((p for p in POINTS if p >= self.points), POINTS_MAX)
+        return FreqSweepParams(
+            round(self.start / 1.0e9, FREQ_DECIMALS) * 1.0e9,
+            round(self.stop / 1.0e9, FREQ_DECIMALS) * 1.0e9,
+            points,
+            round(self.power, POWER_DECIMALS),
+            self.averaging,
+            self.sparams,
+        )
+
     def __str__(self):
         """Return string representation."""
         sp = " ".join([s.value for s in self.sparams])
@@ -140,6 +183,64 @@ class FreqSweepParams:
             return None
 
 
+def decode_form5(block):
+    """Decodes a FORM5 binary block into an (N, 2) numpy array.
+
+    FORM5 blocks start with "#A" and a 2 byte length, followed by pairs of
+    little-endian 32 bit floats, one pair per point. The array is a view
+    on the block, so no per-point work is done in Python.
+
+    Args:
+        block (bytes): raw bytes read from the VNA
+    """
+    begin = block.index(b"#A")
+    length = int.from_bytes(block[begin + 2 : begin + 4], byteorder="little")
+    data = np.frombuffer(block, dtype="<f4", count=length // 4, offset=begin + 4)
+    return data.reshape(-1, 2)
+
+
+def mag_phase(data, unwrap=True):
+    """Returns the log magnitude (dB) and phase (degrees) of a complex trace.
+
+    Args:
+        data (np.ndarray): complex trace, e.g. from VNA.get_complex
+        unwrap (bool): unwrap the phase instead of keeping it in -180 to 180
+    """
+    mag = 20 * np.log10(np.abs(data))
+    phase = np.angle(data)
+    if unwrap:
+        phase = np.unwrap(phase)
+    return mag, np.degrees(phase)
+
+
+def write_trace_csv(path, title, Freq, traces, fsync=False):
+    """Writes complex traces to a CSV file in the layout used by WriteData.
+
+    The file has a title line, a "Freq [GHz]," row and then a "[Mag]" and a
+    "[Phase]" row per trace. Phase is written wrapped like the PHAS display.
+
+    Args:
+        path (str): file to write
+        title (str): first line, e.g. "Angle of: 10.000"
+        Freq (list): frequencies in GHz
+        traces (dict): S-param name (e.g. "S21") to complex numpy array
+        fsync (bool): force the file to the disk before returning
+    """
+    with open(path, 'w+', newline='', encoding = 'utf-8') as myfile:
+        myfile.write(title + "\n")
+        myfile.write("Freq [GHz],")
+        myfile.write(', '.join(str(item) for item in Freq)+'\n')
+        for name, data in traces.items():
+            mag, phase = mag_phase(data, unwrap=False)
+            myfile.write(name + " [Mag],")
+            myfile.write(', '.join(str(item) for item in mag)+'\n')
+            myfile.write(name + " [Phase],")
+            myfile.write(', '.join(str(item) for item in phase)+'\n')
+        if fsync:
+            myfile.flush()
+            os.fsync(myfile.fileno())
+
+
 class VNA:
     """Interface with a GPIB instrument using the Visa library.
 
@@ -158,6 +259,18 @@ class VNA:
         self.cal_type = None
         self.cal_params = None
         self.averaging_factor = 1
+        # CalLibrary to restore calibrations from in set_sweep_params, and
+        # the key of the set restored last
+        self.cal_library = None
+        self.cal_key = None
+
+        # Command batching: setup mnemonics waiting to be sent with the next
+        # write. self.state caches instrument settings (sweep, channel,
+        # formats) so they don't have to be queried or written again.
+        self.pending = []
+        self.state = {}
+        self.writes_issued = 0
+        self.writes_elided = 0
 
         self.rm = None
         self.vna = None
@@ -169,20 +282,29 @@ class VNA:
         except:
             pass
 
-    def connect(self, address):
+    def connect(self, address, resource=None):
         """Establish a connection with the VNA.
 
+        Args:
+            address (int): GPIB address of the VNA
+            resource: already open VISA resource to use instead, e.g. a
+                vna_simulator.SimulatedVNA
+
         Returns true after successful connection.
         """
+        self.pending = []
+        self.refresh()
         if self.dummy:
             self.connected = True
         else:
             try:
-                self.rm = visa.ResourceManager()
-                self.vna = self.rm.open_resource(
-                    "GPIB1::{}::INSTR".format(address),
-                    resource_pyclass=MessageBasedResource,
-                )
+                if resource is None:
+                    self.rm = visa.ResourceManager()
+                    resource = self.rm.open_resource(
+                        "GPIB1::{}::INSTR".format(address),
+                        resource_pyclass=MessageBasedResource,
+                    )
+                self.vna = resource
                 self.vna.timeout = (
                     None  # Avoid timing out for time consuming measurements.
                 )
@@ -216,9 +338,16 @@ class VNA:
         self.connected = False
         self.cal_ok = False
         self.cal_params = None
+        self.cal_key = None
 
     def write(self, msg):
-        """Write message to VNA."""
+        """Write message to VNA.
+
+        Any queued setup mnemonics are sent in front of msg in the same write.
+        """
+        msg = self.take_pending() + msg
+        self.track_state(msg)
+        self.writes_issued += 1
         if len(msg) < 200:
             # Print out short messages for debugging
             util.dprint(msg)
@@ -229,13 +358,20 @@ class VNA:
 
     def read(self):
         """Read message from VNA."""
+        self.flush()
         if self.dummy:
             return "1"
         else:
             return self.vna.read()
 
     def query(self, msg):
-        """Query (write and read) with VNA."""
+        """Query (write and read) with VNA.
+
+        Any queued setup mnemonics are sent in front of msg in the same write.
+        """
+        msg = self.take_pending() + msg
+        self.track_state(msg)
+        self.writes_issued += 1
         if len(msg) < 200:
             util.dprint(msg)
         else:
@@ -245,6 +381,105 @@ class VNA:
         else:
             return self.vna.query(msg)
 
+    def setup(self, *mnemonics):
+        """Queues setup mnemonics to be sent with the next write.
+
+        Mnemonics that select a data format, channel or display format that is
+        already active are skipped. Queued mnemonics are joined with ";" and
+        sent in front of the next write, query or flush.
+
+        Args:
+            mnemonics (str): mnemonics without the trailing ";", e.g. "CHAN2"
+        """
+        for m in mnemonics:
+            key = self.state_key(m)
+            if key is not None and self.state.get(key) == m:
+                self.writes_elided += 1
+                continue
+            if key is not None:
+                self.state[key] = m
+            self.pending.append(m)
+
+    def take_pending(self):
+        """Returns the queued setup mnemonics as one string and clears them."""
+        if not self.pending:
+            return ""
+        # Each queued mnemonic would otherwise have been its own write
+        self.writes_elided += len(self.pending)
+        msg = "".join(m + ";" for m in self.pending)
+        self.pending = []
+        return msg
+
+    def flush(self):
+        """Sends any queued setup mnemonics in a single write."""
+        if self.pending:
+            # The write itself is counted in writes_issued, not elided
+            self.writes_elided -= 1
+            self.write("")
+
+    def state_key(self, mnemonic):
+        """Returns the key in self.state that a mnemonic selects, or None.
+
+        The display format is kept per channel, so it can only be tracked once
+        the active channel is known.
+        """
+        if mnemonic in DATA_FORMATS:
+            return "data_format"
+        if mnemonic in CHANNELS.values():
+            return "channel"
+        if mnemonic in DISPLAY_FORMATS and "channel" in self.state:
+            return "display_" + self.state["channel"]
+        return None
+
+    def track_state(self, msg):
+        """Updates the tracked instrument state from a message sent to it.
+
+        Sweep settings written directly (not through set_sweep_params or
+        set_if_bw) are dropped from the cache so they get queried again.
+        """
+        for m in msg.split(";"):
+            m = m.strip().upper()
+            if m.lstrip("*") in RESET_MNEMONICS or (m.startswith("CALI") and "?" not in m):
+                # Presets and calibrations can change anything
+                self.state = {}
+                self.cal_key = None
+                continue
+            key = self.state_key(m)
+            if key is not None:
+                self.state[key] = m
+                continue
+            for prefix, key in SWEEP_STATE.items():
+                if m.startswith(prefix) and "?" not in m:
+                    self.state.pop(key, None)
+            if m.startswith("AVER") and "?" not in m:
+                for key in [k for k in self.state if k.startswith("averaging_")]:
+                    del self.state[key]
+
+    def cached_query(self, key, msg, convert):
+        """Returns the cached setting for key, querying msg if not cached.
+
+        Args:
+            key (str): key in self.state, e.g. "start"
+            msg (str): query for the setting, e.g. "STAR?;"
+            convert (function): converts the reply to the cached value
+        """
+        if key not in self.state:
+            self.state[key] = convert(self.query(msg))
+        return self.state[key]
+
+    def refresh(self):
+        """Drops all cached instrument state so it gets queried again.
+
+        Call this after the instrument was changed from the front panel.
+        """
+        self.flush()
+        self.state = {}
+
+    def reset_write_counters(self):
+        """Resets writes_issued and writes_elided, e.g. at each angle step."""
+        self.writes_issued = 0
+        self.writes_elided = 0
+
     def display_4_channels(self):
         """Displays the 4 channels in a 2x2 grid with one slot for each.
         Assigns S11 to CHAN1, S12 to CHAN3, S21 to CHAN2, and S22 to CHAN4."""
@@ -277,10 +512,76 @@ class VNA:
                 return t
         return None
 
+    def get_calibration_data(self):
+        """Reads the calibration coefficients from the VNA.
+
+        Returns a dict of CalType to a list of big-endian float64 arrays, one
+        per OUTPCALC array, for every calibration present.
+        """
+        data = {}
+
+        # 64 bit numbers (8 bytes/number, 16 bytes per point)
+        self.write("FORM3;")
+
+        for t in CalType:
+            # Set the channel as appropriate
+            if t == CalType.CALIS221:
+                ch = CHANNELS[SParam.S22]
+            else:
+                ch = CHANNELS[SParam.S11]
+            self.write("{};".format(ch))
+
+            if self.dummy or not bool(int(self.query(t.name + "?;"))):
+                continue
+            arrays = []
+            for i in range(CAL_DATA_LENGTH[t]):
+                self.write("OUTPCALC{:02d};".format(i + 1))
+                header = self.vna.read_bytes(4)  # "#A" and a 2 byte length
+                length = struct.unpack(">H", header[2:])[0]
+                # Whole block in one read
+                arrays.append(np.frombuffer(self.vna.read_bytes(length), dtype=">f8"))
+            data[t] = arrays
+        return data
+
+    def set_calibration_data(self, cal_type, data):
+        """Loads calibration coefficients into the VNA and turns them on.
+
+        The sweep must already be set to the one the data was measured with.
+
+        Args:
+            cal_type (CalType): calibration to activate
+            data (dict): CalType to a list of arrays, as from
+                get_calibration_data
+        """
+        assert isinstance(cal_type, CalType)
+        arrays = data[cal_type]
+        if len(arrays) != CAL_DATA_LENGTH[cal_type]:
+            raise VNAError("{} needs {} arrays".format(cal_type.name, CAL_DATA_LENGTH[cal_type]))
+
+        self.write("FORM3;")
+        self.write(cal_type.name + ";")
+        for i, values in enumerate(arrays):
+            if self.dummy:
+                self.write("INPUCALC{:02d}<data>;".format(i + 1))
+                continue
+            block = np.ascontiguousarray(values, dtype=">f8")
+            self.write("INPUCALC{:02d}".format(i + 1))
+            self.vna.write_raw(b"#A" + struct.pack(">H", block.nbytes) + block.tobytes())
+            self.write(";")
+
+        self.write("SAVC;")  # Complete coefficient transfer
+        self.cal_type = cal_type
+        self.cal_ok = True
+
     def set_sweep_params(self, sweep_params):
-        """Set the FreqSweepParams for measurement."""
+        """Set the FreqSweepParams for measurement.
+
+        Points are sent as the next count the instrument allows, see
+        FreqSweepParams.as_set.
+        """
         assert isinstance(sweep_params, FreqSweepParams)
         # self.measurement_params = sweep_params
+        sweep_params = sweep_params.as_set()
         self.write(
             "STAR {a:.{b}f}GHz;".format(a=sweep_params.start / 1.0e9, b=FREQ_DECIMALS)
         )
@@ -291,12 +592,24 @@ class VNA:
         self.write("POWE {a:.{b}f};".format(a=sweep_params.power, b=POWER_DECIMALS))
         self.averaging_factor = sweep_params.averaging
 
+        if self.cal_library is not None:
+            self.cal_library.restore(self, sweep_params)
+
+        # Cache the values as they were sent to the VNA
+        self.state["start"] = sweep_params.start
+        self.state["stop"] = sweep_params.stop
+        self.state["points"] = sweep_params.points
+        self.state["power"] = sweep_params.power
+
     def get_sweep_params(self):
-        """Get the FreqSweepParams for measurement."""
-        start = float(self.query("STAR?;"))
-        stop = float(self.query("STOP?;"))
-        points = int(float(self.query("POIN?;")))
-        power = float(self.query("POWE?;"))
+        """Get the FreqSweepParams for measurement.
+
+        Settings are served from the state cache when they are known.
+        """
+        start = self.cached_query("start", "STAR?;", float)
+        stop = self.cached_query("stop", "STOP?;", float)
+        points = self.cached_query("points", "POIN?;", lambda x: int(float(x)))
+        power = self.cached_query("power", "POWE?;", float)
 
         if self.dummy and isinstance(self.cal_params, FreqSweepParams):
             return self.cal_params
@@ -304,23 +617,36 @@ class VNA:
         return FreqSweepParams(start, stop, points, power, self.averaging_factor, [])
 
     def sweep(self):
-        """Triggers a sweep (with averging if selected)."""
-        self.write("CONT;")
+        """Triggers a sweep (with averging if selected).
+
+        Averaging is only set up on channels where the cached averaging
+        differs from averaging_factor.
+        """
+        self.setup("CONT")
+        changed = []
         for i in ("CHAN1", "CHAN2", "CHAN3", "CHAN4"):
-            self.write(i + ";AUTO;")
+            self.setup(i, "AUTO")
+            if self.state.get("averaging_" + i) == self.averaging_factor:
+                continue
+            changed.append(i)
             if self.averaging_factor < 2:
-                self.write("AVEROOFF;")
+                self.setup("AVEROOFF")
             else:
-                self.write("AVERFACT{};".format(self.averaging_factor))
-                self.write("AVEROON;")
+                self.setup("AVERFACT{}".format(self.averaging_factor), "AVEROON")
 
-        if not self.dummy:
+        if self.dummy:
+            self.flush()
+        else:
             # self.vna.query_ascii_values("OPC?;SING;")
             if self.averaging_factor < 2:
                 self.query("OPC?;SING;")
             else:
                 self.query("OPC?;NUMG{};".format(self.averaging_factor))
 
+        # Only cache once the AVER mnemonics are written, see track_state
+        for i in changed:
+            self.state["averaging_" + i] = self.averaging_factor
+
 
     def get_freq(self):
         """Returns a numpy array with the values of frequency
@@ -350,22 +676,15 @@ class VNA:
         Args:
             chan (str): String specifying the channel to get the values from
         """
-        self.write("FORM5;")  # Use binary format to output data
-        self.write(chan + ";")  # Select channel
-        self.write("LOGM;")  # Show logm values
-        res = []
+        # Use binary format to output data, select channel and show logm values
+        self.setup("FORM5", chan, "LOGM")
 
         if self.dummy:
+            self.flush()
             return np.empty(0)
 
-        aux = self.vna.query_binary_values(
-            "OUTPFORM;", container=tuple, header_fmt="hp"
-        )  # Ask for the values from channel and format them as tuple
-        for i in range(
-            0, len(aux), 2
-        ):  # Only get the first value of every data pair because the other is zero
-            res.append(aux[i])
-        return np.asarray(res)
+        # Only keep the first value of every data pair because the other is zero
+        return self.query_form5("OUTPFORM;")[:, 0].astype(np.float64)
 
     def get_phase(self, chan="CHAN1"):
         """Returns a numpy array with the phase values
@@ -374,72 +693,109 @@ class VNA:
         Args:
             chan (str): String specifying the channel to get the values from
         """
-        self.write("FORM5;")  # Use binary format to output data
-        self.write(chan + ";")
-        self.write("PHAS;")
-        res = []
+        # Use binary format to output data, select channel and show phase
+        self.setup("FORM5", chan, "PHAS")
 
         if self.dummy:
+            self.flush()
             return np.empty(0)
 
-        aux = self.vna.query_binary_values(
-            "OUTPFORM;", container=tuple, header_fmt="hp"
-        )  # Ask for the values from channel and format them as tuple
-        for i in range(
-            0, len(aux), 2
-        ):  # Only get the first value of every data pair because the other is zero
-            res.append(aux[i])
-        return np.asarray(res)
+        # Only keep the first value of every data pair because the other is zero
+        return self.query_form5("OUTPFORM;")[:, 0].astype(np.float64)
+
+    def get_complex(self, chan="CHAN1"):
+        """Returns a complex numpy array with the raw trace on the channel
+        specified.
+
+        The real/imaginary data is transferred once with OUTPDATA, so the
+        display format does not need to be switched between LOGM and PHAS.
+        Use mag_phase to get the magnitude and phase from it.
+
+        Args:
+            chan (str): String specifying the channel to get the values from
+        """
+        self.setup("FORM5", chan)  # Use binary format and select channel
+
+        if self.dummy:
+            self.flush()
+            return np.empty(0, dtype=np.complex128)
+
+        data = self.query_form5("OUTPDATA;").astype(np.float64)
+        return data[:, 0] + 1j * data[:, 1]
+
+    def get_raw_sparams(self):
+        """Returns the raw (uncorrected) S11, S21, S12 and S22 of the last
+        sweep as complex numpy arrays, for error_correction.
+
+        Needs the full 2-port calibration on, which measures all four.
+        """
+        self.setup("FORM5")
+        raw = {}
+        for i, name in enumerate(("S11", "S21", "S12", "S22")):
+            if self.dummy:
+                self.flush()
+                raw[name] = np.empty(0, dtype=np.complex128)
+                continue
+            data = self.query_form5("OUTPRAW{};".format(i + 1)).astype(np.float64)
+            raw[name] = data[:, 0] + 1j * data[:, 1]
+        return raw
+
+    def query_form5(self, msg):
+        """Sends an output command and decodes the FORM5 block it returns.
+
+        Returns an (N, 2) float32 array, see decode_form5.
+        """
+        self.write(msg)
+        return decode_form5(self.vna.read_raw())
     
     def set_if_bw(self, Freq):
         if Freq >= IF_BW_FREQ_MIN and Freq <= IF_BW_FREQ_MAX:
             self.write("IFBW{}HZ;".format(Freq))
+            self.state["if_bw"] = Freq
             
     def get_if_bw(self):
-        return self.query("IFBW?;")
+        """Returns the IF bandwidth in Hz as an int."""
+        return self.cached_query("if_bw", "IFBW?;", lambda x: int(float(x)))
     
-    def WriteData(self, filepath, Angle, Freq):
+    def WriteData(self, filepath, Angle, Freq, writer=None):
+        """Writes S12 and S21 to filepath + Angle + ".csv".
+
+        With a BackgroundWriter the traces are only read here and the file is
+        written from the writer's thread.
+        """
         Angle = f'{float(Angle):.3f}'
         print("Writing Data Angle: " + Angle + " Deg")
         path = filepath + Angle + ".csv";
-        # S11Mag = self.get_mag("CHAN1");
-        S12Mag = self.get_mag("CHAN2");
-        S21Mag = self.get_mag("CHAN3");
-        # S22Mag = self.get_mag("CHAN4");
-        # S11Phase = self.get_phase("CHAN1");
-        S12Phase = self.get_phase("CHAN2");
-        S21Phase = self.get_phase("CHAN3");
-        # S22Phase = self.get_phase("CHAN4");
-        with open(path, 'w+', newline='', encoding = 'utf-8') as myfile:
-            myfile.write("Angle of: " + Angle + "\n")
-            myfile.write("Freq [GHz],")
-            myfile.write(', '.join(str(item) for item in Freq)+'\n')
-            # myfile.write("S11 [Mag],")
-            # myfile.write(', '.join(str(item) for item in S11Mag)+'\n')
-            # myfile.write("S11 [Phase],")
-            # myfile.write(', '.join(str(item) for item in S11Phase)+'\n')
+        traces = {
+            # "S11": self.get_complex("CHAN1"),
             ########## 2/5/2023 -- Only extracting S12 to improve speed of 
-            myfile.write("S12 [Mag],")
-            myfile.write(', '.join(str(item) for item in S12Mag)+'\n')
-            myfile.write("S12 [Phase],")
-            myfile.write(', '.join(str(item) for item in S12Phase)+'\n')
-            myfile.write("S21 [Mag],")
-            myfile.write(', '.join(str(item) for item in S21Mag)+'\n')
-            myfile.write("S21 [Phase],")
-            myfile.write(', '.join(str(item) for item in S21Phase)+'\n')
-            # myfile.write("S22 [Mag],")
-            # myfile.write(', '.join(str(item) for item in S22Mag)+'\n')
-            # myfile.write("S22 [Phase],")
-            # myfile.write(', '.join(str(item) for item in S22Phase)+'\n')
+            "S12": self.get_complex("CHAN2"),
+            "S21": self.get_complex("CHAN3"),
+            # "S22": self.get_complex("CHAN4"),
+        }
+        if writer is None:
+            write_trace_csv(path, "Angle of: " + Angle, Freq, traces)
+        else:
+            writer.write_csv(path, "Angle of: " + Angle, Freq, traces)
     
+    def StoreData(self, store, Angle, writer=None):
+        """Like WriteData, but appends the traces to a MeasurementStore.
+
+        The traces stored are the store's sparams, read from CHANNELS.
+        """
+        print("Storing Data Angle: {:.3f} Deg".format(float(Angle)))
+        traces = {s: self.get_complex(CHANNELS[SParam(s)]) for s in store.sparams}
+        if writer is None:
+            store.append(float(Angle), traces)
+        else:
+            writer.append(store, Angle, traces)
+
 #####TEMPORARY#####
     def WriteData_singlePoint(self, filepath, name, Freq):
         print("Writing Data for point: " + name + " Deg")
         path = filepath + name + ".csv";
-        S12Mag = self.get_mag("CHAN2");
-        S21Mag = self.get_mag("CHAN3");
-        S12Phase = self.get_phase("CHAN2");
-        S21Phase = self.get_phase("CHAN3");
+        S12Mag, S12Phase = mag_phase(self.get_complex("CHAN2"), unwrap=False)
+        S21Mag, S21Phase = mag_phase(self.get_complex("CHAN3"), unwrap=False)
         with open(path, 'w+', newline='', encoding = 'utf-8') as myfile:
             myfile.write("point of: " + name + "\n")
             myfile.write("Freq [GHz],")
@@ -459,20 +815,24 @@ class VNA:
         path = filepath + Angle + ".csv";
         
         if 's11' in Channel:
-            S11Mag = self.get_mag("CHAN1");
-            S11Phase = self.get_phase("CHAN1");
+            S11Mag, S11Phase = mag_phase(
+                self.get_complex("CHAN1"), unwrap=False
+            )
         
         if 's12' in Channel:
-            S12Mag = self.get_mag("CHAN2");        
-            S12Phase = self.get_phase("CHAN2");
+            S12Mag, S12Phase = mag_phase(
+                self.get_complex("CHAN2"), unwrap=False
+            )
         
         if 's22' in Channel:
-            S21Mag = self.get_mag("CHAN3");        
-            S21Phase = self.get_phase("CHAN3");
+            S21Mag, S21Phase = mag_phase(
+                self.get_complex("CHAN3"), unwrap=False
+            )
         
         if 's21' in Channel:
-            S22Mag = self.get_mag("CHAN4");        
-            S22Phase = self.get_phase("CHAN4");
+            S22Mag, S22Phase = mag_phase(
+                self.get_complex("CHAN4"), unwrap=False
+            )
 
         with open(path, 'w+', newline='', encoding = 'utf-8') as myfile:
             myfile.write("Angle of: " + Angle + "\n")
@@ -1,4 +1,45 @@
-int Index;
+// Commands are lines "<seq> <command>\n", where seq is a number chosen by the
+// host that is sent back in the replies:
+//   ACK <seq>             as soon as the line is parsed
+//   DONE <seq> <result>   once the command is finished
+//   ERR <seq> <reason>    if the command can't be run
+//
+// Commands:
+//   M<steps>                       relative move, DONE has the step count
+//   P<max speed>,<acceleration>    set the motion profile (steps/s, steps/s^2),
+//                                  DONE has the profile that is used
+//   Q                              DONE has the position in steps
+//   X                              stop (without ramping down), DONE has the
+//                                  position in steps
+//
+// Characters without a newline that are followed by 1 s of silence are taken
+// as an old style command: a bare step count, printed back when the move is
+// done.
+//
+// Moves follow a trapezoidal profile: they start at START_SPEED, accelerate
+// up to maxSpeed and decelerate back to START_SPEED before the last step.
+// With maxSpeed = START_SPEED the stage runs at the old constant 500 steps/s.
+// Steps are made from loop() so commands are parsed while moving.
+
+#define START_SPEED 500.0     // steps/s, the old fixed 2 ms step period
+#define MAX_SPEED_LIMIT 4000.0
+#define STEP_PULSE_US 20      // width of the high step pulse
+#define LEGACY_TIMEOUT_MS 1000
+#define MAX_LINE 32
+
+float maxSpeed = START_SPEED;   // steps/s
+float acceleration = 2000.0;    // steps/s^2
+
+char line[MAX_LINE + 1];
+int lineLength = 0;
+unsigned long lastCharTime;
+
+long position = 0;          // in steps
+long moveSteps = 0;         // signed size of the current move
+long moveIndex = 0;         // steps done in the current move
+long moveSeq = -1;          // seq of the current move, -1 for old style
+bool moving = false;
+unsigned long nextStep;
 
 void setup()
 {
@@ -12,47 +53,163 @@ digitalWrite(4,LOW);
 
 void loop()
 {
-  // put your main code here, to run repeatedly:
-  if (Serial.available() > 0) {
-    // read the incoming byte:
-    // say what you got:
-    String DiffAngleSTR = Serial.readString();
-    int NumberofSteps = DiffAngleSTR.toInt();
-    if(NumberofSteps > 0 ){
-      //Serial.println("Moving Positive");
-      PositiveDirection(NumberofSteps);
-      Serial.println(NumberofSteps);
+  ReadSerial();
+  if (moving) {
+    StepIfDue();
+  }
+}
+
+// Collects characters into line and runs it when it is complete
+void ReadSerial() {
+  while (Serial.available() > 0) {
+    char c = Serial.read();
+    lastCharTime = millis();
+    if (c == '\n' || c == '\r') {
+      if (lineLength > 0) {
+        line[lineLength] = '\0';
+        RunLine();
+        lineLength = 0;
+      }
+    } else if (lineLength < MAX_LINE) {
+      line[lineLength++] = c;
     }
-    if(NumberofSteps < 0 ){
-     //Serial.println("Moving Negative");
-      NegativeDirection(abs(NumberofSteps));
-     
-     Serial.println(NumberofSteps);
+  }
+
+  if (lineLength > 0 && millis() - lastCharTime >= LEGACY_TIMEOUT_MS) {
+    // Old style command, a step count without a newline
+    line[lineLength] = '\0';
+    lineLength = 0;
+    long NumberofSteps = atol(line);
+    if (NumberofSteps != 0 && !moving) {
+      StartMove(-1, NumberofSteps);
     }
   }
 }
 
-void PositiveDirection(int NumSteps) {
-digitalWrite(3,LOW);
+// Parses "<seq> <command>" and runs the command
+void RunLine() {
+  char *command;
+  long seq = strtol(line, &command, 10);
+  if (command == line || *command != ' ') {
+    Serial.println("ERR -1 bad frame");
+    return;
+  }
+  command++;
 
-for(Index = 0; Index < NumSteps; Index++)
-{
-  digitalWrite(2,HIGH);
-  delayMicroseconds(1000);
-  digitalWrite(2,LOW);
-  delayMicroseconds(1000);
+  Serial.print("ACK ");
+  Serial.println(seq);
+
+  switch (command[0]) {
+    case 'M':
+      if (moving) {
+        Reply("ERR ", seq, "busy");
+      } else {
+        long steps = atol(command + 1);
+        if (steps == 0) {
+          Reply("DONE ", seq, "0");
+        } else {
+          StartMove(seq, steps);
+        }
+      }
+      break;
+    case 'P':
+      if (moving) {
+        Reply("ERR ", seq, "busy");
+      } else {
+        SetProfile(command + 1);
+        Serial.print("DONE ");
+        Serial.print(seq);
+        Serial.print(" ");
+        Serial.print(maxSpeed, 0);
+        Serial.print(",");
+        Serial.println(acceleration, 0);
+      }
+      break;
+    case 'Q':
+      ReplyNumber("DONE ", seq, position);
+      break;
+    case 'X':
+      if (moving) {
+        moving = false;
+        ReportMoveDone();
+      }
+      ReplyNumber("DONE ", seq, position);
+      break;
+    default:
+      Reply("ERR ", seq, "unknown command");
+  }
 }
 
+void Reply(const char *kind, long seq, const char *msg) {
+  Serial.print(kind);
+  Serial.print(seq);
+  Serial.print(" ");
+  Serial.println(msg);
 }
 
-void NegativeDirection(int NumSteps) {
-digitalWrite(3,HIGH);
+void ReplyNumber(const char *kind, long seq, long value) {
+  Serial.print(kind);
+  Serial.print(seq);
+  Serial.print(" ");
+  Serial.println(value);
+}
+
+// Parses "<max speed>,<acceleration>"
+void SetProfile(char *args) {
+  char *rest;
+  float newSpeed = strtod(args, &rest);
+  maxSpeed = constrain(newSpeed, START_SPEED, MAX_SPEED_LIMIT);
+  if (*rest == ',') {
+    float newAcceleration = strtod(rest + 1, NULL);
+    if (newAcceleration > 0) {
+      acceleration = newAcceleration;
+    }
+  }
+}
+
+void StartMove(long seq, long steps) {
+  digitalWrite(3, steps > 0 ? LOW : HIGH);
+  moveSeq = seq;
+  moveSteps = steps;
+  moveIndex = 0;
+  moving = true;
+  nextStep = micros();
+}
+
+// Makes the next step of the current move once its time has come
+void StepIfDue() {
+  if ((long)(micros() - nextStep) < 0) {
+    return;
+  }
+  long total = abs(moveSteps);
+  if (moveIndex >= total) {
+    // The last step period is over
+    moving = false;
+    ReportMoveDone();
+    return;
+  }
+
+  // Speed is limited by the distance to accelerate from the start and to
+  // decelerate before the end
+  long ramp = min(moveIndex, total - 1 - moveIndex);
+  float speed = sqrt(START_SPEED * START_SPEED + 2.0 * acceleration * ramp);
+  if (speed > maxSpeed) {
+    speed = maxSpeed;
+  }
 
-for(Index = 0; Index < NumSteps; Index++)
-{
   digitalWrite(2,HIGH);
-  delayMicroseconds(1000);
+  delayMicroseconds(STEP_PULSE_US);
   digitalWrite(2,LOW);
-  delayMicroseconds(1000);
+  moveIndex++;
+  position += moveSteps > 0 ? 1 : -1;
+  nextStep += (unsigned long)(1000000.0 / speed);
 }
+
+void ReportMoveDone() {
+  long done = moveSteps > 0 ? moveIndex : -moveIndex;
+  if (moveSeq < 0) {
+    Serial.println(done);
+  } else {
+    ReplyNumber("DONE ", moveSeq, done);
+  }
 }
@@ -367,11 +367,9 @@ class VNA:
                     if not self.dummy:
                         header = self.vna.read_bytes(4)  # 4-byte header
                         # big-endian, 2 bytes
-                        values = int(struct.unpack(">h", header[2:])[0] / 8)
-                        d = []
-
-                        for i in range(values):
-                            d.append(self.vna.read_bytes(8))
+                        length = struct.unpack(">H", header[2:])[0]
+                        # Whole block in one read, big-endian float64
+                        d = np.frombuffer(self.vna.read_bytes(length), dtype=">f8")
                     else:
                         d = (1, 2, 3)
                     data2.append(d)
@@ -398,7 +396,11 @@ class VNA:
                     self.write("INPUCALC{:02d}<data>;".format(i + 1))
                 else:
                     self.write("INPUCALC{:02d}".format(i + 1))
-                    msg = b"#A" + struct.pack(">h", len(data) * 8) + b"".join(data)
+                    if len(data) and isinstance(data[0], bytes):
+                        # Saved as a list of 8-byte values by older versions
+                        data = np.frombuffer(b"".join(data), dtype=">f8")
+                    block = np.ascontiguousarray(data, dtype=">f8")
+                    msg = b"#A" + struct.pack(">H", block.nbytes) + block.tobytes()
                     self.vna.write_raw(msg)
                     self.write(";")
 